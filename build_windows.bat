@@ -85,12 +85,31 @@ if errorlevel 1 (
     echo Continuing with build...
 )
 
+REM Install RDKit (optional - without it structure searches go to PubChem)
+echo.
+echo Installing RDKit (optional, enables offline structure search)...
+pip install rdkit>=2023.9.1 2>nul
+if errorlevel 1 (
+    echo WARNING: RDKit installation failed.
+    echo The app will work but structure searches will use PubChem.
+    echo Continuing with build...
+)
+
 REM Install PyInstaller
 pip install pyinstaller>=6.0.0
 
 echo.
 echo Dependencies installed.
 
+REM Download the GHS hazard pictograms to bundle (optional - the app
+REM falls back to fetching them from PubChem on first use)
+if not exist "static\ghs" mkdir "static\ghs"
+for /L %%i in (1,1,9) do (
+    if not exist "static\ghs\GHS0%%i.svg" (
+        curl -s -f -o "static\ghs\GHS0%%i.svg" "https://pubchem.ncbi.nlm.nih.gov/images/ghs/GHS0%%i.svg" || echo WARNING: Could not download GHS0%%i.svg
+    )
+)
+
 echo.
 echo Step 3/4: Building executable with PyInstaller...
 echo ------------------------------------------
@@ -5,6 +5,8 @@ PyInstaller spec file for Chemical Extractor.
 This creates a one-folder bundle that includes:
 - The Flask web app and all dependencies
 - The static pubchem_dump_cid_to_cas.tsv lookup file (~87MB)
+- The GHS hazard pictogram SVGs (static/ghs/)
+- The page stylesheets and scripts (static/css/, static/js/)
 
 The 'data/' directory is NOT included - it contains user-specific data
 and will be auto-created when the user first runs the app.
@@ -24,8 +26,17 @@ datas = [
     # Include the PubChem dump file (CAS->CID lookup table)
     # This is a ~28MB gzipped file required for offline CAS lookups
     (str(SPEC_DIR / 'pubchem_dump_cid_to_cas.tsv.gz'), '.'),
+
+    # Page CSS / JS, served with fingerprinted URLs
+    (str(SPEC_DIR / 'static' / 'css'), 'static/css'),
+    (str(SPEC_DIR / 'static' / 'js'), 'static/js'),
 ]
 
+# GHS hazard pictograms (downloaded by the build workflow / build_windows.bat).
+# If missing, the app fetches them from PubChem once and caches them in data/.
+if (SPEC_DIR / 'static' / 'ghs').is_dir():
+    datas.append((str(SPEC_DIR / 'static' / 'ghs'), 'static/ghs'))
+
 # Hidden imports that PyInstaller might miss
 hidden_imports = [
     # Snappy decompression (for Firefox localStorage)
@@ -89,6 +100,15 @@ hidden_imports = [
     # Progress bars
     'tqdm',
 
+    # Offline structure search (optional - imported lazily, skipped if not installed)
+    'rdkit',
+    'rdkit.Chem',
+    'rdkit.Chem.rdFingerprintGenerator',
+    'rdkit.RDLogger',
+
+    # Brotli-compressed static assets (optional - falls back to gzip)
+    'brotli',
+
     # Standard library that might need explicit inclusion
     'sqlite3',
     'hashlib',
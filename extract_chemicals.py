@@ -8,6 +8,9 @@ looks up CAS numbers in PubChem, and opens a browser search.
 
 import argparse
 import asyncio
+import base64
+import copy
+import gzip
 import hashlib
 import html
 import json
@@ -18,9 +21,12 @@ import shutil
 import sqlite3
 import sys
 import tempfile
+import threading
 import time
 import uuid
 import webbrowser
+import zlib
+from array import array
 from datetime import datetime
 from pathlib import Path
 from urllib.parse import quote
@@ -34,6 +40,7 @@ if sys.stdout is None:
     sys.stderr = _log_file
 
 import aiohttp
+import numpy as np
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
@@ -62,6 +69,16 @@ PUBCHEM_SEARCH_URL = "https://pubchem.ncbi.nlm.nih.gov/#query="
 CAS_PATTERN = re.compile(r"^\d{1,7}-\d{2}-\d$")
 RATE_LIMIT_DELAY = 0.25  # 4 requests per second (under PubChem's 5/sec limit)
 MAX_URL_LENGTH = 8000  # Safe browser URL limit
+CID_SET_CACHE_MAX_BYTES = 200 * 1024 * 1024  # LRU limit for data/cid_sets/
+CID_SET_TOUCH_INTERVAL = 3600  # seconds; min gap between last_used updates of a cached set
+PUBCHEM_CACHE_KEY_TTL = 11 * 3600  # seconds; PubChem drops cache keys after ~12 hours
+LOCAL_SEARCH_PREFIX = "local:"  # cache keys of searches resolved locally, never uploaded
+
+# Compound info freshness (background refresh scheduler in the web UI)
+COMPOUND_INFO_MAX_AGE_DAYS = 30  # entries older than this are eligible for refresh
+COMPOUND_REFRESH_BUDGET = 120  # max PubChem requests per refresh cycle
+COMPOUND_REFRESH_INTERVAL = 15 * 60  # seconds between refresh cycles
+COMPOUND_REFRESH_RETRY_DAYS = 1  # wait this long before retrying a failed refresh
 
 # ============================================================================
 # Path Configuration (handles both regular Python and PyInstaller bundles)
@@ -135,6 +152,15 @@ FILTER_RESULTS_FILE = DATA_DIR / "filter_results.json"
 COMPOUND_INFO_FILE = DATA_DIR / "compound_info.json"
 APP_SEARCHES_FILE = DATA_DIR / "app_searches.json"
 STALE_SEARCHES_FILE = DATA_DIR / "stale_searches.json"
+INVENTORY_KEY_FILE = DATA_DIR / "inventory_cache_key.json"
+CID_SETS_DIR = DATA_DIR / "cid_sets"  # downloaded PubChem search results, see get_search_cids()
+IMAGE_CACHE_DIR = DATA_DIR / "images"  # structure PNGs + fetched GHS SVGs
+
+# GHS pictograms (bundled SVGs, populated at build time; see build-windows.yml)
+GHS_CODES = [f"GHS0{i}" for i in range(1, 10)]
+GHS_BUNDLE_DIR = BUNDLE_DIR / "static" / "ghs"
+PUBCHEM_IMAGE_URL = "https://pubchem.ncbi.nlm.nih.gov/image/imgsrv.fcgi"
+PUBCHEM_GHS_URL = "https://pubchem.ncbi.nlm.nih.gov/images/ghs/{code}.svg"
 
 # Legacy cache configuration (for CAS→CID API lookups)
 CACHE_DIR = Path.home() / ".cache" / "cas_to_cid"
@@ -544,6 +570,117 @@ def combine_pubchem_cache_keys(
     return None
 
 
+def _as_cid_array(cids) -> np.ndarray:
+    """Convert a CID collection (ints, strings or an array) to an int64 array."""
+    if isinstance(cids, np.ndarray):
+        return cids.astype(np.int64, copy=False)
+    return np.fromiter((int(c) for c in cids), dtype=np.int64)
+
+
+def cid_array(cids) -> np.ndarray:
+    """
+    Build a CID set: a sorted, de-duplicated int32 array.
+
+    This is the in-memory format for filter results, the inventory and
+    downloaded searches; set operations on it are vectorized (see
+    combine_cid_sets) and it serializes compactly (see encode_cid_array).
+    """
+    return np.unique(_as_cid_array(cids)).astype(np.int32)
+
+
+def pack_cid_array(cids: np.ndarray) -> bytes:
+    """
+    Serialize a sorted CID array as zlib(delta-encoded uint32).
+
+    Gaps between consecutive sorted CIDs are small, so this is typically a
+    few bytes per CID instead of ~9 for a JSON list.
+    """
+    arr = np.asarray(cids, dtype=np.int64)
+    deltas = np.diff(arr, prepend=0).astype("<u4")
+    return zlib.compress(deltas.tobytes(), 6)
+
+
+def unpack_cid_array(data: bytes) -> np.ndarray:
+    """Inverse of pack_cid_array()."""
+    if not data:
+        return np.empty(0, dtype=np.int32)
+    deltas = np.frombuffer(zlib.decompress(data), dtype="<u4")
+    return np.cumsum(deltas, dtype=np.int64).astype(np.int32)
+
+
+def encode_cid_array(cids: np.ndarray) -> str:
+    """pack_cid_array() as base64 text, for storing CID sets inside JSON."""
+    return base64.b64encode(pack_cid_array(cids)).decode("ascii")
+
+
+def decode_cid_array(data: str) -> np.ndarray:
+    """Inverse of encode_cid_array()."""
+    if not data:
+        return np.empty(0, dtype=np.int32)
+    return unpack_cid_array(base64.b64decode(data))
+
+
+def combine_cid_sets(our_cids, their_cids, operation: str = "AND") -> np.ndarray:
+    """
+    Combine two CID collections locally, like list_refinement.cgi would.
+
+    Args:
+        our_cids: Inventory CIDs (ints, strings or an array)
+        their_cids: CIDs of the other search (ints, strings or an array)
+        operation: AND (both), OR (either), NOT (ours but not theirs)
+
+    Returns:
+        CID set (sorted int32 array) of the result
+    """
+    ours = cid_array(our_cids)
+    theirs = cid_array(their_cids)
+    operation = operation.upper()
+    if operation == "AND":
+        return np.intersect1d(ours, theirs, assume_unique=True)
+    if operation == "OR":
+        return np.union1d(ours, theirs)
+    if operation == "NOT":
+        return np.setdiff1d(ours, theirs, assume_unique=True)
+    raise ValueError(f"Invalid operation '{operation}'. Use AND, OR, or NOT.")
+
+
+# ---------------------------------------------------------------------------
+# Shared PubChem request budget
+# ---------------------------------------------------------------------------
+_pubchem_slot_lock = threading.Lock()
+_pubchem_next_slot = 0.0  # time.monotonic() of the next free request slot
+
+
+def reserve_pubchem_slot() -> float:
+    """
+    Reserve the next PubChem request slot for this process.
+
+    Slots are RATE_LIMIT_DELAY apart, shared by every thread and event loop,
+    so concurrent workers together stay under PubChem's limit. The caller
+    must wait the returned number of seconds before sending its request.
+    """
+    global _pubchem_next_slot
+    with _pubchem_slot_lock:
+        now = time.monotonic()
+        slot = max(now, _pubchem_next_slot)
+        _pubchem_next_slot = slot + RATE_LIMIT_DELAY
+    return slot - now
+
+
+def wait_for_pubchem_slot() -> None:
+    """Block until a reserved PubChem request slot comes up."""
+    delay = reserve_pubchem_slot()
+    if delay > 0:
+        time.sleep(delay)
+
+
+async def wait_for_pubchem_slot_async() -> None:
+    """Async variant of wait_for_pubchem_slot()."""
+    delay = reserve_pubchem_slot()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
 def load_pubchem_dump() -> dict[str, int]:
     """Load the PubChem CAS→CID mapping from the gzipped TSV dump file."""
     import gzip
@@ -603,6 +740,81 @@ def compute_file_hash(file_path: Path) -> str:
     return f"sha256:{sha256.hexdigest()}"
 
 
+# ---------------------------------------------------------------------------
+# In-process JSON store
+# ---------------------------------------------------------------------------
+#
+# The data files below are read on nearly every request. read_json_file()
+# parses each file once per process and hands out the parsed object until
+# the file changes: write_json_file() drops the cached copy, and a change of
+# mtime or size on disk (the CLI, another app instance) is noticed on the
+# next read. The file is stat()ed at most once per JSON_STAT_INTERVAL.
+#
+# Cached objects are shared between requests and threads, so callers must
+# not modify what they get back. Code that edits a file works on a copy
+# (copy.deepcopy, or a new dict/list) and saves it with write_json_file().
+
+JSON_STAT_INTERVAL = 1.0  # seconds
+
+_json_store: dict[Path, dict] = {}  # path -> {"data", "stat", "checked", "version"}
+_json_store_lock = threading.Lock()
+_json_store_generation = 0
+
+
+def _json_file_stat(path: Path) -> tuple[int, int] | None:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _json_store_entry(path: Path) -> dict:
+    """The cached entry of a JSON file, (re)loaded if the file changed."""
+    global _json_store_generation
+    now = time.monotonic()
+    with _json_store_lock:
+        entry = _json_store.get(path)
+        if entry is not None and now - entry["checked"] < JSON_STAT_INTERVAL:
+            return entry
+
+    stat = _json_file_stat(path)
+    with _json_store_lock:
+        entry = _json_store.get(path)
+        if entry is not None and entry["stat"] == stat:
+            entry["checked"] = now
+            return entry
+
+    data = None
+    if stat is not None:
+        try:
+            data = json.loads(path.read_bytes())
+        except (json.JSONDecodeError, OSError, UnicodeDecodeError):
+            data = None
+    with _json_store_lock:
+        _json_store_generation += 1
+        entry = {"data": data, "stat": stat, "checked": now, "version": _json_store_generation}
+        _json_store[path] = entry
+    return entry
+
+
+def read_json_file(path: Path):
+    """Parsed contents of a JSON data file (shared, do not modify), or None if missing/invalid."""
+    return _json_store_entry(path)["data"]
+
+
+def json_file_version(path: Path) -> int:
+    """A number that changes whenever the cached contents of *path* change."""
+    return _json_store_entry(path)["version"]
+
+
+def write_json_file(path: Path, data, default=None) -> None:
+    """Write a JSON data file atomically and invalidate its cached copy."""
+    _write_atomic(path, json.dumps(data, indent=2, default=default).encode())
+    with _json_store_lock:
+        _json_store.pop(path, None)
+
+
 def load_cid_cache() -> dict | None:
     """
     Load the CID cache from disk.
@@ -611,12 +823,7 @@ def load_cid_cache() -> dict | None:
         Cache dict with source_html, source_hash, created, stats, results
         or None if cache doesn't exist or is invalid
     """
-    if not CID_CACHE_FILE.exists():
-        return None
-    try:
-        return json.loads(CID_CACHE_FILE.read_text())
-    except (json.JSONDecodeError, OSError):
-        return None
+    return read_json_file(CID_CACHE_FILE)
 
 
 def save_cid_cache(
@@ -650,7 +857,7 @@ def save_cid_cache(
         "results": results,
     }
 
-    CID_CACHE_FILE.write_text(json.dumps(cache_data, indent=2))
+    write_json_file(CID_CACHE_FILE, cache_data)
     print(f"Saved CID cache: {found} found, {not_found} not found")
 
 
@@ -1313,6 +1520,73 @@ def upload_cids_to_pubchem_cache(cids: list[str]) -> str | None:
     return None
 
 
+_inventory_key_lock = threading.Lock()
+
+
+def cid_set_hash(cids) -> str:
+    """Stable hash of a set of CIDs (order and duplicates don't matter)."""
+    canonical = ",".join(str(c) for c in sorted({int(c) for c in cids}))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _load_inventory_key() -> dict | None:
+    if not INVENTORY_KEY_FILE.exists():
+        return None
+    try:
+        return json.loads(INVENTORY_KEY_FILE.read_text())
+    except (json.JSONDecodeError, OSError):
+        return None
+
+
+def get_inventory_cache_key(cids, force_refresh: bool = False) -> str | None:
+    """
+    Return a PubChem cache_key for the inventory CID set, uploading only on a miss.
+
+    The key is remembered in data/inventory_cache_key.json together with a
+    hash of the CID set, and reused until the CID set changes or it gets close
+    to PubChem's ~12 hour expiry.
+
+    Args:
+        cids: Inventory CIDs (ints or strings)
+        force_refresh: Re-upload even if a stored key looks valid — use this
+            when PubChem rejected the stored key
+
+    Returns:
+        cache_key string, or None if the upload failed
+    """
+    digest = cid_set_hash(cids)
+    with _inventory_key_lock:
+        if not force_refresh:
+            stored = _load_inventory_key()
+            if stored and stored.get("cid_hash") == digest:
+                try:
+                    age = (datetime.now() - datetime.fromisoformat(stored["created"])).total_seconds()
+                except (KeyError, TypeError, ValueError):
+                    age = PUBCHEM_CACHE_KEY_TTL
+                if age < PUBCHEM_CACHE_KEY_TTL:
+                    logger.debug("Reusing inventory cache key (%.0f min old)", age / 60)
+                    return stored["cache_key"]
+
+        cache_key = upload_cids_to_pubchem_cache(sorted({str(c) for c in cids}, key=int))
+        if cache_key:
+            DATA_DIR.mkdir(parents=True, exist_ok=True)
+            INVENTORY_KEY_FILE.write_text(json.dumps({
+                "version": 1,
+                "cache_key": cache_key,
+                "cid_hash": digest,
+                "cid_count": len({int(c) for c in cids}),
+                "created": datetime.now().isoformat(),
+            }, indent=2))
+        return cache_key
+
+
+def invalidate_inventory_cache_key() -> None:
+    """Forget the stored inventory cache_key (e.g. after PubChem rejected it)."""
+    with _inventory_key_lock:
+        if INVENTORY_KEY_FILE.exists():
+            INVENTORY_KEY_FILE.unlink()
+
+
 def save_html_snapshot(html_content: str) -> Path:
     """
     Save HTML content as a timestamped snapshot.
@@ -1753,37 +2027,223 @@ def save_rug_table(df: pd.DataFrame, cid_results: dict[str, dict]) -> None:
         "columns": list(table_df.columns),
         "rows": table_df.to_dict(orient="records"),
     }
-    RUG_TABLE_FILE.write_text(json.dumps(data, indent=2, default=str))
+    write_json_file(RUG_TABLE_FILE, data, default=str)
     logger.info("Saved RUG table: %d rows, %d columns", len(table_df), len(table_df.columns))
 
 
 def load_rug_table() -> dict | None:
-    """Load the RUG table from disk."""
-    if not RUG_TABLE_FILE.exists():
-        return None
-    try:
-        return json.loads(RUG_TABLE_FILE.read_text())
-    except (json.JSONDecodeError, OSError):
-        return None
+    """The RUG table (shared in-process copy, do not modify)."""
+    return read_json_file(RUG_TABLE_FILE)
+
+
+_rug_row_index: dict | None = None
+_rug_row_index_lock = threading.Lock()
+
+
+def get_rug_row_index(rows: list[dict]) -> dict:
+    """
+    Positions of RUG table rows by CID and by CAS number.
+
+    Built once per loaded table: load_rug_table() hands out the same rows
+    list until the file changes, so the index is rebuilt exactly when the
+    table is.
+
+    Returns:
+        {"cids": sorted unique CIDs, "starts": offsets into "positions" per
+         CID (one extra at the end), "positions": row positions grouped by
+         CID, "row_cids": CID per row (-1 if none), "cas": CAS -> positions}
+    """
+    global _rug_row_index
+    with _rug_row_index_lock:
+        if _rug_row_index is not None and _rug_row_index["rows"] is rows:
+            return _rug_row_index
+        row_cids = np.full(len(rows), -1, dtype=np.int64)
+        cas: dict[str, list[int]] = {}
+        for i, row in enumerate(rows):
+            try:
+                row_cids[i] = int(row.get("CID"))
+            except (TypeError, ValueError):
+                pass
+            casnr = str(row.get("Casnr") or "").strip()
+            if casnr:
+                cas.setdefault(casnr, []).append(i)
+        positions = np.flatnonzero(row_cids >= 0)
+        positions = positions[np.argsort(row_cids[positions], kind="stable")]
+        cids, starts = np.unique(row_cids[positions], return_index=True)
+        _rug_row_index = {
+            "rows": rows,
+            "cids": cids.astype(np.int32),
+            "starts": np.append(starts, len(positions)),
+            "positions": positions,
+            "row_cids": row_cids,
+            "cas": cas,
+        }
+        return _rug_row_index
+
+
+def rug_row_positions(index: dict, cids) -> np.ndarray:
+    """Table-ordered positions of the rows whose CID is in a CID set, in O(matches)."""
+    cids = cid_array(cids)
+    at = np.searchsorted(index["cids"], cids)
+    found = at < len(index["cids"])
+    found[found] = index["cids"][at[found]] == cids[found]
+    at = at[found]
+    starts = index["starts"][at]
+    lengths = index["starts"][at + 1] - starts
+    # Concatenate the positions[start:start + length] runs without a Python loop
+    take = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return np.sort(index["positions"][take])
+
+
+def _extract_cids_from_sdq_payload(payload) -> list[int]:
+    """
+    SDQ can return a few shapes. We try the common ones:
+    - dict with "result": [ {"cid": ...}, ... ]
+    - dict with "result": [ ["cid"], ["123"], ... ] (table with header)
+    - dict with "result": [ ["123", ...], ... ] (table without header)
+    - top-level list containing one of the above dicts
+    - top-level list of dicts each having a "cid" field
+    """
+    if isinstance(payload, list):
+        # Case 0: top-level list of dict rows with "cid"
+        if payload and isinstance(payload[0], dict) and "cid" in payload[0]:
+            cids: list[int] = []
+            for row in payload:
+                if not isinstance(row, dict):
+                    continue
+                cid = row.get("cid")
+                if cid is None:
+                    continue
+                try:
+                    cids.append(int(cid))
+                except (TypeError, ValueError):
+                    continue
+            return cids
+
+        # Otherwise: sometimes the response is a list of sections; pick the first dict-like item
+        for item in payload:
+            if isinstance(item, dict):
+                return _extract_cids_from_sdq_payload(item)
+        return []
+
+    if not isinstance(payload, dict):
+        return []
+
+    rows = payload.get("result") or payload.get("Result") or []
+    if not isinstance(rows, list):
+        return []
+
+    cids: list[int] = []
+    if not rows:
+        return cids
+
+    # Case A: list of dicts
+    if isinstance(rows[0], dict):
+        for row in rows:
+            cid = row.get("cid") if isinstance(row, dict) else None
+            if cid is None:
+                continue
+            try:
+                cids.append(int(cid))
+            except (TypeError, ValueError):
+                continue
+        return cids
+
+    # Case B/C: list of lists
+    if isinstance(rows[0], list):
+        # Header detection: first row contains "cid"
+        header = rows[0]
+        cid_idx = None
+        if all(isinstance(x, str) for x in header):
+            for i, col in enumerate(header):
+                if str(col).strip().lower() == "cid":
+                    cid_idx = i
+                    break
+
+        start_i = 1 if cid_idx is not None else 0
+        for row in rows[start_i:]:
+            if not isinstance(row, list) or not row:
+                continue
+            val = row[cid_idx] if cid_idx is not None and cid_idx < len(row) else row[0]
+            try:
+                cids.append(int(val))
+            except (TypeError, ValueError):
+                continue
+        return cids
+
+    return cids
+
+
+def _parse_sdq_csv_stream(lines) -> tuple[array, list[bytes]]:
+    """
+    Parse a streamed SDQ CSV download (one CID per line, optional header).
+
+    Returns:
+        (cids, unparsed) — CIDs as a compact int32 array, and any lines that
+        were not CIDs (a JSON body if the server ignored outfmt=csv)
+    """
+    cids = array("i")
+    unparsed: list[bytes] = []
+    for line in lines:
+        value = line.strip().strip(b'"')
+        if not value:
+            continue
+        if unparsed or not value.isdigit():
+            # Header ("cid") is skipped; anything else is kept for diagnostics
+            if value.lower() != b"cid" or unparsed:
+                unparsed.append(line)
+            continue
+        cids.append(int(value))
+    return cids, unparsed
+
+
+# Keys SDQ answered with a clean empty list for: confirmed expired, as
+# opposed to keys whose download failed (network, rate limit, server error)
+_expired_search_keys: set[str] = set()
+_expired_search_keys_lock = threading.Lock()
 
 
-def fetch_cids_from_listkey(cache_key: str) -> list[int] | None:
+def is_expired_search_key(cache_key: str) -> bool:
+    """True if a download of *cache_key* confirmed that PubChem expired it."""
+    with _expired_search_keys_lock:
+        return cache_key in _expired_search_keys
+
+
+def fetch_cids_from_listkey(
+    cache_key: str,
+    intersect_key: str | None = None,
+    limit: int = 10_000_000,
+) -> np.ndarray | None:
     """
     Fetch the actual CID list from a PubChem *cache_key* using the SDQ endpoint.
 
     This mirrors what the web UI does when you download results for a search
     identified by a cache_key (see network call to sdq/sphinxql.cgi).
 
-    Returns list of CID ints, or None on total failure.
+    Only the CID column is requested, as CSV, and parsed line by line while
+    streaming into an int32 array, so memory stays proportional to the number
+    of CIDs even for searches with millions of hits.
+
+    If *intersect_key* is given (e.g. the inventory's cache key), both keys
+    are passed as SDQ inputs and PubChem returns only CIDs present in both,
+    so a broad search downloads at most as many rows as the smaller list.
+    *limit* caps the rows downloaded (see search_key_alive).
+
+    Returns an int32 array of CIDs, or None on total failure. Without
+    *intersect_key*, zero results also count as failure (expired keys come
+    back empty) and the key is recorded as expired (see
+    is_expired_search_key); with it, an empty array means there is no
+    overlap — or that one of the keys has expired.
+    Test the result with ``is None`` / ``len()``, not truthiness.
     """
     url = "https://pubchem.ncbi.nlm.nih.gov/sdq/sphinxql.cgi"
 
     query = {
-        "download": "*",
+        "download": "cid",
         "collection": "compound",
         "order": ["relevancescore,desc"],
         "start": 1,
-        "limit": 10_000_000,
+        "limit": limit,
         "downloadfilename": f"PubChem_compound_CID_{cache_key}",
         "where": {
             "ands": [
@@ -1791,239 +2251,296 @@ def fetch_cids_from_listkey(cache_key: str) -> list[int] | None:
                     "input": {
                         "type": "netcachekey",
                         "idtype": "cid",
-                        "key": cache_key,
+                        "key": key,
                     }
                 }
+                for key in (cache_key, intersect_key) if key
             ]
         },
     }
 
     params = {
         "infmt": "json",
-        "outfmt": "json",
+        "outfmt": "csv",
         "query": json.dumps(query),
     }
 
     logger.info(
-        "Starting CID fetch from cache_key %s... via SDQ",
+        "Starting CID fetch from cache_key %s... via SDQ%s",
         cache_key[:20] + ("..." if len(cache_key) > 20 else ""),
+        f" (intersected with {intersect_key[:20]}...)" if intersect_key else "",
     )
 
-    def _extract_cids_from_sdq_payload(payload) -> list[int]:
-        """
-        SDQ can return a few shapes. We try the common ones:
-        - dict with "result": [ {"cid": ...}, ... ]
-        - dict with "result": [ ["cid"], ["123"], ... ] (table with header)
-        - dict with "result": [ ["123", ...], ... ] (table without header)
-        - top-level list containing one of the above dicts
-        - top-level list of dicts each having a "cid" field
-        """
-        if isinstance(payload, list):
-            # Case 0: top-level list of dict rows with "cid"
-            if payload and isinstance(payload[0], dict) and "cid" in payload[0]:
-                cids: list[int] = []
-                for row in payload:
-                    if not isinstance(row, dict):
-                        continue
-                    cid = row.get("cid")
-                    if cid is None:
-                        continue
-                    try:
-                        cids.append(int(cid))
-                    except (TypeError, ValueError):
-                        continue
-                return cids
-
-            # Otherwise: sometimes the response is a list of sections; pick the first dict-like item
-            for item in payload:
-                if isinstance(item, dict):
-                    return _extract_cids_from_sdq_payload(item)
-            return []
-
-        if not isinstance(payload, dict):
-            return []
-
-        rows = payload.get("result") or payload.get("Result") or []
-        if not isinstance(rows, list):
-            return []
-
-        cids: list[int] = []
-        if not rows:
-            return cids
-
-        # Case A: list of dicts
-        if isinstance(rows[0], dict):
-            for row in rows:
-                cid = row.get("cid") if isinstance(row, dict) else None
-                if cid is None:
-                    continue
-                try:
-                    cids.append(int(cid))
-                except (TypeError, ValueError):
-                    continue
-            return cids
-
-        # Case B/C: list of lists
-        if isinstance(rows[0], list):
-            # Header detection: first row contains "cid"
-            header = rows[0]
-            cid_idx = None
-            if all(isinstance(x, str) for x in header):
-                for i, col in enumerate(header):
-                    if str(col).strip().lower() == "cid":
-                        cid_idx = i
-                        break
-
-            start_i = 1 if cid_idx is not None else 0
-            for row in rows[start_i:]:
-                if not isinstance(row, list) or not row:
-                    continue
-                val = row[cid_idx] if cid_idx is not None and cid_idx < len(row) else row[0]
-                try:
-                    cids.append(int(val))
-                except (TypeError, ValueError):
-                    continue
-            return cids
-
-        return cids
-
+    resp = None
     try:
-        resp = requests.get(url, params=params, timeout=120)
+        with requests.get(url, params=params, timeout=120, stream=True) as resp:
+            if resp.status_code != 200:
+                body_snippet = ""
+                try:
+                    text = resp.text or ""
+                    body_snippet = text[:500].replace("\n", " ")
+                except Exception:
+                    body_snippet = "<unable to read response body>"
 
-        if resp.status_code != 200:
-            body_snippet = ""
-            try:
-                text = resp.text or ""
-                body_snippet = text[:500].replace("\n", " ")
-            except Exception:
-                body_snippet = "<unable to read response body>"
-
-            logger.error(
-                "SDQ fetch HTTP %d for cache_key %s... (url=%s, body_snippet=%r)",
-                resp.status_code,
-                cache_key[:20],
-                resp.url,
-                body_snippet,
-            )
-            return None
+                logger.error(
+                    "SDQ fetch HTTP %d for cache_key %s... (url=%s, body_snippet=%r)",
+                    resp.status_code,
+                    cache_key[:20],
+                    resp.url,
+                    body_snippet,
+                )
+                return None
 
-        data = resp.json()
-        cids = _extract_cids_from_sdq_payload(data)
+            cids, unparsed = _parse_sdq_csv_stream(resp.iter_lines(chunk_size=64 * 1024))
 
-        if not cids:
-            # High-signal debug to understand why we got 0 CIDs for a key that should have results.
+        if unparsed and not cids:
+            # Server answered with JSON (older behaviour or an error object)
+            body = b"\n".join(unparsed)
             try:
-                payload_type = type(data).__name__
-                keys = list(data.keys()) if isinstance(data, dict) else None
-                result_len = None
-                header = None
-                if isinstance(data, dict):
-                    rows = data.get("result") or data.get("Result") or None
-                    if isinstance(rows, list):
-                        result_len = len(rows)
-                        if rows and isinstance(rows[0], list):
-                            header = rows[0][:20]
+                cids = array("i", _extract_cids_from_sdq_payload(json.loads(body)))
+            except ValueError:
+                pass
+            if not cids:
                 logger.warning(
-                    "SDQ returned 0 CIDs for cache_key %s... (payload_type=%s, keys=%s, result_len=%s, header=%r, url=%s)",
+                    "SDQ returned 0 CIDs for cache_key %s... (url=%s, body_snippet=%r)",
                     cache_key[:20],
-                    payload_type,
-                    keys,
-                    result_len,
-                    header,
                     resp.url,
+                    body[:2000].decode("utf-8", "replace"),
                 )
-                snippet = json.dumps(data, ensure_ascii=False)[:2000].replace("\n", " ")
-                logger.debug("SDQ payload snippet (first 2000 chars): %s", snippet)
-            except Exception:
-                logger.debug("Failed to log SDQ debug payload details", exc_info=True)
 
         logger.info(
             "Fetched %d CIDs from cache_key %s...",
             len(cids),
             cache_key[:20],
         )
-        return cids or None
+        if not cids and (unparsed or not intersect_key):
+            if not unparsed:
+                # A clean, empty CSV answer: PubChem no longer knows the key
+                with _expired_search_keys_lock:
+                    _expired_search_keys.add(cache_key)
+            return None
+        return np.frombuffer(cids, dtype=np.int32).copy()
 
     except Exception as e:
-        # Log response shape hints if we got a response
+        logger.error(
+            "Error fetching CIDs from cache_key %s...: %s (http_status=%s)",
+            cache_key[:20],
+            e,
+            getattr(resp, "status_code", None),
+        )
+        return None
+
+
+def search_key_alive(cache_key: str) -> bool | None:
+    """
+    Whether PubChem still holds a search, by downloading at most one CID.
+
+    Returns True if it does, False if it answered that the key expired, or
+    None if the check itself failed (network, rate limit, server error).
+    """
+    cids = fetch_cids_from_listkey(cache_key, limit=1)
+    if cids is not None:
+        return True
+    return False if is_expired_search_key(cache_key) else None
+
+
+_cid_set_lock = threading.Lock()
+
+
+def _cid_set_index_path() -> Path:
+    return CID_SETS_DIR / "index.json"
+
+
+def _load_cid_set_index() -> dict:
+    """The CID-set index (shared in-process copy, do not modify)."""
+    index = read_json_file(_cid_set_index_path())
+    return index if isinstance(index, dict) else {}
+
+
+def _save_cid_set_index(index: dict) -> None:
+    write_json_file(_cid_set_index_path(), index)
+
+
+def get_cached_cid_set(cache_key: str) -> np.ndarray | None:
+    """CID set of a PubChem search from the local cache, or None if not cached."""
+    with _cid_set_lock:
+        index = _load_cid_set_index()
+        entry = index.get(cache_key)
+        if entry is None:
+            return None
         try:
-            body_snippet = (resp.text or "")[:500].replace("\n", " ")
-            logger.error(
-                "Error fetching CIDs from cache_key %s...: %s (http_status=%s, body_snippet=%r)",
-                cache_key[:20],
-                e,
-                getattr(resp, "status_code", None),
-                body_snippet,
-            )
-        except Exception:
-            logger.error("Error fetching CIDs from cache_key %s...: %s", cache_key[:20], e)
+            cids = unpack_cid_array((CID_SETS_DIR / entry["file"]).read_bytes())
+        except (OSError, zlib.error):
+            _save_cid_set_index({k: e for k, e in index.items() if k != cache_key})
+            return None
+        # LRU bookkeeping: rewriting the index on every hit is wasteful,
+        # an hour's precision is plenty for eviction order
+        now = datetime.now()
+        try:
+            touched = datetime.fromisoformat(entry.get("last_used", ""))
+        except ValueError:
+            touched = None
+        if touched is None or (now - touched).total_seconds() >= CID_SET_TOUCH_INTERVAL:
+            _save_cid_set_index({**index, cache_key: {**entry, "last_used": now.isoformat()}})
+        return cids
+
+
+def has_cached_cid_set(cache_key: str) -> bool:
+    # The index is kept parsed in memory (read_json_file), so this is cheap
+    # enough to ask for every history entry on every poll
+    return cache_key in _load_cid_set_index()
+
+
+def store_cid_set(cache_key: str, cids) -> None:
+    """
+    Keep a search's CID set locally, keyed by its PubChem cache_key.
+
+    Sets stay usable after PubChem expires the key. The least recently used
+    sets are evicted once the cache exceeds CID_SET_CACHE_MAX_BYTES.
+    """
+    cids = cid_array(cids)
+    data = pack_cid_array(cids)
+    name = hashlib.sha1(cache_key.encode()).hexdigest()[:20] + ".cids"
+    now = datetime.now().isoformat()
+    with _cid_set_lock:
+        _write_atomic(CID_SETS_DIR / name, data)
+        index = dict(_load_cid_set_index())
+        index[cache_key] = {
+            "file": name,
+            "count": int(len(cids)),
+            "bytes": len(data),
+            "created": now,
+            "last_used": now,
+        }
+        total = sum(e["bytes"] for e in index.values())
+        for key, entry in sorted(index.items(), key=lambda kv: kv[1]["last_used"]):
+            if total <= CID_SET_CACHE_MAX_BYTES or key == cache_key:
+                continue
+            (CID_SETS_DIR / entry["file"]).unlink(missing_ok=True)
+            total -= entry["bytes"]
+            del index[key]
+            logger.info("Evicted cached CID set %s... (%d CIDs)", key[:20], entry["count"])
+        _save_cid_set_index(index)
+
+
+def local_search_key(cids) -> str:
+    """
+    Cache key for a search whose CIDs were downloaded directly (name and
+    SMILES searches). The set lives only in the local CID-set cache; a
+    PubChem cache key is created when the user opens it on PubChem.
+    """
+    return LOCAL_SEARCH_PREFIX + cid_set_hash(cids)[:24]
+
+
+def is_local_search_key(cache_key: str) -> bool:
+    return cache_key.startswith(LOCAL_SEARCH_PREFIX)
+
+
+def get_search_cids(cache_key: str) -> np.ndarray | None:
+    """
+    CID set of a PubChem search: local cache first, else download and cache it.
+
+    Returns None if the search is not cached and can no longer be downloaded
+    (local searches cannot be downloaded at all).
+    """
+    cids = get_cached_cid_set(cache_key)
+    if cids is not None or is_local_search_key(cache_key):
+        return cids
+    cids = fetch_cids_from_listkey(cache_key)
+    if cids is None:
         return None
+    cids = cid_array(cids)
+    store_cid_set(cache_key, cids)
+    return cids
 
 
-def save_filter_result(search_name: str, operation: str, matching_cids: list[int], pubchem_url: str = "") -> str:
-    """Save a filter result and return its short ID."""
+_filter_results_lock = threading.Lock()  # serializes read-modify-write of FILTER_RESULTS_FILE
+
+
+def save_filter_result(search_name: str, operation: str, matching_cids, pubchem_url: str = "") -> str:
+    """Save a filter result and return its short ID.
+
+    The CIDs (any iterable or array) are stored compressed under "cids";
+    read them back with get_filter_cids().
+    """
     filter_id = str(uuid.uuid4())[:8]
     DATA_DIR.mkdir(parents=True, exist_ok=True)
 
-    results = load_filter_results()
-    results.insert(0, {
+    cids = cid_array(matching_cids)
+    entry = {
         "id": filter_id,
         "search_name": search_name,
         "operation": operation,
-        "matching_cids": matching_cids,
-        "match_count": len(matching_cids),
+        "cids": encode_cid_array(cids),
+        "match_count": int(len(cids)),
         "pubchem_url": pubchem_url,
         "created": datetime.now().isoformat(),
-    })
-    # Keep all saved + last 10 unsaved
-    saved = [r for r in results if r.get("saved")]
-    unsaved = [r for r in results if not r.get("saved")]
-    results = saved + unsaved[:10]
-    FILTER_RESULTS_FILE.write_text(json.dumps(results, indent=2))
-    logger.info("Saved filter: '%s' (%s) → %d matches", search_name, operation, len(matching_cids))
+    }
+    with _filter_results_lock:
+        results = [entry] + load_filter_results()
+        # Keep all saved + last 10 unsaved
+        saved = [r for r in results if r.get("saved")]
+        unsaved = [r for r in results if not r.get("saved")]
+        write_json_file(FILTER_RESULTS_FILE, saved + unsaved[:10])
+    logger.info("Saved filter: '%s' (%s) → %d matches", search_name, operation, len(cids))
     return filter_id
 
 
+def get_filter_cids(filter_result: dict) -> np.ndarray:
+    """CID set of a filter result (also reads the older plain "matching_cids" list)."""
+    if "cids" in filter_result:
+        return decode_cid_array(filter_result["cids"])
+    return cid_array(filter_result.get("matching_cids", []))
+
+
 def load_filter_results() -> list[dict]:
-    """Load saved filter results."""
-    if not FILTER_RESULTS_FILE.exists():
-        return []
-    try:
-        return json.loads(FILTER_RESULTS_FILE.read_text())
-    except (json.JSONDecodeError, OSError):
-        return []
+    """Saved filter results, newest first (shared in-process copy, do not modify)."""
+    results = read_json_file(FILTER_RESULTS_FILE)
+    return results if isinstance(results, list) else []
 
 
 def toggle_saved_filter(filter_id: str, saved: bool) -> bool:
     """Set the saved flag on a filter result. Returns True if found."""
-    results = load_filter_results()
-    for r in results:
-        if r["id"] == filter_id:
-            r["saved"] = saved
-            FILTER_RESULTS_FILE.write_text(json.dumps(results, indent=2))
-            return True
+    with _filter_results_lock:
+        results = copy.deepcopy(load_filter_results())
+        for r in results:
+            if r["id"] == filter_id:
+                r["saved"] = saved
+                write_json_file(FILTER_RESULTS_FILE, results)
+                return True
+    return False
+
+
+def set_filter_pubchem_url(filter_id: str, pubchem_url: str) -> bool:
+    """Store the (lazily created) PubChem URL of a filter result. Returns True if found."""
+    with _filter_results_lock:
+        results = copy.deepcopy(load_filter_results())
+        for r in results:
+            if r["id"] == filter_id:
+                r["pubchem_url"] = pubchem_url
+                r["pubchem_url_created"] = datetime.now().isoformat()
+                write_json_file(FILTER_RESULTS_FILE, results)
+                return True
     return False
 
 
 def delete_filter_result(filter_id: str) -> bool:
     """Remove a filter result entirely. Returns True if found."""
-    results = load_filter_results()
-    new_results = [r for r in results if r["id"] != filter_id]
-    if len(new_results) == len(results):
-        return False
-    FILTER_RESULTS_FILE.write_text(json.dumps(new_results, indent=2))
+    with _filter_results_lock:
+        results = load_filter_results()
+        new_results = [r for r in results if r["id"] != filter_id]
+        if len(new_results) == len(results):
+            return False
+        write_json_file(FILTER_RESULTS_FILE, new_results)
     return True
 
 
 def load_app_searches() -> set[str]:
     """Load app-generated cache keys from disk."""
-    if not APP_SEARCHES_FILE.exists():
-        return set()
-    try:
-        data = json.loads(APP_SEARCHES_FILE.read_text())
-        return set(data.get("cache_keys", []))
-    except (json.JSONDecodeError, OSError):
+    data = read_json_file(APP_SEARCHES_FILE)
+    if not isinstance(data, dict):
         return set()
+    return set(data.get("cache_keys", []))
 
 
 def save_app_search(cache_key: str) -> None:
@@ -2031,12 +2548,9 @@ def save_app_search(cache_key: str) -> None:
     DATA_DIR.mkdir(parents=True, exist_ok=True)
 
     # Load existing data to preserve the searches field
-    existing = {}
-    if APP_SEARCHES_FILE.exists():
-        try:
-            existing = json.loads(APP_SEARCHES_FILE.read_text())
-        except (json.JSONDecodeError, OSError):
-            pass
+    existing = read_json_file(APP_SEARCHES_FILE)
+    if not isinstance(existing, dict):
+        existing = {}
 
     app_searches = load_app_searches()
     app_searches.add(cache_key)
@@ -2048,7 +2562,7 @@ def save_app_search(cache_key: str) -> None:
         "cache_keys": app_searches_list,
         "searches": existing.get("searches", []),
     }
-    APP_SEARCHES_FILE.write_text(json.dumps(data, indent=2))
+    write_json_file(APP_SEARCHES_FILE, data)
     logger.info("Recorded app-generated search: %s", cache_key[:20])
 
 
@@ -2063,13 +2577,10 @@ def save_app_search_with_metadata(cache_key: str, query: str, count: int) -> Non
 
     # Load existing data
     data = {"version": 2, "cache_keys": [], "searches": []}
-    if APP_SEARCHES_FILE.exists():
-        try:
-            existing = json.loads(APP_SEARCHES_FILE.read_text())
-            data["cache_keys"] = existing.get("cache_keys", [])
-            data["searches"] = existing.get("searches", [])
-        except (json.JSONDecodeError, OSError):
-            pass
+    existing = read_json_file(APP_SEARCHES_FILE)
+    if isinstance(existing, dict):
+        data["cache_keys"] = list(existing.get("cache_keys", []))
+        data["searches"] = list(existing.get("searches", []))
 
     # Note: We intentionally do NOT add to cache_keys here.
     # cache_keys is for combined searches that shouldn't be combined again.
@@ -2087,31 +2598,24 @@ def save_app_search_with_metadata(cache_key: str, query: str, count: int) -> Non
     # Keep last 50 searches
     data["searches"] = data["searches"][-50:]
 
-    APP_SEARCHES_FILE.write_text(json.dumps(data, indent=2))
+    write_json_file(APP_SEARCHES_FILE, data)
     logger.info("Recorded direct search '%s' with %d results: %s", query, count, cache_key[:20])
 
 
 def load_app_search_metadata() -> dict[str, dict]:
     """Load app search metadata as dict of cache_key -> metadata."""
-    if not APP_SEARCHES_FILE.exists():
-        return {}
-    try:
-        data = json.loads(APP_SEARCHES_FILE.read_text())
-        searches = data.get("searches", [])
-        return {s["cache_key"]: s for s in searches if "cache_key" in s}
-    except (json.JSONDecodeError, OSError):
+    data = read_json_file(APP_SEARCHES_FILE)
+    if not isinstance(data, dict):
         return {}
+    return {s["cache_key"]: s for s in data.get("searches", []) if "cache_key" in s}
 
 
 def load_stale_searches() -> set[str]:
     """Load blacklisted stale cache keys from disk."""
-    if not STALE_SEARCHES_FILE.exists():
-        return set()
-    try:
-        data = json.loads(STALE_SEARCHES_FILE.read_text())
-        return set(data.get("cache_keys", []))
-    except (json.JSONDecodeError, OSError):
+    data = read_json_file(STALE_SEARCHES_FILE)
+    if not isinstance(data, dict):
         return set()
+    return set(data.get("cache_keys", []))
 
 
 def mark_search_as_stale(cache_key: str) -> None:
@@ -2122,27 +2626,498 @@ def mark_search_as_stale(cache_key: str) -> None:
     # Keep last 100 to avoid unbounded growth
     stale_list = list(stale)[-100:]
     data = {"version": 1, "cache_keys": stale_list}
-    STALE_SEARCHES_FILE.write_text(json.dumps(data, indent=2))
+    write_json_file(STALE_SEARCHES_FILE, data)
     logger.info("Blacklisted stale search: %s", cache_key[:20])
 
 
-def load_compound_info() -> dict:
-    """Load compound info cache from disk."""
-    if not COMPOUND_INFO_FILE.exists():
-        return {"version": 1, "compounds": {}}
+# ---------------------------------------------------------------------------
+# Boolean query expressions over CID sets
+# ---------------------------------------------------------------------------
+#
+# Grammar (AND binds tighter than OR, NOT tightest; keywords are
+# case-insensitive):
+#
+#   expr    := and_expr ("OR" and_expr)*
+#   and_expr:= not_expr ("AND" not_expr)*
+#   not_expr:= "NOT" not_expr | "(" expr ")" | operand
+#   operand := all | filter:<id> | search:<cache_key> | "search name"
+#            | formula:<text> | elements:<formula query> | location:<text>
+#            | owner:<text> | ghs:<code> | mw:<range>
+#
+# The AST is nested tuples: ("and", [nodes]), ("or", [nodes]),
+# ("not", node) and ("operand", kind, value).
+
+QUERY_OPERAND_KINDS = ("filter", "search", "name", "formula", "elements", "location", "owner", "ghs", "mw")
+QUERY_LOCAL_KINDS = ("formula", "elements", "location", "owner", "ghs", "mw")  # evaluated from local data only
+_QUERY_KEYWORDS = ("AND", "OR", "NOT")
+
+
+def _tokenize_query(text: str) -> list[tuple[str, str]]:
+    """Split a query into ("(", ")", "op", "operand") tokens."""
+    tokens = []
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if ch.isspace():
+            i += 1
+        elif ch in "()":
+            tokens.append((ch, ch))
+            i += 1
+        else:
+            start = i
+            while i < len(text) and not text[i].isspace() and text[i] not in "()":
+                if text[i] == '"':
+                    end = text.find('"', i + 1)
+                    if end == -1:
+                        raise ValueError(f"Unclosed quote at position {i + 1}")
+                    i = end
+                i += 1
+            word = text[start:i]
+            if word.upper() in _QUERY_KEYWORDS:
+                tokens.append(("op", word.upper()))
+            else:
+                tokens.append(("operand", word))
+    return tokens
+
+
+def _parse_operand(word: str) -> tuple:
+    """Turn an operand token into ("operand", kind, value)."""
+    if word.lower() == "all":
+        return ("operand", "all", "")
+    kind, sep, value = word.partition(":")
+    if word.startswith('"') or not sep:
+        # Bare word or quoted text: a search or filter referred to by name
+        return ("operand", "name", word.strip('"'))
+    kind = kind.lower()
+    if kind not in QUERY_OPERAND_KINDS:
+        raise ValueError(f"Unknown operand type '{kind}:' (use one of: {', '.join(QUERY_OPERAND_KINDS)})")
+    value = value.strip('"')
+    if not value:
+        raise ValueError(f"Missing value after '{kind}:'")
+    return ("operand", kind, value)
+
+
+def parse_query(text: str) -> tuple:
+    """
+    Parse a boolean query expression such as ``(A AND B) OR NOT C``.
+
+    Raises:
+        ValueError: with a human-readable message on syntax errors
+    """
+    tokens = _tokenize_query(text)
+    if not tokens:
+        raise ValueError("Empty query")
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else (None, None)
+
+    def parse_or():
+        nonlocal pos
+        children = [parse_and()]
+        while peek() == ("op", "OR"):
+            pos += 1
+            children.append(parse_and())
+        return children[0] if len(children) == 1 else ("or", children)
+
+    def parse_and():
+        nonlocal pos
+        children = [parse_not()]
+        while peek() == ("op", "AND"):
+            pos += 1
+            children.append(parse_not())
+        return children[0] if len(children) == 1 else ("and", children)
+
+    def parse_not():
+        nonlocal pos
+        kind, value = peek()
+        if kind == "op" and value == "NOT":
+            pos += 1
+            return ("not", parse_not())
+        if kind == "(":
+            pos += 1
+            node = parse_or()
+            if peek()[0] != ")":
+                raise ValueError("Missing closing parenthesis")
+            pos += 1
+            return node
+        if kind == "operand":
+            pos += 1
+            return _parse_operand(value)
+        if kind is None:
+            raise ValueError("Query ends unexpectedly")
+        raise ValueError(f"Unexpected '{value}'")
+
+    node = parse_or()
+    if pos != len(tokens):
+        raise ValueError(f"Unexpected '{tokens[pos][1]}'")
+    return node
+
+
+def query_operands(node: tuple) -> list[tuple]:
+    """All operand nodes of a parsed query, in order of appearance."""
+    if node[0] == "operand":
+        return [node]
+    if node[0] == "not":
+        return query_operands(node[1])
+    return [op for child in node[1] for op in query_operands(child)]
+
+
+def _parse_mw_range(value: str) -> tuple[float, float]:
+    m = re.fullmatch(r"\s*(<=|>=|<|>)?\s*(\d+(?:\.\d+)?)\s*(?:-\s*(\d+(?:\.\d+)?))?\s*", value)
+    if not m:
+        raise ValueError(f"Invalid MW range '{value}' (use e.g. 100-200, <300 or >50)")
+    op, lo, hi = m.group(1), float(m.group(2)), m.group(3)
+    if hi is not None:
+        if op:
+            raise ValueError(f"Invalid MW range '{value}'")
+        return lo, float(hi)
+    if op in ("<", "<="):
+        return float("-inf"), lo
+    if op in (">", ">="):
+        return lo, float("inf")
+    return lo, lo
+
+
+def evaluate_predicate(kind: str, value: str, rows: list[dict], compounds: dict) -> np.ndarray:
+    """
+    CID set of inventory rows matching a local predicate.
+
+    formula is a case-sensitive substring of the molecular formula,
+    elements a formula query (``"C=6 N=1"``, ``halogen``, see
+    formula_query_mask), location / owner are case-insensitive substrings, ghs is a pictogram
+    code (``GHS02`` or ``02``) and mw a range such as ``100-200``, ``<300``
+    or ``>50``.
+    """
+    if kind == "elements":
+        return formula_query_cids(value, rows, compounds)
+    if kind == "mw":
+        lo, hi = _parse_mw_range(value)
+    elif kind == "ghs":
+        digits = value.upper().removeprefix("GHS")
+        if not digits.isdigit():
+            raise ValueError(f"Invalid GHS code '{value}' (use e.g. GHS02)")
+        code = f"GHS{int(digits):02d}"
+    elif kind not in ("formula", "location", "owner"):
+        raise ValueError(f"Unknown predicate '{kind}'")
+    needle = value.lower()
+
+    hits = []
+    for row in rows:
+        cid_val = row.get("CID")
+        if cid_val is None:
+            continue
+        try:
+            cid = int(cid_val)
+        except (TypeError, ValueError):
+            continue
+        ci = compounds.get(str(cid), {})
+        if kind == "formula":
+            ok = value in (ci.get("formula") or row.get("Formula") or "")
+        elif kind == "location":
+            ok = needle in (row.get("Location") or "").lower()
+        elif kind == "owner":
+            ok = needle in (row.get("Owner") or "").lower()
+        elif kind == "ghs":
+            ok = code in ci.get("ghs_pictograms", [])
+        else:
+            try:
+                ok = lo <= float(ci.get("mw") or "nan") <= hi
+            except ValueError:
+                ok = False
+        if ok:
+            hits.append(cid)
+    return cid_array(hits)
+
+
+def run_query(node: tuple, universe: np.ndarray, resolve, estimate) -> tuple[np.ndarray, list[str]]:
+    """
+    Evaluate a parsed query against the inventory.
+
+    Operands are fetched through *resolve(kind, value)* (returns a CID set
+    already restricted to *universe*) and each distinct operand is resolved
+    at most once. *estimate(kind, value)* gives a cheap size estimate used
+    for planning: AND operands are evaluated smallest first, negated AND
+    operands are applied as set differences afterwards, and evaluation stops
+    as soon as an intermediate AND result is empty, so expensive (remote)
+    operands later in the chain are never fetched.
+
+    Returns:
+        (cids, plan) — the result CID set and a log of evaluation steps
+    """
+    cache: dict[tuple, np.ndarray] = {}
+    plan: list[str] = []
+
+    def label(n):
+        if n[0] == "operand":
+            return f"{n[1]}:{n[2]}" if n[2] else n[1]
+        if n[0] == "not":
+            return f"NOT {label(n[1])}"
+        return "(" + f" {n[0].upper()} ".join(label(c) for c in n[1]) + ")"
+
+    # Sort keys are compared many times; estimate each node (and each
+    # distinct operand, which may need a lookup) only once
+    estimates: dict[int, float] = {}
+    operand_estimates: dict[tuple, float] = {}
+
+    def est(n) -> float:
+        if id(n) not in estimates:
+            estimates[id(n)] = _est(n)
+        return estimates[id(n)]
+
+    def _est(n) -> float:
+        if n[0] == "operand":
+            if n[1] == "all":
+                return len(universe)
+            key = (n[1], n[2])
+            if key not in operand_estimates:
+                operand_estimates[key] = estimate(n[1], n[2])
+            return operand_estimates[key]
+        if n[0] == "not":
+            return max(len(universe) - est(n[1]), 0)
+        if n[0] == "and":
+            return min(est(c) for c in n[1])
+        return min(sum(est(c) for c in n[1]), len(universe))
+
+    def ev(n) -> np.ndarray:
+        kind = n[0]
+        if kind == "operand":
+            if n[1] == "all":
+                return universe
+            key = (n[1], n[2])
+            if key not in cache:
+                cache[key] = np.intersect1d(resolve(n[1], n[2]), universe, assume_unique=True)
+                plan.append(f"{label(n)} -> {len(cache[key])}")
+            return cache[key]
+        if kind == "not":
+            return np.setdiff1d(universe, ev(n[1]), assume_unique=True)
+        if kind == "or":
+            result = np.empty(0, dtype=np.int32)
+            for child in sorted(n[1], key=est, reverse=True):
+                result = np.union1d(result, ev(child))
+                if len(result) == len(universe):
+                    plan.append(f"{label(n)}: everything matched, skipping the rest")
+                    break
+            return result
+
+        # AND: intersect positives smallest-first, then subtract negations
+        positives = sorted((c for c in n[1] if c[0] != "not"), key=est)
+        negatives = sorted((c[1] for c in n[1] if c[0] == "not"), key=est, reverse=True)
+        result = universe
+        for child in positives:
+            result = np.intersect1d(result, ev(child), assume_unique=True)
+            if not len(result):
+                plan.append(f"{label(n)}: empty after {label(child)}, skipping the rest")
+                return result
+        for child in negatives:
+            result = np.setdiff1d(result, ev(child), assume_unique=True)
+            if not len(result):
+                plan.append(f"{label(n)}: empty after NOT {label(child)}, skipping the rest")
+                return result
+        return result
+
+    result = ev(node)
+    return result, plan
+
+
+# ---------------------------------------------------------------------------
+# Batch search: many names / CAS numbers / SMILES against the inventory
+# ---------------------------------------------------------------------------
+BATCH_MAX_QUERIES = 2000
+BATCH_MAX_WORKERS = 4  # overlap request latency; throughput is set by the shared slot budget
+BATCH_REPORT_COLUMNS = [
+    "Query", "Type", "PubChem CIDs", "In Inventory", "Matched CIDs",
+    "Names", "CAS", "Locations", "Error",
+]
+
+# Whole-string SMILES: organic-subset atoms, bracket atoms, bonds, ring closures
+_SMILES_LIKE = re.compile(r"(?:Cl|Br|\[[^\]\s]+\]|[BCNOSPFIbcnosp]|[0-9%()=#\\/@+\-.:*])+")
+_BATCH_PREFIX = re.compile(r"^(name|cas|smiles):\s*(.+)$", re.IGNORECASE)
+
+
+def read_batch_queries(text: str) -> list[str]:
+    """
+    Split a batch input into queries: one per line, first tab-separated
+    column only, blank lines and ``#`` comments skipped, duplicates dropped.
+    """
+    queries = []
+    seen = set()
+    for line in text.splitlines():
+        query = line.split("\t", 1)[0].strip()
+        if not query or query.startswith("#") or query in seen:
+            continue
+        seen.add(query)
+        queries.append(query)
+    return queries
+
+
+def classify_batch_query(query: str) -> tuple[str, str]:
+    """
+    Guess whether a query is a CAS number, a SMILES string or a name.
+
+    A ``cas:``, ``smiles:`` or ``name:`` prefix overrides the guess.
+
+    Returns:
+        (kind, value) with kind one of "cas", "smiles", "name"
+    """
+    m = _BATCH_PREFIX.match(query)
+    if m:
+        return m.group(1).lower(), m.group(2).strip()
+    if CAS_PATTERN.match(query):
+        return "cas", query
+    if len(query) > 2 and _SMILES_LIKE.fullmatch(query):
+        return "smiles", query
+    return "name", query
+
+
+def _pug_identifier_cids(namespace: str, value: str, retries: int = 3) -> tuple[list[int], str | None]:
+    """
+    Look up CIDs for a name or SMILES via PUG REST, inside the shared budget.
+
+    The identifier is POSTed so SMILES with ``/`` or ``#`` survive.
+
+    Returns:
+        (cids, error) - no match is ([], None), a failure ([], message)
+    """
+    error = None
+    for attempt in range(retries):
+        wait_for_pubchem_slot()
+        try:
+            resp = requests.post(
+                f"{PUBCHEM_BASE_URL}/compound/{namespace}/cids/JSON",
+                data={namespace: value},
+                timeout=30,
+            )
+        except requests.RequestException as e:
+            error = f"Request failed: {type(e).__name__}"
+            continue
+        if resp.status_code == 200:
+            try:
+                cids = resp.json().get("IdentifierList", {}).get("CID", [])
+            except ValueError:
+                return [], "Invalid response from PubChem"
+            return [c for c in cids if c], None  # CID 0 means "valid but unknown"
+        if resp.status_code == 404:
+            return [], None
+        if resp.status_code in (429, 503):
+            # PubChem is throttling us: back off before the next slot
+            error = "PubChem busy"
+            time.sleep(2 ** attempt)
+            continue
+        try:
+            error = resp.json()["Fault"]["Message"]
+        except (ValueError, KeyError, TypeError):
+            error = f"PubChem error: {resp.status_code}"
+        return [], error
+    return [], error
+
+
+def resolve_batch_query(query: str) -> dict:
+    """
+    Resolve one batch query to PubChem CIDs.
+
+    CAS numbers are looked up in the bundled PubChem dump first and only go
+    to PubChem (as a synonym) when missing. SMILES that PubChem rejects are
+    retried as names, since short names can look like SMILES.
+
+    Returns:
+        {"query", "type", "cids", "error"}
+    """
+    kind, value = classify_batch_query(query)
+    if kind == "cas":
+        cid = load_pubchem_dump().get(value)
+        if cid is not None:
+            return {"query": query, "type": kind, "cids": [cid], "error": None}
+        cids, error = _pug_identifier_cids("name", value)
+    elif kind == "smiles":
+        cids, error = _pug_identifier_cids("smiles", value)
+        if error and not _BATCH_PREFIX.match(query):
+            kind = "name"
+            cids, error = _pug_identifier_cids("name", value)
+    else:
+        cids, error = _pug_identifier_cids("name", value)
+    return {"query": query, "type": kind, "cids": cids, "error": error}
+
+
+def batch_search(queries: list[str], inventory, max_workers: int = BATCH_MAX_WORKERS):
+    """
+    Resolve queries concurrently and intersect each with the inventory.
+
+    Yields one result per query as it completes (not in input order):
+    {"index", "query", "type", "pubchem_count", "matches", "error"} where
+    matches are the inventory CIDs found for that query. Closing the
+    generator early cancels queries that have not started yet.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    inventory = cid_array(inventory)
+    if any(classify_batch_query(q)[0] == "cas" for q in queries):
+        load_pubchem_dump()  # load once up front, not in every worker
+    pool = ThreadPoolExecutor(max_workers=max_workers)
     try:
-        data = json.loads(COMPOUND_INFO_FILE.read_text())
-        if "compounds" not in data:
-            return {"version": 1, "compounds": {}}
-        return data
-    except (json.JSONDecodeError, OSError):
+        futures = {pool.submit(resolve_batch_query, q): i for i, q in enumerate(queries)}
+        for future in as_completed(futures):
+            result = future.result()
+            hits = cid_array(result.pop("cids"))
+            result["index"] = futures[future]
+            result["pubchem_count"] = len(hits)
+            result["matches"] = np.intersect1d(hits, inventory, assume_unique=True).tolist()
+            yield result
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def index_rows_by_cid(rows: list[dict]) -> dict[int, list[dict]]:
+    """Group inventory table rows by their integer CID (rows without one are skipped)."""
+    by_cid: dict[int, list[dict]] = {}
+    for row in rows:
+        try:
+            by_cid.setdefault(int(row.get("CID")), []).append(row)
+        except (TypeError, ValueError):
+            continue
+    return by_cid
+
+
+def batch_report_row(result: dict, by_cid: dict[int, list[dict]]) -> dict:
+    """
+    One batch report row: a batch_search() result with its matching
+    inventory entries folded into the Names / CAS / Locations cells.
+    """
+    entries = [e for cid in result["matches"] for e in by_cid.get(cid, [])]
+
+    def joined(column):
+        return "; ".join(dict.fromkeys(str(e[column]) for e in entries if e.get(column)))
+
+    return {
+        "Query": result["query"],
+        "Type": result["type"],
+        "PubChem CIDs": result["pubchem_count"],
+        "In Inventory": len(entries),
+        "Matched CIDs": " ".join(str(c) for c in result["matches"]),
+        "Names": joined("Name"),
+        "CAS": joined("Casnr"),
+        "Locations": joined("Location"),
+        "Error": result["error"] or "",
+    }
+
+
+def batch_report_rows(results: list[dict], rows: list[dict]) -> list[dict]:
+    """The full batch report, one row per query in input order."""
+    by_cid = index_rows_by_cid(rows)
+    return [batch_report_row(r, by_cid) for r in sorted(results, key=lambda r: r["index"])]
+
+
+def load_compound_info() -> dict:
+    """The compound info cache (shared in-process copy, do not modify)."""
+    data = read_json_file(COMPOUND_INFO_FILE)
+    if not isinstance(data, dict) or "compounds" not in data:
         return {"version": 1, "compounds": {}}
+    return data
 
 
 def save_compound_info(data: dict) -> None:
     """Save compound info cache to disk."""
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    COMPOUND_INFO_FILE.write_text(json.dumps(data, indent=2))
+    write_json_file(COMPOUND_INFO_FILE, data)
 
 
 async def _fetch_bulk_properties(
@@ -2175,21 +3150,28 @@ async def _fetch_ghs_for_cid(
     session: aiohttp.ClientSession,
     cid: int,
     semaphore: asyncio.Semaphore,
-) -> tuple[int, list[str]]:
-    """Fetch GHS pictogram codes for a single CID via PUG View."""
+) -> tuple[int, list[str] | None]:
+    """Fetch GHS pictogram codes for a single CID via PUG View.
+
+    Returns None instead of a list when the request failed, so callers can
+    tell "no pictograms" apart from "unknown".
+    """
     url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug_view/data/compound/{cid}/JSON/?heading=GHS+Classification"
     async with semaphore:
         try:
-            await asyncio.sleep(1.0)  # rate limit: 5 concurrent × 1s = 5 req/sec
+            await wait_for_pubchem_slot_async()
             async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as resp:
                 if resp.status == 200:
                     data = await resp.json()
                     pictograms = _extract_ghs_pictograms(data)
                     return (cid, pictograms)
+                if resp.status == 404:
+                    # No GHS heading for this compound
+                    return (cid, [])
                 logger.debug("GHS fetch HTTP %d for CID %d", resp.status, cid)
-                return (cid, [])
+                return (cid, None)
         except Exception:
-            return (cid, [])
+            return (cid, None)
 
 
 def _extract_ghs_pictograms(data: dict) -> list[str]:
@@ -2219,24 +3201,65 @@ def _walk_sections_for_pictograms(sections: list, codes: set) -> None:
                         codes.add(match.group(1))
 
 
+_PROPERTY_FIELDS = ("smiles", "formula", "mw", "iupac", "title")
+
+
+def _apply_properties(result: dict, prop: dict, fetched_at: str) -> None:
+    """Merge one PUG REST property record into the compound info dict."""
+    cid_key = str(prop.get("CID", ""))
+    if not cid_key:
+        return
+    entry = result.setdefault(cid_key, {})
+    entry.update({
+        "smiles": prop.get("CanonicalSMILES") or prop.get("ConnectivitySMILES", ""),
+        "formula": prop.get("MolecularFormula", ""),
+        "mw": str(prop.get("MolecularWeight", "")),
+        "iupac": prop.get("IUPACName", ""),
+        "title": prop.get("Title", ""),
+        "fetched_at": fetched_at,
+    })
+    entry.pop("source", None)  # no longer (only) from extract files
+
+
+def _apply_ghs(result: dict, cid: int, pictograms: list[str] | None, fetched_at: str) -> None:
+    """Merge GHS pictograms for one CID, keeping old data if the fetch failed."""
+    entry = result.setdefault(str(cid), {})
+    if pictograms is None:
+        # Failed request: keep what we had, but make sure the key exists
+        entry.setdefault("ghs_pictograms", [])
+        return
+    entry["ghs_pictograms"] = pictograms
+    entry.setdefault("fetched_at", fetched_at)
+
+
 async def fetch_compound_properties(
     cids: list[int],
     existing_info: dict,
     progress_cb=None,
+    checkpoint_cb=None,
 ) -> dict:
     """
     Fetch compound properties and GHS data from PubChem for the given CIDs.
 
+    Only CIDs missing (or missing fields) in *existing_info* are fetched;
+    keeping existing entries fresh is the job of refresh_compound_info().
+
     Args:
         cids: List of CID integers to fetch
         existing_info: Existing compound info dict (compounds section)
         progress_cb: Optional callback(fetched_count, total_count)
+        checkpoint_cb: Optional callback(result) every 50 GHS results, to
+            save progress; the caller merges it into the stored info
 
     Returns:
         Dict mapping CID string to compound info dict
     """
-    result = dict(existing_info)
-    cids_need_props = [c for c in cids if str(c) not in result]
+    result = {cid: dict(entry) for cid, entry in existing_info.items()}
+    # Entries partially filled from extract files still need the missing fields
+    cids_need_props = [
+        c for c in cids
+        if not all(k in result.get(str(c), {}) for k in _PROPERTY_FIELDS)
+    ]
     cids_need_ghs = [c for c in cids if str(c) not in result or "ghs_pictograms" not in result.get(str(c), {})]
 
     total = len(cids_need_props) + len(cids_need_ghs)
@@ -2252,17 +3275,9 @@ async def fetch_compound_properties(
         for i in range(0, len(cids_need_props), 200):
             chunk = cids_need_props[i : i + 200]
             props_list = await _fetch_bulk_properties(session, chunk, semaphore)
+            now = datetime.now().isoformat()
             for prop in props_list:
-                cid_key = str(prop.get("CID", ""))
-                if not cid_key:
-                    continue
-                result[cid_key] = {
-                    "smiles": prop.get("CanonicalSMILES") or prop.get("ConnectivitySMILES", ""),
-                    "formula": prop.get("MolecularFormula", ""),
-                    "mw": str(prop.get("MolecularWeight", "")),
-                    "iupac": prop.get("IUPACName", ""),
-                    "title": prop.get("Title", ""),
-                }
+                _apply_properties(result, prop, now)
             fetched += len(chunk)
             if progress_cb:
                 progress_cb(fetched, total)
@@ -2272,22 +3287,1100 @@ async def fetch_compound_properties(
         save_counter = 0
         for coro in asyncio.as_completed(tasks):
             cid, pictograms = await coro
-            cid_key = str(cid)
-            if cid_key not in result:
-                result[cid_key] = {}
-            result[cid_key]["ghs_pictograms"] = pictograms
+            _apply_ghs(result, cid, pictograms, datetime.now().isoformat())
             fetched += 1
             save_counter += 1
             if progress_cb:
                 progress_cb(fetched, total)
             # Incremental save every 50 CIDs
-            if save_counter >= 50:
+            if save_counter >= 50 and checkpoint_cb:
                 save_counter = 0
-                save_compound_info({"version": 1, "compounds": result})
+                checkpoint_cb(result)
 
     return result
 
 
+def _timestamp(iso: str | None) -> float:
+    """POSIX time of an ISO timestamp (0.0 if missing or invalid)."""
+    try:
+        return datetime.fromisoformat(iso).timestamp() if iso else 0.0
+    except ValueError:
+        return 0.0
+
+
+def select_stale_cids(
+    compounds: dict,
+    cids: list[int],
+    max_age_days: float = COMPOUND_INFO_MAX_AGE_DAYS,
+    limit: int | None = None,
+) -> list[int]:
+    """
+    Pick the CIDs whose compound info is oldest, for a budgeted refresh.
+
+    Entries without a fetched_at timestamp (written before timestamps were
+    recorded) count as the oldest. CIDs with no entry at all are skipped —
+    those are fetched by fetch_compound_properties(). A CID whose refresh
+    failed (refresh_attempted_at newer than fetched_at) waits
+    COMPOUND_REFRESH_RETRY_DAYS and then queues by its last attempt, so
+    permanently failing CIDs cannot use up every cycle's budget.
+
+    Returns:
+        CIDs older than *max_age_days*, oldest first, at most *limit* of them
+    """
+    now = datetime.now().timestamp()
+    cutoff = now - max_age_days * 86400
+    retry_cutoff = now - COMPOUND_REFRESH_RETRY_DAYS * 86400
+    aged: list[tuple[float, int]] = []
+    for cid in cids:
+        entry = compounds.get(str(cid))
+        if entry is None:
+            continue
+        ts = _timestamp(entry.get("fetched_at"))
+        if ts >= cutoff:
+            continue
+        attempted = _timestamp(entry.get("refresh_attempted_at"))
+        if attempted > ts:
+            if attempted >= retry_cutoff:
+                continue
+            ts = attempted
+        aged.append((ts, cid))
+    aged.sort()
+    stale = [cid for _, cid in aged]
+    return stale[:limit] if limit is not None else stale
+
+
+def cids_for_request_budget(budget: int) -> int:
+    """How many CIDs a refresh can cover with *budget* PubChem requests.
+
+    Each CID costs one PUG View (GHS) request plus 1/200 of a bulk property
+    request.
+    """
+    if budget <= 0:
+        return 0
+    return max(1, budget * 200 // 201)
+
+
+async def refresh_compound_info(
+    cids: list[int],
+    existing_info: dict,
+    progress_cb=None,
+    concurrency: int = 2,
+) -> dict:
+    """
+    Re-fetch properties and GHS data for CIDs that are already cached.
+
+    Runs at low priority (few concurrent requests) and never drops data: if a
+    request fails, the previous values for that CID are kept. Every entry
+    gets a refresh_attempted_at timestamp (see select_stale_cids).
+
+    Args:
+        cids: CIDs to refresh (typically from select_stale_cids())
+        existing_info: Existing compound info dict (compounds section)
+        progress_cb: Optional callback(refreshed_count, total_count)
+        concurrency: Max concurrent PubChem requests
+
+    Returns:
+        Dict with only the refreshed CID entries (merge into the full dict)
+    """
+    refreshed = {str(c): dict(existing_info.get(str(c), {})) for c in cids}
+    attempted_at = datetime.now().isoformat()
+    for entry in refreshed.values():
+        entry["refresh_attempted_at"] = attempted_at
+    total = len(cids)
+    done = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession() as session:
+        for i in range(0, len(cids), 200):
+            chunk = cids[i : i + 200]
+            props_list = await _fetch_bulk_properties(session, chunk, semaphore)
+            now = datetime.now().isoformat()
+            for prop in props_list:
+                _apply_properties(refreshed, prop, now)
+
+        tasks = [_fetch_ghs_for_cid(session, cid, semaphore) for cid in cids]
+        for coro in asyncio.as_completed(tasks):
+            cid, pictograms = await coro
+            _apply_ghs(refreshed, cid, pictograms, datetime.now().isoformat())
+            done += 1
+            if progress_cb:
+                progress_cb(done, total)
+
+    return refreshed
+
+
+def _write_atomic(path: Path, content: bytes) -> None:
+    """Write bytes via a temp file so readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    tmp.write_bytes(content)
+    os.replace(tmp, path)
+
+
+def structure_image_url(cid: int, size: str = "s") -> str:
+    """PubChem image server URL for a structure depiction (size "s" or "l")."""
+    return f"{PUBCHEM_IMAGE_URL}?cid={cid}&t={size}"
+
+
+def structure_image_path(cid: int, size: str = "s") -> Path:
+    """Disk cache location of a structure image."""
+    return IMAGE_CACHE_DIR / size / f"{cid}.png"
+
+
+def get_structure_image(cid: int, size: str = "s") -> Path | None:
+    """
+    Return the cached structure image for a CID, fetching it on a miss.
+
+    Returns:
+        Path to the PNG, or None if PubChem could not be reached
+    """
+    path = structure_image_path(cid, size)
+    if path.exists():
+        return path
+    try:
+        resp = requests.get(structure_image_url(cid, size), timeout=15)
+    except requests.RequestException as e:
+        logger.debug("Structure image fetch failed for CID %d: %s", cid, e)
+        return None
+    if resp.status_code != 200 or not resp.headers.get("Content-Type", "").startswith("image/"):
+        logger.debug("Structure image HTTP %d for CID %d", resp.status_code, cid)
+        return None
+    _write_atomic(path, resp.content)
+    return path
+
+
+async def prefetch_structure_images(
+    cids: list[int],
+    size: str = "s",
+    progress_cb=None,
+    concurrency: int = 2,
+) -> int:
+    """
+    Download structure images for all CIDs not yet in the disk cache.
+
+    Rate limited to stay well under PubChem's request limit, so it can run in
+    the background while the app is in use.
+
+    Returns:
+        Number of images downloaded
+    """
+    missing = [c for c in cids if not structure_image_path(c, size).exists()]
+    total = len(missing)
+    done = 0
+    downloaded = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_one(session: aiohttp.ClientSession, cid: int) -> bool:
+        async with semaphore:
+            await wait_for_pubchem_slot_async()
+            try:
+                async with session.get(
+                    structure_image_url(cid, size), timeout=aiohttp.ClientTimeout(total=30)
+                ) as resp:
+                    if resp.status != 200 or not resp.content_type.startswith("image/"):
+                        return False
+                    content = await resp.read()
+            except Exception:
+                return False
+        _write_atomic(structure_image_path(cid, size), content)
+        return True
+
+    if progress_cb:
+        progress_cb(done, total)
+    async with aiohttp.ClientSession() as session:
+        tasks = [fetch_one(session, cid) for cid in missing]
+        for coro in asyncio.as_completed(tasks):
+            if await coro:
+                downloaded += 1
+            done += 1
+            if progress_cb:
+                progress_cb(done, total)
+    return downloaded
+
+
+def get_ghs_pictogram(code: str) -> Path | None:
+    """
+    Return a GHS pictogram SVG: bundled copy first, then disk cache, then PubChem.
+
+    Returns:
+        Path to the SVG, or None for unknown codes or if it could not be fetched
+    """
+    if code not in GHS_CODES:
+        return None
+    bundled = GHS_BUNDLE_DIR / f"{code}.svg"
+    if bundled.exists():
+        return bundled
+    cached = IMAGE_CACHE_DIR / "ghs" / f"{code}.svg"
+    if cached.exists():
+        return cached
+    try:
+        resp = requests.get(PUBCHEM_GHS_URL.format(code=code), timeout=15)
+    except requests.RequestException as e:
+        logger.debug("GHS pictogram fetch failed for %s: %s", code, e)
+        return None
+    if resp.status_code != 200:
+        return None
+    _write_atomic(cached, resp.content)
+    return cached
+
+
+def build_ghs_sprite() -> tuple[str, bool]:
+    """
+    Combine the GHS pictograms into a single SVG stack.
+
+    Each pictogram becomes a nested <svg id="GHS0x"> that is only shown when
+    targeted, so ``sprite.svg#GHS02`` renders one pictogram from one file.
+
+    Returns:
+        (svg_text, complete) — complete is False if some pictograms were
+        unavailable (the caller should not cache the result for long)
+    """
+    parts = []
+    complete = True
+    for code in GHS_CODES:
+        path = get_ghs_pictogram(code)
+        if path is None:
+            complete = False
+            continue
+        svg = path.read_text(encoding="utf-8")
+        svg = re.sub(r"<\?xml[^>]*\?>|<!DOCTYPE[^>]*>", "", svg).strip()
+        svg = re.sub(
+            r"<svg\b[^>]*>",
+            lambda m: re.sub(r'\sid="[^"]*"', "", m.group(0)).replace("<svg", f'<svg id="{code}"', 1),
+            svg,
+            count=1,
+        )
+        parts.append(svg)
+    sprite = (
+        '<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">'
+        "<style>:root>svg{display:none}:root>svg:target{display:inline}</style>"
+        + "".join(parts)
+        + "</svg>"
+    )
+    return sprite, complete
+
+
+# Standard atomic weights (IUPAC, abridged), used to derive average molecular
+# weight from formulas in the PubChem extract files
+ATOMIC_WEIGHTS = {
+    "H": 1.008, "D": 2.014, "T": 3.016, "He": 4.0026, "Li": 6.94, "Be": 9.0122,
+    "B": 10.81, "C": 12.011, "N": 14.007, "O": 15.999, "F": 18.998, "Ne": 20.180,
+    "Na": 22.990, "Mg": 24.305, "Al": 26.982, "Si": 28.085, "P": 30.974, "S": 32.06,
+    "Cl": 35.45, "Ar": 39.95, "K": 39.098, "Ca": 40.078, "Sc": 44.956, "Ti": 47.867,
+    "V": 50.942, "Cr": 51.996, "Mn": 54.938, "Fe": 55.845, "Co": 58.933, "Ni": 58.693,
+    "Cu": 63.546, "Zn": 65.38, "Ga": 69.723, "Ge": 72.630, "As": 74.922, "Se": 78.971,
+    "Br": 79.904, "Kr": 83.798, "Rb": 85.468, "Sr": 87.62, "Y": 88.906, "Zr": 91.224,
+    "Nb": 92.906, "Mo": 95.95, "Tc": 98.0, "Ru": 101.07, "Rh": 102.91, "Pd": 106.42,
+    "Ag": 107.87, "Cd": 112.41, "In": 114.82, "Sn": 118.71, "Sb": 121.76, "Te": 127.60,
+    "I": 126.90, "Xe": 131.29, "Cs": 132.91, "Ba": 137.33, "La": 138.91, "Ce": 140.12,
+    "Pr": 140.91, "Nd": 144.24, "Pm": 145.0, "Sm": 150.36, "Eu": 151.96, "Gd": 157.25,
+    "Tb": 158.93, "Dy": 162.50, "Ho": 164.93, "Er": 167.26, "Tm": 168.93, "Yb": 173.05,
+    "Lu": 174.97, "Hf": 178.49, "Ta": 180.95, "W": 183.84, "Re": 186.21, "Os": 190.23,
+    "Ir": 192.22, "Pt": 195.08, "Au": 196.97, "Hg": 200.59, "Tl": 204.38, "Pb": 207.2,
+    "Bi": 208.98, "Po": 209.0, "At": 210.0, "Rn": 222.0, "Fr": 223.0, "Ra": 226.0,
+    "Ac": 227.0, "Th": 232.04, "Pa": 231.04, "U": 238.03, "Np": 237.0, "Pu": 244.0,
+    "Am": 243.0, "Cm": 247.0, "Bk": 247.0, "Cf": 251.0, "Es": 252.0, "Fm": 257.0,
+    "Md": 258.0, "No": 259.0, "Lr": 266.0,
+}
+
+_FORMULA_TOKEN = re.compile(r"([A-Z][a-z]?)(\d*)")
+
+
+def parse_formula(formula: str) -> dict[str, int] | None:
+    """
+    Parse a PubChem molecular formula into element counts.
+
+    Charges ("+", "-2") are ignored and dot-separated components with an
+    optional multiplier ("CuO4S.5H2O") are summed. Returns None if the
+    formula contains anything other than element symbols, counts and
+    charges.
+    """
+    counts: dict[str, int] = {}
+    for component in formula.strip().split("."):
+        m = re.match(r"^(\d*)(.*?)(?:[+-]\d*)?$", component.strip())
+        multiplier = int(m.group(1) or 1)
+        body = m.group(2)
+        if not body:
+            return None
+        pos = 0
+        for m in _FORMULA_TOKEN.finditer(body):
+            if m.start() != pos or m.group(1) not in ATOMIC_WEIGHTS:
+                return None
+            counts[m.group(1)] = counts.get(m.group(1), 0) + int(m.group(2) or 1) * multiplier
+            pos = m.end()
+        if pos != len(body):
+            return None
+    return counts
+
+
+def formula_weight(formula: str) -> float | None:
+    """Average molecular weight of a formula, or None if it cannot be parsed."""
+    counts = parse_formula(formula)
+    if counts is None:
+        return None
+    return sum(ATOMIC_WEIGHTS[el] * n for el, n in counts.items())
+
+
+# ---------------------------------------------------------------------------
+# Element composition index (local formula queries)
+# ---------------------------------------------------------------------------
+#
+# Formula queries are whitespace separated conditions, all of which must
+# hold:
+#
+#   Hg  +Hg  has:Hg,Br     contains the element(s)
+#   -N  lacks:N  no:N      does not contain the element(s)
+#   N=1  C>=6  Cl<3        element count comparison (=, >=, <=, >, <)
+#   C:6-8                  element count range
+#   halogen                any of F, Cl, Br, I (X stands for their total: X>=2)
+#   only:CHNO              no elements besides these
+#   dbe>=4  dbe:4          double bond equivalents (rings + pi bonds)
+#   C6H6  exact:C6H6       exact molecular formula
+#
+# e.g. "C=6 N=1 dbe>=4" for C6 aromatics with exactly one nitrogen.
+
+ELEMENT_SYMBOLS = list(ATOMIC_WEIGHTS)
+_ELEMENT_COLUMN = {el: i for i, el in enumerate(ELEMENT_SYMBOLS)}
+HALOGENS = ("F", "Cl", "Br", "I")
+_COUNT_CONDITION = re.compile(r"^([A-Z][a-z]?|X)(=|==|>=|<=|>|<)(\d+)$")
+_COUNT_RANGE = re.compile(r"^([A-Z][a-z]?|X):(\d+)-(\d+)$")
+_DBE_CONDITION = re.compile(r"^dbe(=|==|>=|<=|>|<|:)(-?\d+(?:\.5)?)$", re.IGNORECASE)
+_COMPARE = {
+    "=": np.equal, "==": np.equal, ":": np.equal,
+    ">=": np.greater_equal, "<=": np.less_equal, ">": np.greater, "<": np.less,
+}
+
+_element_index: dict | None = None
+_element_index_lock = threading.Lock()
+
+
+def get_element_index(rows: list[dict], compounds: dict) -> dict:
+    """
+    Element counts of every inventory compound as a numeric matrix.
+
+    Formulas come from compound info, or the RUG table where PubChem has
+    none. Rebuilt only when the formulas change.
+
+    Returns:
+        {"cids": int32 array, "counts": uint16 matrix (cid x ELEMENT_SYMBOLS),
+         "unparsed": number of CIDs without a usable formula}
+    """
+    global _element_index
+    index = _element_index
+    if index is not None and index["sources"][0] is rows and index["sources"][1] is compounds:
+        return index  # same loaded data as last time (see read_json_file)
+    formulas = {}
+    for row in rows:
+        try:
+            cid = int(row.get("CID"))
+        except (TypeError, ValueError):
+            continue
+        formula = (compounds.get(str(cid)) or {}).get("formula") or row.get("Formula") or ""
+        if formula and cid not in formulas:
+            formulas[cid] = str(formula)
+    cids = sorted(formulas)
+    key = hashlib.sha256("\n".join(f"{c}\t{formulas[c]}" for c in cids).encode()).hexdigest()
+
+    with _element_index_lock:
+        if _element_index is not None and _element_index["key"] == key:
+            _element_index["sources"] = (rows, compounds)
+            return _element_index
+        counts = np.zeros((len(cids), len(ELEMENT_SYMBOLS)), dtype=np.uint16)
+        keep = np.zeros(len(cids), dtype=bool)
+        for i, cid in enumerate(cids):
+            parsed = parse_formula(formulas[cid])
+            if parsed is None:
+                continue
+            keep[i] = True
+            for el, n in parsed.items():
+                counts[i, _ELEMENT_COLUMN[el]] = min(n, 65535)
+        _element_index = {
+            "key": key,
+            "sources": (rows, compounds),
+            "cids": np.array(cids, dtype=np.int32)[keep],
+            "counts": counts[keep],
+            "unparsed": int((~keep).sum()),
+        }
+        return _element_index
+
+
+def _element_columns(spec: str) -> list[int]:
+    """Column indexes for "Hg", "Hg,Br" or "CHNO"-style element lists."""
+    symbols = re.findall(r"[A-Z][a-z]?", spec)
+    if not symbols or "".join(symbols) != re.sub(r"[\s,]", "", spec):
+        raise ValueError(f"Invalid element list '{spec}'")
+    unknown = [el for el in symbols if el not in _ELEMENT_COLUMN]
+    if unknown:
+        raise ValueError(f"Unknown element '{unknown[0]}'")
+    return [_ELEMENT_COLUMN[el] for el in symbols]
+
+
+def _element_counts(counts: np.ndarray, symbol: str) -> np.ndarray:
+    if symbol == "X":
+        return counts[:, [_ELEMENT_COLUMN[el] for el in HALOGENS]].sum(axis=1, dtype=np.int32)
+    return counts[:, _element_columns(symbol)[0]].astype(np.int32)
+
+
+def _double_bond_equivalents(counts: np.ndarray) -> np.ndarray:
+    """1 + C + Si - (H + X)/2 + (N + P)/2 for each row."""
+    col = _ELEMENT_COLUMN
+    c = counts.astype(np.float64)
+    return (
+        1 + c[:, col["C"]] + c[:, col["Si"]]
+        - (c[:, col["H"]] + c[:, col["D"]] + _element_counts(counts, "X")) / 2
+        + (c[:, col["N"]] + c[:, col["P"]]) / 2
+    )
+
+
+def formula_query_mask(query: str, counts: np.ndarray) -> np.ndarray:
+    """
+    Rows of an element count matrix matching a formula query (see above).
+
+    Raises:
+        ValueError: for conditions that cannot be parsed
+    """
+    terms = query.split()
+    if not terms:
+        raise ValueError("Empty formula query")
+    mask = np.ones(len(counts), dtype=bool)
+    for term in terms:
+        prefix, sep, rest = term.partition(":")
+        prefix = prefix.lower() if sep else ""
+        if term.lower() in ("halogen", "halogenated", "halogens"):
+            mask &= _element_counts(counts, "X") > 0
+        elif prefix == "has" or term.startswith("+"):
+            cols = _element_columns(rest if prefix else term[1:])
+            mask &= (counts[:, cols] > 0).all(axis=1)
+        elif prefix in ("lacks", "no") or term.startswith("-"):
+            cols = _element_columns(rest if prefix else term[1:])
+            mask &= (counts[:, cols] == 0).all(axis=1)
+        elif prefix == "only":
+            others = np.ones(counts.shape[1], dtype=bool)
+            others[_element_columns(rest)] = False
+            mask &= (counts[:, others] == 0).all(axis=1)
+        elif _DBE_CONDITION.match(term):
+            op, value = _DBE_CONDITION.match(term).groups()
+            mask &= _COMPARE[op](_double_bond_equivalents(counts), float(value))
+        elif _COUNT_CONDITION.match(term):
+            symbol, op, value = _COUNT_CONDITION.match(term).groups()
+            mask &= _COMPARE[op](_element_counts(counts, symbol), int(value))
+        elif _COUNT_RANGE.match(term):
+            symbol, lo, hi = _COUNT_RANGE.match(term).groups()
+            n = _element_counts(counts, symbol)
+            mask &= (n >= int(lo)) & (n <= int(hi))
+        else:
+            exact = parse_formula(rest if prefix == "exact" else term)
+            if exact is None:
+                raise ValueError(f"Invalid formula condition '{term}'")
+            if prefix != "exact" and len(exact) == 1 and list(exact.values()) == [1] and term in _ELEMENT_COLUMN:
+                # A bare element symbol ("Hg") means "contains"
+                mask &= counts[:, _ELEMENT_COLUMN[term]] > 0
+                continue
+            wanted = np.zeros(counts.shape[1], dtype=np.int64)
+            for el, n in exact.items():
+                wanted[_ELEMENT_COLUMN[el]] = n
+            mask &= (counts == wanted).all(axis=1)
+    return mask
+
+
+def formula_query_cids(query: str, rows: list[dict], compounds: dict) -> np.ndarray:
+    """CID set of inventory compounds matching a formula query."""
+    index = get_element_index(rows, compounds)
+    return cid_array(index["cids"][formula_query_mask(query, index["counts"])])
+
+
+# ---------------------------------------------------------------------------
+# Local name index (typo-tolerant name / CAS search over the inventory)
+# ---------------------------------------------------------------------------
+#
+# Names are split into lower-case words and indexed by word trigrams (as in
+# PostgreSQL's pg_trgm). A query matches a name when enough of its trigrams
+# occur in it, so "benzne", "sodium chlorid" and "dinitrophenol" all find
+# their compounds without asking PubChem.
+
+NAME_INDEX_FIELDS = ("Name", "GROSname")  # RUG columns; plus PubChem title and IUPAC name
+NAME_MIN_SCORE = 0.5  # fraction of the query's trigrams that must occur in a name
+_NAME_SEPARATORS = re.compile(r"[\W_]+")
+
+_name_index: dict | None = None
+_name_index_lock = threading.Lock()
+
+
+def _name_words(text: str) -> list[str]:
+    return _NAME_SEPARATORS.sub(" ", text.casefold()).split()
+
+
+def _name_trigrams(words: list[str]) -> set[str]:
+    grams = set()
+    for word in words:
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def get_name_index(rows: list[dict], compounds: dict) -> dict:
+    """
+    Trigram index over the names of every inventory compound.
+
+    Indexes the RUG Name and GROSname columns and the PubChem title and IUPAC
+    name from compound info. Rebuilt only when the names change.
+
+    Returns:
+        {"cids", "texts", "norms": per indexed name, "sizes": trigram count
+         per name, "postings": trigram -> int32 array of name positions,
+         "sources": the (rows, compounds) it was built from}
+
+    CAS numbers are not indexed here: they are looked up in the RUG row
+    index (get_rug_row_index), which follows every change of the table.
+    """
+    global _name_index
+    index = _name_index
+    if index is not None and index["sources"][0] is rows and index["sources"][1] is compounds:
+        return index  # same loaded data as last time (see read_json_file)
+    names: dict[tuple[int, str], None] = {}
+    for row in rows:
+        try:
+            cid = int(row.get("CID"))
+        except (TypeError, ValueError):
+            continue
+        ci = compounds.get(str(cid)) or {}
+        for text in [row.get(f) for f in NAME_INDEX_FIELDS] + [ci.get("title"), ci.get("iupac")]:
+            if text and isinstance(text, str) and text.strip():
+                names[(cid, text.strip())] = None
+    key = hashlib.sha256("\n".join(f"{c}\t{t}" for c, t in names).encode()).hexdigest()
+
+    with _name_index_lock:
+        if _name_index is not None and _name_index["key"] == key:
+            _name_index["sources"] = (rows, compounds)
+            return _name_index
+        postings: dict[str, list[int]] = {}
+        cids, texts, norms, sizes = [], [], [], []
+        for i, (cid, text) in enumerate(names):
+            words = _name_words(text)
+            grams = _name_trigrams(words)
+            cids.append(cid)
+            texts.append(text)
+            norms.append(" ".join(words))
+            sizes.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        _name_index = {
+            "key": key,
+            "sources": (rows, compounds),
+            "cids": np.array(cids, dtype=np.int32),
+            "texts": texts,
+            "norms": norms,
+            "sizes": np.array(sizes, dtype=np.int32),
+            "postings": {g: np.array(p, dtype=np.int32) for g, p in postings.items()},
+        }
+        return _name_index
+
+
+def local_name_search(query: str, index: dict, min_score: float = NAME_MIN_SCORE,
+                      limit: int | None = None) -> list[dict]:
+    """
+    Rank inventory compounds by how well one of their names matches *query*.
+
+    CAS numbers match exactly. Otherwise the score is the fraction of the
+    query's trigrams found in the name; ties prefer the name closest in
+    length (trigram Jaccard similarity), so exact names come first.
+
+    Returns:
+        [{"cid", "name", "score", "exact"}], best first, one entry per CID
+    """
+    query = query.strip()
+    if CAS_PATTERN.match(query):
+        row_index = get_rug_row_index(index["sources"][0])
+        row_cids = row_index["row_cids"][row_index["cas"].get(query, [])]
+        return [
+            {"cid": int(cid), "name": query, "score": 1.0, "exact": True}
+            for cid in np.unique(row_cids[row_cids >= 0])
+        ]
+    words = _name_words(query)
+    grams = _name_trigrams(words)
+    lists = [index["postings"][g] for g in grams if g in index["postings"]]
+    if not lists:
+        return []
+    shared = np.bincount(np.concatenate(lists), minlength=len(index["cids"]))
+    candidates = np.flatnonzero(shared >= min_score * len(grams))
+    shared = shared[candidates]
+    score = shared / len(grams)
+    jaccard = shared / (len(grams) + index["sizes"][candidates] - shared)
+    norm = " ".join(words)
+
+    best: dict[int, dict] = {}
+    for i in np.lexsort((-jaccard, -score)):
+        pos = candidates[i]
+        cid = int(index["cids"][pos])
+        if cid not in best:
+            best[cid] = {
+                "cid": cid,
+                "name": index["texts"][pos],
+                "score": round(float(score[i]), 3),
+                "exact": index["norms"][pos] == norm,
+            }
+    results = list(best.values())
+    return results[:limit] if limit else results
+
+
+def name_search_cids(query: str, rows: list[dict], compounds: dict) -> np.ndarray:
+    """
+    CID set for a name / CAS search of the inventory.
+
+    Compounds whose name matches the query exactly (ignoring case and
+    punctuation) win; only without an exact match are the fuzzy matches
+    used, and then only those with the best score, so "benzene" finds
+    benzene rather than every benzene derivative and "sodium chlorid"
+    finds sodium chloride but not calcium chloride. The set is combined
+    with the inventory as is, so near misses must not slip in; the full
+    ranking stays available from local_name_search().
+    """
+    matches = local_name_search(query, get_name_index(rows, compounds))
+    exact = [m["cid"] for m in matches if m["exact"]]
+    if exact or not matches:
+        return cid_array(exact)
+    return cid_array([m["cid"] for m in matches if m["score"] == matches[0]["score"]])
+
+
+# PubChem FTP extract files (pubchem/Compound/Extras/), tab-separated,
+# CID in the first column. Maps file name -> compound info fields by column.
+PUBCHEM_EXTRACT_FILES = {
+    "CID-Title": {1: "title"},
+    "CID-SMILES": {1: "smiles"},
+    "CID-IUPAC": {1: "iupac"},
+    "CID-Mass": {1: "formula"},  # CID, formula, monoisotopic mass, exact mass
+}
+
+
+def find_extract_files(directory: Path) -> dict[str, Path]:
+    """Locate PubChem extract files (plain or .gz) in a directory."""
+    found = {}
+    for name in PUBCHEM_EXTRACT_FILES:
+        for candidate in (directory / name, directory / f"{name}.gz"):
+            if candidate.exists():
+                found[name] = candidate
+                break
+    return found
+
+
+def _open_extract(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+
+def ingest_pubchem_extracts(
+    directory: Path,
+    cids: list[int],
+    existing_info: dict,
+    progress_cb=None,
+) -> tuple[dict, dict]:
+    """
+    Populate compound info from locally stored PubChem extract files.
+
+    Each file is streamed once, keeping only rows whose CID is in *cids*, so
+    the multi-GB extracts never have to fit in memory and no API requests are
+    made. GHS pictograms are not in the extracts; entries are left without a
+    ghs_pictograms key so the normal fetch picks those up.
+
+    Entries with API data only get the fields they are missing; the rest are
+    overwritten. Any entry given extract data is stamped with the oldest
+    date it now holds (the extract file's modification time, if older), so
+    the refresh scheduler treats old extracts as stale.
+
+    Args:
+        directory: Directory containing CID-Title, CID-SMILES, CID-IUPAC
+            and/or CID-Mass (optionally gzipped)
+        cids: Inventory CIDs to keep
+        existing_info: Existing compound info dict (compounds section)
+        progress_cb: Optional callback(files_done, files_total)
+
+    Returns:
+        (compounds, stats) — the merged compounds dict and per-file match counts
+    """
+    files = find_extract_files(directory)
+    if not files:
+        raise FileNotFoundError(
+            f"No PubChem extract files ({', '.join(PUBCHEM_EXTRACT_FILES)}) found in {directory}"
+        )
+
+    wanted = {str(c) for c in cids}
+    result = {cid: dict(entry) for cid, entry in existing_info.items()}
+    from_api = {cid for cid, entry in existing_info.items() if entry.get("source") != "extract"}
+    stamped = set()  # extract entries already dated by an earlier file of this ingest
+    stats = {}
+    if progress_cb:
+        progress_cb(0, len(files))
+
+    for i, (name, path) in enumerate(files.items()):
+        columns = PUBCHEM_EXTRACT_FILES[name]
+        last_col = max(columns)
+        fetched_at = datetime.fromtimestamp(path.stat().st_mtime).isoformat()
+        matched = 0
+        logger.info("Ingesting %s", path)
+        with _open_extract(path) as f:
+            for line in f:
+                cid_key, _, rest = line.partition("\t")
+                if cid_key not in wanted:
+                    continue
+                fields = rest.rstrip("\n").split("\t", last_col)
+                entry = result.setdefault(cid_key, {})
+                api = cid_key in from_api
+                changed = False
+                for col, field in columns.items():
+                    if col - 1 < len(fields) and not (api and entry.get(field)):
+                        entry[field] = fields[col - 1]
+                        changed = True
+                if name == "CID-Mass" and not (api and entry.get("mw")):
+                    mw = formula_weight(entry.get("formula", ""))
+                    entry["mw"] = f"{mw:.2f}" if mw is not None else ""
+                    changed = True
+                matched += 1
+                if not changed:
+                    continue
+                if not (api or cid_key in stamped) or _timestamp(fetched_at) < _timestamp(entry.get("fetched_at")):
+                    entry["fetched_at"] = fetched_at
+                stamped.add(cid_key)
+                if not api:
+                    entry["source"] = "extract"
+        stats[name] = matched
+        logger.info("  %s: %d of %d CIDs matched", name, matched, len(wanted))
+        if progress_cb:
+            progress_cb(i + 1, len(files))
+
+    return result, stats
+
+
+# ---------------------------------------------------------------------------
+# Local structure search (optional, needs RDKit)
+# ---------------------------------------------------------------------------
+#
+# Substructure / superstructure / similarity searches over the inventory
+# without PubChem's SearchMaxRecords cut-off. Every inventory SMILES gets a
+# pattern fingerprint (substructure screen) and a Morgan fingerprint
+# (Tanimoto similarity), packed into uint64 matrices and cached in
+# data/structure_index.npz. A query is screened against the whole matrix
+# with vectorized bit operations and only the survivors are matched exactly.
+
+STRUCTURE_INDEX_FILE = DATA_DIR / "structure_index.npz"
+PATTERN_FP_BITS = 2048
+MORGAN_FP_BITS = 2048
+MORGAN_RADIUS = 2
+STRUCTURE_MAX_UNSEARCHED = 0.01  # fall back to PubChem if more of the inventory has no structure
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+_structure_index: dict | None = None
+_structure_index_lock = threading.Lock()
+_structure_mols: dict[int, object] = {}
+
+
+def _rdkit():
+    """Import RDKit lazily; returns (Chem, rdFingerprintGenerator) or None."""
+    try:
+        from rdkit import Chem, RDLogger
+        from rdkit.Chem import rdFingerprintGenerator
+    except ImportError:
+        return None
+    RDLogger.DisableLog("rdApp.*")
+    return Chem, rdFingerprintGenerator
+
+
+def has_rdkit() -> bool:
+    return _rdkit() is not None
+
+
+def popcount_words(words: np.ndarray) -> np.ndarray:
+    """Number of set bits in each uint64 element (same shape, uint8)."""
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(words)
+    words = np.ascontiguousarray(words)
+    return _POPCOUNT8[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def popcount_rows(words: np.ndarray) -> np.ndarray:
+    """Number of set bits in each row of a uint64 matrix (or in a vector)."""
+    return popcount_words(words).sum(axis=-1, dtype=np.int32)
+
+
+def _pack_bits(bits: np.ndarray) -> np.ndarray:
+    """0/1 vector (length a multiple of 64) -> uint64 words."""
+    return np.packbits(np.asarray(bits, dtype=np.uint8), bitorder="little").view(np.uint64)
+
+
+def _structure_fingerprints(mol, rd) -> tuple[np.ndarray, np.ndarray]:
+    """(pattern, morgan) fingerprints of a molecule as uint64 words."""
+    Chem, fpgen = rd
+    pattern = Chem.PatternFingerprint(mol, fpSize=PATTERN_FP_BITS).ToBitString()
+    morgan = fpgen.GetMorganGenerator(radius=MORGAN_RADIUS, fpSize=MORGAN_FP_BITS)
+    return (
+        _pack_bits(np.frombuffer(pattern.encode(), dtype=np.uint8) - ord("0")),
+        _pack_bits(morgan.GetFingerprintAsNumPy(mol)),
+    )
+
+
+def _load_structure_index_file() -> dict | None:
+    try:
+        with np.load(STRUCTURE_INDEX_FILE) as data:
+            return {name: data[name] for name in data.files}
+    except (FileNotFoundError, OSError, ValueError, KeyError):
+        return None
+
+
+def get_structure_index(cids, compounds: dict) -> dict | None:
+    """
+    Fingerprint index of the inventory structures, or None without RDKit.
+
+    Built from the SMILES in compound info; only structures that are new or
+    changed since the cached index are fingerprinted again.
+
+    Returns:
+        {"key", "cids", "smiles", "pattern", "morgan", "morgan_counts"}
+    """
+    global _structure_index
+    rd = _rdkit()
+    if rd is None:
+        return None
+    pairs = sorted(
+        (cid, compounds[str(cid)]["smiles"])
+        for cid in {int(c) for c in cids}
+        if (compounds.get(str(cid)) or {}).get("smiles")
+    )
+    key = hashlib.sha256("\n".join(f"{c}\t{s}" for c, s in pairs).encode()).hexdigest()
+
+    with _structure_index_lock:
+        if _structure_index is not None and _structure_index["key"] == key:
+            return _structure_index
+        cached = _structure_index if _structure_index is not None else _load_structure_index_file()
+        if cached is not None and str(cached["key"]) == key:
+            index = cached
+        else:
+            reuse = {}
+            if cached is not None:
+                reuse = {
+                    (int(c), str(s)): i
+                    for i, (c, s) in enumerate(zip(cached["cids"], cached["smiles"]))
+                }
+            start = time.time()
+            Chem = rd[0]
+            keep_cids, keep_smiles, patterns, morgans = [], [], [], []
+            computed = 0
+            for cid, smiles in pairs:
+                i = reuse.get((cid, smiles))
+                if i is not None:
+                    pattern, morgan = cached["pattern"][i], cached["morgan"][i]
+                else:
+                    mol = Chem.MolFromSmiles(smiles)
+                    if mol is None:
+                        continue
+                    pattern, morgan = _structure_fingerprints(mol, rd)
+                    computed += 1
+                keep_cids.append(cid)
+                keep_smiles.append(smiles)
+                patterns.append(pattern)
+                morgans.append(morgan)
+            index = {
+                "key": np.array(key),
+                "cids": np.array(keep_cids, dtype=np.int32),
+                "smiles": np.array(keep_smiles, dtype=str),
+                "pattern": np.array(patterns, dtype=np.uint64).reshape(-1, PATTERN_FP_BITS // 64),
+                "morgan": np.array(morgans, dtype=np.uint64).reshape(-1, MORGAN_FP_BITS // 64),
+            }
+            DATA_DIR.mkdir(parents=True, exist_ok=True)
+            tmp = STRUCTURE_INDEX_FILE.with_suffix(".tmp.npz")
+            np.savez_compressed(tmp, **index)
+            os.replace(tmp, STRUCTURE_INDEX_FILE)
+            logger.info("Structure index: %d structures (%d fingerprinted) in %.1fs",
+                        len(keep_cids), computed, time.time() - start)
+        index["key"] = str(index["key"])
+        index["morgan_counts"] = popcount_rows(index["morgan"])
+        _structure_index = index
+        _structure_mols.clear()
+        return index
+
+
+def _index_mol(index: dict, row: int):
+    """RDKit molecule for an index row, parsed on first use."""
+    cid = int(index["cids"][row])
+    mol = _structure_mols.get(cid)
+    if mol is None:
+        mol = _rdkit()[0].MolFromSmiles(str(index["smiles"][row]))
+        _structure_mols[cid] = mol
+    return mol
+
+
+def local_structure_search(
+    search_type: str,
+    smiles: str,
+    cids,
+    compounds: dict,
+    threshold: int = 90,
+) -> tuple[np.ndarray, int] | None:
+    """
+    Substructure, superstructure or similarity search over inventory CIDs.
+
+    superstructure finds inventory compounds contained in the query;
+    similarity is Morgan (radius 2) Tanimoto >= threshold percent.
+
+    Returns:
+        (matching CID set, number of inventory CIDs without a usable
+        structure), or None when the search can't be answered locally:
+        RDKit is missing or more than STRUCTURE_MAX_UNSEARCHED of the
+        inventory has no structure yet.
+
+    Raises:
+        ValueError: for an invalid query SMILES or search type
+    """
+    if search_type not in ("substructure", "superstructure", "similarity"):
+        raise ValueError(f"Unknown structure search '{search_type}'")
+    index = get_structure_index(cids, compounds)
+    if index is None:
+        return None
+    total = len({int(c) for c in cids})
+    unsearched = total - len(index["cids"])
+    if total and unsearched / total > STRUCTURE_MAX_UNSEARCHED:
+        logger.info("Structure search: %d of %d CIDs have no structure yet, using PubChem", unsearched, total)
+        return None
+
+    rd = _rdkit()
+    query = rd[0].MolFromSmiles(smiles)
+    if query is None or not query.GetNumAtoms():
+        raise ValueError("Invalid SMILES")
+    pattern, morgan = _structure_fingerprints(query, rd)
+
+    if search_type == "similarity":
+        common = popcount_rows(index["morgan"] & morgan)
+        union = index["morgan_counts"] + popcount_rows(morgan) - common
+        similarity = common / np.maximum(union, 1)
+        return cid_array(index["cids"][similarity >= threshold / 100]), unsearched
+
+    # Screen: a substructure's pattern bits are a subset of its superstructure's
+    if search_type == "substructure":
+        candidates = np.flatnonzero(((index["pattern"] & pattern) == pattern).all(axis=1))
+        hits = [r for r in candidates if _index_mol(index, r).HasSubstructMatch(query)]
+    else:
+        candidates = np.flatnonzero(((index["pattern"] & ~pattern) == 0).all(axis=1))
+        hits = [r for r in candidates if query.HasSubstructMatch(_index_mol(index, r))]
+    logger.info("Structure search (%s): %d candidates, %d hits", search_type, len(candidates), len(hits))
+    return cid_array(index["cids"][np.array(hits, dtype=np.int64)]), unsearched
+
+
+SIMILARITY_BLOCK_ROWS = 256  # rows per block
+SIMILARITY_BLOCK_COLS = 4096  # candidates per block: ~40 MB of temporaries per block
+SIMILARITY_WORKERS = 4  # blocks in flight at once
+SIMILARITY_MIN_THRESHOLD = 0.5  # below this nearly every pair is a candidate
+SIMILARITY_MAX_PAIRS = 5000
+
+
+def tanimoto_block(a: np.ndarray, a_counts: np.ndarray, b: np.ndarray, b_counts: np.ndarray) -> np.ndarray:
+    """
+    Tanimoto similarities between every row of a and every row of b.
+
+    Accumulates popcount(a & b) one 64-bit word at a time, so memory stays
+    at len(a) x len(b) regardless of the fingerprint length.
+    """
+    common = np.zeros((len(a), len(b)), dtype=np.int32)
+    both = np.empty((len(a), len(b)), dtype=np.uint64)
+    for w in range(a.shape[1]):
+        np.bitwise_and(a[:, w, None], b[None, :, w], out=both)
+        common += popcount_words(both)
+    union = a_counts[:, None] + b_counts[None, :] - common
+    return common / np.maximum(union, 1)
+
+
+def similar_compounds(index: dict, cid: int, k: int = 20, min_similarity: float = 0.0) -> list[tuple[int, float]]:
+    """
+    The k inventory compounds most similar to one we hold (Morgan Tanimoto).
+
+    Returns:
+        [(cid, similarity)] best first, without the compound itself
+
+    Raises:
+        KeyError: if the CID has no structure in the index
+    """
+    rows = np.flatnonzero(index["cids"] == cid)
+    if not len(rows):
+        raise KeyError(cid)
+    row = rows[0]
+    fps, counts = index["morgan"], index["morgan_counts"]
+    sims = tanimoto_block(fps[row:row + 1], counts[row:row + 1], fps, counts)[0]
+    sims[row] = -1.0
+    k = min(k, len(sims) - 1)
+    if k <= 0:
+        return []
+    top = np.argpartition(-sims, k - 1)[:k]
+    top = top[np.argsort(-sims[top], kind="stable")]
+    return [(int(index["cids"][i]), float(sims[i])) for i in top if sims[i] >= min_similarity]
+
+
+def find_near_duplicates(
+    index: dict,
+    threshold: float = 0.95,
+    cids=None,
+    max_pairs: int = SIMILARITY_MAX_PAIRS,
+) -> tuple[list[tuple[int, int, float]], int]:
+    """
+    Pairs of inventory compounds with Morgan Tanimoto >= threshold.
+
+    Fingerprints are sorted by bit count: Tanimoto(a, b) <= min/max of their
+    counts, so each block of rows is only compared with the following rows
+    whose count is at most max(block) / threshold. Those candidates are
+    split into column chunks, so a block is at most SIMILARITY_BLOCK_ROWS x
+    SIMILARITY_BLOCK_COLS; blocks run on a small thread pool (numpy releases
+    the GIL).
+
+    Args:
+        index: get_structure_index() result
+        threshold: minimum similarity [SIMILARITY_MIN_THRESHOLD-1]
+        cids: restrict to these CIDs (default: whole index)
+        max_pairs: keep only this many best pairs
+
+    Returns:
+        ([(cid_a, cid_b, similarity)] best first, number of compounds compared)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not SIMILARITY_MIN_THRESHOLD <= threshold <= 1:
+        raise ValueError(f"threshold must be between {SIMILARITY_MIN_THRESHOLD} and 1")
+    keep = np.arange(len(index["cids"]))
+    if cids is not None:
+        keep = np.flatnonzero(np.isin(index["cids"], cid_array(cids)))
+    counts = index["morgan_counts"][keep]
+    order = np.argsort(counts, kind="stable")
+    keep, counts = keep[order], counts[order]
+    fps = index["morgan"][keep]
+    n = len(keep)
+
+    def blocks():
+        for start in range(0, n, SIMILARITY_BLOCK_ROWS):
+            stop = min(start + SIMILARITY_BLOCK_ROWS, n)
+            limit = int(np.searchsorted(counts, counts[stop - 1] / threshold, side="right"))
+            for first in range(start, limit, SIMILARITY_BLOCK_COLS):
+                yield start, stop, first, min(first + SIMILARITY_BLOCK_COLS, limit)
+
+    def run_block(block: tuple[int, int, int, int]) -> list[tuple[int, int, float]]:
+        start, stop, first, last = block
+        sims = tanimoto_block(fps[start:stop], counts[start:stop], fps[first:last], counts[first:last])
+        if first < stop:
+            # upper triangle only: pair (i, j) with j > i
+            sims[np.arange(first, last)[None, :] <= np.arange(start, stop)[:, None]] = 0.0
+        ii, jj = np.nonzero(sims >= threshold)
+        return [
+            (int(index["cids"][keep[start + i]]), int(index["cids"][keep[first + j]]), float(sims[i, j]))
+            for i, j in zip(ii, jj)
+        ]
+
+    pairs = []
+    with ThreadPoolExecutor(max_workers=min(SIMILARITY_WORKERS, os.cpu_count() or 1)) as pool:
+        for block_pairs in pool.map(run_block, blocks()):
+            pairs.extend(block_pairs)
+            if len(pairs) > 4 * max_pairs:
+                pairs.sort(key=lambda p: -p[2])
+                del pairs[max_pairs:]
+    pairs.sort(key=lambda p: -p[2])
+    return pairs[:max_pairs], n
+
+
 def main():
     epilog = """\
 Examples:
@@ -2298,6 +4391,8 @@ Examples:
   %(prog)s --refresh              Refresh both HTML and CIDs
   %(prog)s --list-snapshots       Show available HTML snapshots
   %(prog)s --combine AND          Intersect with your latest Firefox PubChem search
+  %(prog)s --ingest-extracts DIR  Fill compound info from PubChem extract files
+  %(prog)s --batch list.txt       Check which of these names/CAS/SMILES you hold
 
 Workflow:
   1. HTML snapshots are stored in data/snapshots/ with timestamps
@@ -2399,6 +4494,20 @@ Data sources (in order of priority):
         action="store_true",
         help="List available HTML snapshots and exit"
     )
+    info_group.add_argument(
+        "--ingest-extracts",
+        type=Path,
+        metavar="DIR",
+        help="Fill compound info from PubChem extract files (CID-Title, CID-SMILES, "
+             "CID-IUPAC, CID-Mass; plain or .gz) in DIR and exit"
+    )
+    info_group.add_argument(
+        "--batch",
+        type=Path,
+        metavar="FILE",
+        help="Look up every name, CAS number or SMILES in FILE (one per line), write "
+             "a batch_report.csv of which ones are in the inventory and exit"
+    )
 
     args = parser.parse_args()
 
@@ -2407,6 +4516,55 @@ Data sources (in order of priority):
         print_snapshots()
         return
 
+    # Handle --ingest-extracts
+    if args.ingest_extracts:
+        cache = load_cid_cache()
+        if not cache or "results" not in cache:
+            print("Error: No CID cache found. Run a CID lookup first.")
+            sys.exit(1)
+        cids = [int(r["cid"]) for r in cache["results"].values() if r.get("cid") is not None]
+        try:
+            compounds, stats = ingest_pubchem_extracts(
+                args.ingest_extracts, cids, load_compound_info().get("compounds", {})
+            )
+        except FileNotFoundError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        save_compound_info({"version": 1, "compounds": compounds})
+        for name, matched in stats.items():
+            print(f"  {name}: {matched} of {len(set(cids))} CIDs")
+        print("\nDone! GHS pictograms are fetched from PubChem the next time the web UI runs.")
+        return
+
+    # Handle --batch
+    if args.batch:
+        cache = load_cid_cache()
+        rug_table = load_rug_table()
+        if not cache or "results" not in cache or not rug_table:
+            print("Error: No CID cache found. Run a CID lookup first.")
+            sys.exit(1)
+        try:
+            queries = read_batch_queries(args.batch.read_text(encoding="utf-8-sig"))
+        except OSError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        if not queries:
+            print(f"Error: No queries in {args.batch}")
+            sys.exit(1)
+        inventory = [r["cid"] for r in cache["results"].values() if r.get("cid") is not None]
+        results = list(tqdm(batch_search(queries, inventory), total=len(queries), desc="Batch search"))
+        report = pd.DataFrame(batch_report_rows(results, rug_table.get("rows", [])),
+                              columns=BATCH_REPORT_COLUMNS)
+        output_dir = args.output_dir or Path.cwd()
+        output_dir.mkdir(parents=True, exist_ok=True)
+        report_path = output_dir / "batch_report.csv"
+        report.to_csv(report_path, index=False)
+        held = int((report["In Inventory"] > 0).sum())
+        failed = int((report["Error"] != "").sum())
+        print(f"\n{held} of {len(queries)} queries are in the inventory ({failed} failed)")
+        print(f"Saved batch report to: {report_path}")
+        return
+
     # Handle --refresh flag (shorthand for both)
     if args.refresh:
         args.refresh_html = True
@@ -2508,8 +4666,8 @@ Data sources (in order of priority):
             else:
                 print(f"\nCombining {len(cids)} CIDs with latest Firefox search ({args.combine})...")
 
-                # Step 5a: Upload program's CIDs to cache
-                prog_key = upload_cids_to_pubchem_cache(cids)
+                # Step 5a: Get a cache key for the program's CIDs (reused if recent)
+                prog_key = get_inventory_cache_key(cids)
                 if not prog_key:
                     print("Failed to upload CIDs to PubChem cache")
                 else:
@@ -2521,6 +4679,11 @@ Data sources (in order of priority):
                     else:
                         # Step 5c: Combine the cache keys
                         combine_result = combine_pubchem_cache_keys(user_key, prog_key, args.combine)
+                        if not combine_result:
+                            # Stored key may have expired early - retry with a fresh upload
+                            prog_key = get_inventory_cache_key(cids, force_refresh=True)
+                            if prog_key:
+                                combine_result = combine_pubchem_cache_keys(user_key, prog_key, args.combine)
                         if combine_result:
                             combined_key, list_size = combine_result
                             url = f"https://pubchem.ncbi.nlm.nih.gov/#query={combined_key}"
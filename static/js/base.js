@@ -0,0 +1,99 @@
+// Helper for async actions with loading state
+async function runAction(url, btn, options = {}) {
+    const originalText = btn.innerHTML;
+    btn.disabled = true;
+    btn.innerHTML = '<span class="loading"></span> ' + (options.loadingText || 'Processing...');
+
+    try {
+        const resp = await fetch(url, { method: 'POST' });
+        const data = await resp.json();
+        if (data.pubchem_url) {
+            window.open(data.pubchem_url, '_blank');
+        } else if (data.redirect) {
+            window.location.href = data.redirect;
+        } else if (data.error) {
+            alert('Error: ' + data.error);
+        } else {
+            window.location.reload();
+        }
+    } catch (e) {
+        alert('Error: ' + e.message);
+    } finally {
+        btn.disabled = false;
+        btn.innerHTML = originalText;
+    }
+}
+
+function toggleTheme() {
+    const html = document.documentElement;
+    const current = html.getAttribute('data-theme') || 'dark';
+    const next = current === 'dark' ? 'light' : 'dark';
+    html.setAttribute('data-theme', next);
+    localStorage.setItem('theme', next);
+    updateThemeButton();
+}
+function updateThemeButton() {
+    const btn = document.getElementById('theme-toggle');
+    if (!btn) return;
+    const current = document.documentElement.getAttribute('data-theme') || 'dark';
+    btn.textContent = current === 'dark' ? '☀️' : '🌙';
+}
+document.addEventListener('DOMContentLoaded', updateThemeButton);
+
+async function quitApp() {
+    if (confirm('Quit the Chemical Search application?')) {
+        try {
+            await fetch('/api/quit', { method: 'POST' });
+        } catch (e) {
+            // Expected - server shuts down
+        }
+        document.body.innerHTML = '<div style="display:flex;align-items:center;justify-content:center;height:100vh;color:#888;"><p>Application closed. You can close this tab.</p></div>';
+    }
+}
+
+function checkForUpdates() {
+    const el = document.getElementById('update-result');
+    el.innerHTML = 'Checking...';
+    fetch('/api/check-update')
+        .then(r => r.json())
+        .then(data => {
+            if (data.error) {
+                el.innerHTML = 'Could not check for updates: ' + data.error;
+            } else if (!data.update_available) {
+                el.innerHTML = data.message || '<span style="color:#4caf50;">✔</span> You’re on the latest version (v' + data.current + ').';
+            } else {
+                let notes = data.release_notes ? '<p style="margin:8px 0;white-space:pre-wrap;max-height:120px;overflow:auto;font-size:0.8rem;background:var(--bg-card);padding:8px;border-radius:4px;">' + data.release_notes.replace(/</g,'&lt;') + '</p>' : '';
+                let action = '';
+                if (data.is_git) {
+                    action = '<button onclick="gitPullUpdate(this)" class="btn" style="font-size:0.85rem;padding:6px 14px;margin-top:6px;">Update via git pull</button>' +
+                        '<p style="margin-top:8px;font-size:0.8rem;color:var(--text-dim);">This will run <code>git pull</code> to update your local copy. Restart the app afterwards.</p>';
+                } else {
+                    action = '<a href="' + data.download_url + '" target="_blank" class="btn" style="font-size:0.85rem;padding:6px 14px;margin-top:6px;display:inline-block;">Download</a>' +
+                        '<p style="margin-top:8px;font-size:0.8rem;color:var(--text-dim);">Download the zip, close this app, replace your ChemicalExtractor folder contents with the new files, and relaunch.</p>';
+                }
+                el.innerHTML = '<strong>v' + data.latest + ' is available!</strong> (you have v' + data.current + ')' +
+                    notes + action;
+            }
+        })
+        .catch(() => { el.innerHTML = 'Could not check for updates (no internet?).'; });
+}
+function gitPullUpdate(btn) {
+    btn.disabled = true;
+    btn.textContent = 'Updating...';
+    fetch('/api/git-pull', {method:'POST'})
+        .then(r => r.json())
+        .then(data => {
+            if (data.success) {
+                btn.textContent = 'Updated! Restarting...';
+                btn.parentElement.querySelector('p').innerHTML = 'The app is restarting. This page will reload automatically.';
+                // Wait for the server to come back, then reload
+                setTimeout(function tryReload() {
+                    fetch('/api/check-update').then(() => location.reload()).catch(() => setTimeout(tryReload, 500));
+                }, 2000);
+            } else {
+                btn.textContent = 'Update failed';
+                btn.parentElement.querySelector('p').textContent = data.error || 'Unknown error';
+            }
+        })
+        .catch(() => { btn.textContent = 'Update failed'; });
+}
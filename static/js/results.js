@@ -0,0 +1,473 @@
+// Server-side paging: the filters below are sent with every table request
+var grouped = localStorage.getItem('results_group_identical') !== 'false';
+window._filterState = { mwLo: null, mwHi: null, formula: '', location: '', owner: '', ghs: '' };
+window._mwDataMin = MW_RANGE[0];
+window._mwDataMax = MW_RANGE[1];
+window._mwSlider = null;
+
+// Buttons only export the rows loaded in the browser, so load them all first
+function exportAllRows(buttonType) {
+    return function(e, dt, button, config, cb) {
+        const self = this;
+        const pageLen = dt.page.len();
+        dt.one('draw', function() {
+            $.fn.dataTable.ext.buttons[buttonType].action.call(self, e, dt, button, config, function() {
+                dt.page.len(pageLen).draw(false);
+                if (cb) cb();
+            });
+        });
+        dt.page.len(-1).draw(false);
+    };
+}
+
+$(document).ready(function() {
+    if (!document.getElementById('results-data-table')) return;
+
+    // Load visible columns from localStorage
+    let visibleCols = DEFAULT_COLS;
+    try {
+        const stored = localStorage.getItem('results_visible_cols');
+        if (stored) visibleCols = JSON.parse(stored);
+    } catch(e) {}
+
+    // Build column definitions
+    function buildColumnDefs() {
+        return ALL_COLS.map((col, idx) => {
+            let def = {
+                targets: idx,
+                title: col,
+                visible: visibleCols.includes(col),
+                className: 'col-' + col
+            };
+
+            if (col === 'Structure') {
+                def.orderable = false;
+                def.searchable = false;
+                def.exportOptions = { format: { body: function() { return ''; } } };
+            } else if (col === 'Hazards') {
+                def.orderable = false;
+                def.exportOptions = {
+                    format: {
+                        body: function(data) {
+                            const matches = data.match(/alt="(GHS\d+)"/g);
+                            return matches ? matches.map(m => m.match(/GHS\d+/)[0]).join(', ') : '';
+                        }
+                    }
+                };
+            } else if (col === 'CAS') {
+                def.exportOptions = {
+                    format: {
+                        body: function(data) {
+                            const linkMatch = data.match(/>([^<]+)<\/a>/);
+                            if (linkMatch) return linkMatch[1];
+                            const plainMatch = data.match(/<\/s>\s*([^<]+)/);
+                            if (plainMatch) return plainMatch[1];
+                            return data.replace(/<[^>]*>/g, '').trim() || '';
+                        }
+                    }
+                };
+            } else if (col === 'Formula') {
+                def.exportOptions = {
+                    format: {
+                        body: function(data) {
+                            const match = data.match(/data-plaintext="([^"]*)"/);
+                            return match ? match[1] : data.replace(/<[^>]*>/g, '').trim();
+                        }
+                    }
+                };
+            } else if (col === 'CID') {
+                def.type = 'num';
+                def.exportOptions = {
+                    format: {
+                        body: function(data) {
+                            const match = data.match(/>\s*(\d+)\s*</);
+                            return match ? match[1] : '';
+                        }
+                    }
+                };
+            } else if (col === 'MW') {
+                def.type = 'num';
+            } else if (col === 'SMILES') {
+                def.render = function(data, type) {
+                    if (type === 'display' && data.length > 50) {
+                        return '<span class="smiles-cell" title="' + data + '">' + data.substring(0, 50) + '...</span>';
+                    }
+                    return data;
+                };
+            }
+
+            return def;
+        });
+    }
+
+    function buildDTConfig(tableId) {
+        return {
+            serverSide: true,
+            processing: true,
+            searchDelay: 300,
+            ajax: {
+                url: '/api/results/' + encodeURIComponent(FILTER_ID) + '/rows',
+                data: function(d) {
+                    const fs = window._filterState;
+                    d.grouped = grouped ? 1 : 0;
+                    if (fs.mwLo !== null && (fs.mwLo > window._mwDataMin || fs.mwHi < window._mwDataMax)) {
+                        d.mw_lo = fs.mwLo;
+                        d.mw_hi = fs.mwHi;
+                    }
+                    if (fs.formula) d.formula = fs.formula;
+                    if (fs.location) d.location = fs.location;
+                    if (fs.owner) d.owner = fs.owner;
+                    if (fs.ghs) d.ghs = fs.ghs;
+                }
+            },
+            pageLength: 25,
+            lengthMenu: [[10, 25, 50, 100, -1], [10, 25, 50, 100, "All"]],
+            order: [[ALL_COLS.indexOf('Name'), 'asc']],
+            columnDefs: buildColumnDefs(),
+            layout: {
+                topStart: ['buttons', 'pageLength'],
+                topEnd: 'search'
+            },
+            buttons: [
+                {
+                    extend: 'colvis',
+                    text: 'Columns',
+                    columns: ':not(.no-export)'
+                },
+                {
+                    extend: 'collection',
+                    text: 'Export',
+                    buttons: [
+                        {
+                            extend: 'csvHtml5',
+                            action: exportAllRows('csvHtml5'),
+                            text: 'CSV',
+                            title: EXPORT_TITLE,
+                            exportOptions: { columns: ':visible:not(.col-Structure)' }
+                        },
+                        {
+                            extend: 'excelHtml5',
+                            action: exportAllRows('excelHtml5'),
+                            text: 'Excel',
+                            title: EXPORT_TITLE,
+                            exportOptions: { columns: ':visible:not(.col-Structure)' }
+                        },
+                        {
+                            extend: 'copyHtml5',
+                            action: exportAllRows('copyHtml5'),
+                            text: 'Copy to Clipboard',
+                            exportOptions: { columns: ':visible:not(.col-Structure)' }
+                        },
+                        {
+                            text: 'Print / PDF',
+                            action: function(e, dt) {
+                                const visibleCount = dt.columns(':visible').count();
+                                const $tableWrapper = $('.table-responsive:visible');
+                                if (visibleCount > 7) {
+                                    $tableWrapper.addClass('print-scale-many');
+                                }
+                                dt.one('draw', function() {
+                                    setTimeout(function() {
+                                        window.print();
+                                        setTimeout(function() {
+                                            $tableWrapper.removeClass('print-scale-many');
+                                        }, 1000);
+                                    }, 500);
+                                });
+                                dt.page.len(-1).draw();
+                            }
+                        }
+                    ]
+                }
+            ],
+            stateSave: true,
+            stateSaveCallback: function(settings, data) {
+                const visible = [];
+                settings.aoColumns.forEach((col, idx) => {
+                    if (col.bVisible) visible.push(ALL_COLS[idx]);
+                });
+                visibleCols = visible;
+                localStorage.setItem('results_visible_cols', JSON.stringify(visible));
+                localStorage.setItem('DataTables_' + tableId, JSON.stringify(data));
+            },
+            stateLoadCallback: function() {
+                try {
+                    return JSON.parse(localStorage.getItem('DataTables_' + tableId));
+                } catch(e) {
+                    return null;
+                }
+            },
+            language: {
+                search: "Search chemicals:",
+                lengthMenu: "Show _MENU_ rows",
+                info: "Showing _START_ to _END_ of _TOTAL_ chemicals",
+                infoEmpty: "No chemicals found",
+                infoFiltered: "(filtered from _MAX_ total)",
+                zeroRecords: "No matching chemicals found"
+            },
+            initComplete: function() {
+                var $btnGroup = $(this.api().table().container()).find('.dt-buttons');
+                var $pill = $('<span id="group-toggle" style="cursor:pointer;font-size:0.8rem;padding:4px 10px;border-radius:12px;border:1px solid var(--accent);user-select:none;margin-left:8px;align-content:center;"></span>').text('Group identical');
+                function applyStyle() {
+                    if (grouped) {
+                        $pill.css({background:'var(--highlight)',color:'#fff'});
+                    } else {
+                        $pill.css({background:'transparent',color:'var(--text-dim)'});
+                    }
+                }
+                applyStyle();
+                $pill.on('click', function() {
+                    grouped = !grouped;
+                    localStorage.setItem('results_group_identical', grouped ? 'true' : 'false');
+                    applyStyle();
+                    window._activeTable.ajax.reload();
+                });
+                $btnGroup.append($pill);
+            }
+        };
+    }
+
+    var activeTable = $('#results-data-table').DataTable(buildDTConfig('results'));
+    activeTable.on('column-visibility.dt', function(e, settings) {
+        var visible = [];
+        settings.aoColumns.forEach(function(col, idx) {
+            if (col.bVisible) visible.push(ALL_COLS[idx]);
+        });
+        visibleCols = visible;
+        localStorage.setItem('results_visible_cols', JSON.stringify(visible));
+    });
+    window._activeTable = activeTable;
+
+    $(document).on('click', '.vary-pop', function(e) {
+        $('.vary-popover').remove();
+        var content = $(this).next('.vary-pop-content').text();
+        var $pop = $('<div class="vary-popover"></div>').text(content)
+            .css({position:'absolute', background:'var(--bg-card)', border:'1px solid var(--border)',
+                  borderRadius:'6px', padding:'8px 12px', fontSize:'0.8rem', maxWidth:'300px',
+                  zIndex:1000, boxShadow:'0 2px 8px rgba(0,0,0,0.15)', wordBreak:'break-word'});
+        $('body').append($pop);
+        var rect = this.getBoundingClientRect();
+        $pop.css({top: rect.bottom + window.scrollY + 4, left: rect.left + window.scrollX});
+    });
+    $(document).on('click', function(e) {
+        if (!$(e.target).hasClass('vary-pop')) $('.vary-popover').remove();
+    });
+
+});
+
+// Saving the neighbours as a filter is a POST, never a plain link
+function openSimilar(cid) {
+    const form = document.createElement('form');
+    form.method = 'post';
+    form.action = '/similar/' + cid;
+    document.body.appendChild(form);
+    form.submit();
+}
+
+// Keep compound info polling
+function compoundLink(cid, title) {
+    const span = document.createElement('span');
+    const a = document.createElement('a');
+    a.href = '#';
+    a.onclick = () => { openSimilar(cid); return false; };
+    a.title = 'Most similar chemicals you hold';
+    a.className = 'mono';
+    a.style.color = 'var(--success)';
+    a.textContent = cid;
+    span.appendChild(a);
+    span.appendChild(document.createTextNode(title ? ' ' + title : ''));
+    return span;
+}
+
+async function findDuplicates(btn) {
+    const original = btn.innerHTML;
+    btn.disabled = true;
+    btn.innerHTML = '<span class="loading"></span> Comparing...';
+    try {
+        const filterId = new URLSearchParams(window.location.search).get('filter_id') || 'all';
+        const resp = await fetch('/api/duplicates?filter_id=' + encodeURIComponent(filterId));
+        const data = await resp.json();
+        if (data.error) {
+            alert(data.error);
+            return;
+        }
+        const body = document.getElementById('duplicates-body');
+        body.innerHTML = '';
+        data.pairs.forEach(p => {
+            const tr = body.insertRow();
+            tr.insertCell().appendChild(compoundLink(p.a, p.a_title));
+            tr.insertCell().appendChild(compoundLink(p.b, p.b_title));
+            tr.insertCell().textContent = (p.similarity * 100).toFixed(1) + '%';
+        });
+        if (!data.pairs.length) {
+            body.insertRow().insertCell().textContent = 'No pairs above ' + Math.round(data.threshold * 100) + '% similarity.';
+        }
+        document.getElementById('duplicates-summary').textContent =
+            `${data.pairs.length} pairs among ${data.compared} compounds (Tanimoto >= ${Math.round(data.threshold * 100)}%)`;
+        document.getElementById('duplicates-card').style.display = '';
+    } catch (e) {
+        alert('Error: ' + e.message);
+    } finally {
+        btn.disabled = false;
+        btn.innerHTML = original;
+    }
+}
+
+async function pollCompoundInfo() {
+    const badge = document.getElementById('compound-info-badge');
+    if (!badge) return;
+    try {
+        const resp = await fetch('/api/compound-info-status');
+        const data = await resp.json();
+        if (data.status === 'running') {
+            badge.innerHTML = '<span class="loading" style="width:12px;height:12px;"></span> Fetching compound info ' + data.progress;
+            setTimeout(pollCompoundInfo, 3000);
+        } else if (data.status === 'done') {
+            badge.textContent = '';
+        }
+    } catch(e) {}
+}
+document.addEventListener('DOMContentLoaded', pollCompoundInfo);
+
+// --- Save/Unsave toggle ---
+console.log('[Script] toggleSave and filter code starting to parse');
+function toggleSave() {
+    const filterId = FILTER_ID;
+    if (!filterId || filterId === 'all') return;
+    const isSaved = IS_SAVED;
+    const action = isSaved ? 'unsave' : 'save';
+    fetch('/api/filter-results/' + filterId + '/' + action, { method: 'POST' })
+        .then(r => r.json())
+        .then(data => { if (data.success) location.reload(); });
+}
+
+// --- Advanced property filters ---
+// Applied server-side: the table's ajax.data sends window._filterState
+$(document).ready(function() {
+    if (!window._activeTable) return;
+
+    // --- noUiSlider for MW ---
+    var sliderEl = document.getElementById('mw-slider');
+    if (sliderEl) {
+        var dataMin = window._mwDataMin, dataMax = window._mwDataMax;
+        window._filterState.mwLo = dataMin;
+        window._filterState.mwHi = dataMax;
+
+        noUiSlider.create(sliderEl, {
+            start: [dataMin, dataMax],
+            connect: true,
+            range: { 'min': dataMin, 'max': Math.max(dataMax, dataMin + 1) },
+            step: 1,
+            tooltips: [
+                { to: function(v) { return Math.round(v); } },
+                { to: function(v) { return Math.round(v); } }
+            ],
+            pips: {
+                mode: 'count',
+                values: 5,
+                density: 4,
+                format: { to: function(v) { return Math.round(v); } }
+            }
+        });
+        window._mwSlider = sliderEl.noUiSlider;
+    }
+
+    // --- Button handlers ---
+    $('#apply-filters-btn').on('click', function() {
+        if (window._mwSlider) {
+            var vals = window._mwSlider.get();
+            window._filterState.mwLo = parseFloat(vals[0]);
+            window._filterState.mwHi = parseFloat(vals[1]);
+        }
+        window._filterState.formula = ($('#formula-filter').val() || '').toLowerCase();
+        window._filterState.location = $('#location-filter').val() || '';
+        window._filterState.owner = $('#owner-filter').val() || '';
+        window._filterState.ghs = $('#ghs-filter').val() || '';
+        window._activeTable.draw();
+    });
+
+    $('#clear-filters-btn').on('click', function() {
+        if (window._mwSlider) {
+            window._mwSlider.set([window._mwDataMin, window._mwDataMax]);
+        }
+        $('#formula-filter').val('');
+        $('.facet-filter').val('');
+        window._filterState = { mwLo: window._mwDataMin, mwHi: window._mwDataMax, formula: '', location: '', owner: '', ghs: '' };
+        window._activeTable.draw();
+    });
+
+    // Facet counts follow the table: refetched when a draw changes the filters
+    renderFacets(FACETS);
+    window._activeTable.on('draw', refreshFacets);
+    if (window._mwSlider) {
+        window._mwSlider.on('update', function() { renderMwHistogram(window._lastFacets && window._lastFacets.mw); });
+    }
+});
+
+// --- Facet counts (Location, Owner, Hazard, MW histogram) ---
+window._facetQuery = null;
+window._lastFacets = null;
+
+function facetQuery() {
+    const fs = window._filterState;
+    const params = new URLSearchParams();
+    if (grouped) params.set('grouped', '1');
+    const search = window._activeTable.search();
+    if (search) params.set('search', search);
+    if (fs.mwLo !== null && (fs.mwLo > window._mwDataMin || fs.mwHi < window._mwDataMax)) {
+        params.set('mw_lo', fs.mwLo);
+        params.set('mw_hi', fs.mwHi);
+    }
+    ['formula', 'location', 'owner', 'ghs'].forEach(function(name) {
+        if (fs[name]) params.set(name, fs[name]);
+    });
+    return params.toString();
+}
+
+async function refreshFacets() {
+    const query = facetQuery();
+    if (query === window._facetQuery) return;  // paging or sorting only
+    window._facetQuery = query;
+    try {
+        const resp = await fetch('/api/results/' + encodeURIComponent(FILTER_ID) + '/facets?' + query);
+        if (!resp.ok || query !== window._facetQuery) return;
+        renderFacets(await resp.json());
+    } catch (e) {
+        // Counts are informational; keep the previous ones
+    }
+}
+
+function renderFacets(facets) {
+    if (!facets) return;
+    window._lastFacets = facets;
+    ['location', 'owner', 'ghs'].forEach(function(name) {
+        const select = document.getElementById(name + '-filter');
+        if (!select) return;
+        const counts = new Map(facets[name].map(function(f) { return [f.value, f.count]; }));
+        Array.from(select.options).forEach(function(opt) {
+            if (!opt.value) return;
+            const count = counts.get(opt.value) || 0;
+            opt.textContent = opt.dataset.label + ' (' + count + ')';
+            opt.disabled = count === 0 && !opt.selected;
+        });
+    });
+    renderMwHistogram(facets.mw);
+}
+
+function renderMwHistogram(mw) {
+    const el = document.getElementById('mw-histogram');
+    if (!el || !mw) return;
+    const max = Math.max(1, ...mw.counts);
+    let lo = -Infinity, hi = Infinity;
+    if (window._mwSlider) {
+        const vals = window._mwSlider.get();
+        lo = parseFloat(vals[0]);
+        hi = parseFloat(vals[1]);
+    }
+    el.innerHTML = mw.counts.map(function(count, i) {
+        const a = mw.edges[i], b = mw.edges[i + 1];
+        const cls = (b < lo || a > hi) ? 'out' : '';
+        return '<span class="' + cls + '" style="height:' + (100 * count / max) + '%" title="MW ' +
+            Math.round(a) + '-' + Math.round(b) + ': ' + count + '"></span>';
+    }).join('');
+}
@@ -0,0 +1,614 @@
+let selectedCacheKey = null;
+let searchHistory = [];
+let allHistory = [];  // Stores both filtered and unfiltered
+let autoRefreshInterval = null;
+
+function getShowAppSearches() {
+    try {
+        const stored = localStorage.getItem('show_app_searches');
+        return stored === 'true';
+    } catch(e) { return false; }
+}
+
+function saveShowAppSearches(show) {
+    localStorage.setItem('show_app_searches', show ? 'true' : 'false');
+}
+
+function toggleAppSearches() {
+    const toggle = document.getElementById('toggle-app-searches');
+    const wasActive = toggle.dataset.active === '1';
+    const show = !wasActive;
+    toggle.dataset.active = show ? '1' : '0';
+    toggle.style.background = show ? 'var(--highlight)' : 'transparent';
+    toggle.style.color = show ? '#fff' : 'var(--text-dim)';
+    saveShowAppSearches(show);
+
+    // Filter and re-render
+    searchHistory = show ? allHistory : allHistory.filter(entry => !entry._is_app_search);
+    renderHistoryTable();
+}
+
+async function loadHistory() {
+    const tbody = document.getElementById('history-body');
+    if (!tbody) return;
+
+    try {
+        const resp = await fetch('/api/pubchem-history');
+        const data = await resp.json();
+
+        // Store both lists
+        allHistory = data.all_history || [];
+        const filteredHistory = data.history || [];
+
+        // Mark app searches
+        const filteredKeys = new Set(filteredHistory.map(e => e.cachekey));
+        allHistory.forEach(entry => {
+            entry._is_app_search = !filteredKeys.has(entry.cachekey);
+        });
+
+        // Browser warning
+        const warningEl = document.getElementById('browser-warning');
+        if (data.browser_warning && warningEl) {
+            warningEl.textContent = data.browser_warning;
+            warningEl.style.display = 'block';
+        } else if (warningEl) {
+            warningEl.style.display = 'none';
+        }
+
+        // Apply user preference
+        const showAppSearches = getShowAppSearches();
+        const toggle = document.getElementById('toggle-app-searches');
+        if (toggle) {
+            toggle.dataset.active = showAppSearches ? '1' : '0';
+            toggle.style.background = showAppSearches ? 'var(--highlight)' : 'transparent';
+            toggle.style.color = showAppSearches ? '#fff' : 'var(--text-dim)';
+        }
+
+        searchHistory = showAppSearches ? allHistory : filteredHistory;
+
+        renderHistoryTable();
+    } catch (e) {
+        tbody.innerHTML = `<tr><td colspan="5" class="text-warning" style="text-align: center;">
+            Error loading search history: ${e.message}
+        </td></tr>`;
+    }
+}
+
+function renderHistoryTable() {
+    const tbody = document.getElementById('history-body');
+    if (!tbody) return;
+
+    if (searchHistory.length === 0) {
+        tbody.innerHTML = `<tr><td colspan="5" class="text-dim" style="text-align: center; padding: 30px;">
+            No recent PubChem searches found.<br><br>
+            <button class="btn" onclick="window.open('https://pubchem.ncbi.nlm.nih.gov/', '_blank')">
+                Search on PubChem
+            </button>
+        </td></tr>`;
+        updateButtons();
+        return;
+    }
+
+    tbody.innerHTML = searchHistory.map((entry, idx) => `
+        <tr onclick="selectEntry('${entry.cachekey}')" data-cachekey="${entry.cachekey}"
+            style="cursor: pointer;" class="${idx === 0 ? 'selected' : ''}">
+            <td style="text-align: center;">
+                <input type="radio" name="search-select" value="${entry.cachekey}"
+                       ${idx === 0 ? 'checked' : ''}
+                       onclick="event.stopPropagation(); selectEntry('${entry.cachekey}')">
+            </td>
+            <td style="max-width: 350px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap;"
+                title="${entry.name}">
+                ${entry.name}${entry._is_app_search ? ' <span class="badge badge-dim">APP</span>' : ''}
+            </td>
+            <td>${entry.browser || '?'}</td>
+            <td class="text-dim" style="font-size: 0.85rem;">${formatTime(entry.timestamp)}</td>
+            <td style="white-space: nowrap;">
+                <a href="${entry.url}" target="_blank" onclick="event.stopPropagation();"
+                   style="color: var(--highlight); font-size: 0.85rem;">PubChem</a>
+            </td>
+        </tr>
+    `).join('');
+
+    // Select first entry by default
+    if (searchHistory.length > 0) {
+        selectedCacheKey = searchHistory[0].cachekey;
+    }
+    updateButtons();
+}
+
+function formatTime(isoTimestamp) {
+    if (!isoTimestamp) return 'Unknown';
+    const date = new Date(isoTimestamp);
+    const now = new Date();
+    const diffMs = now - date;
+    const diffMins = Math.floor(diffMs / 60000);
+    const diffHours = Math.floor(diffMs / 3600000);
+    const diffDays = Math.floor(diffMs / 86400000);
+
+    if (diffMins < 1) return 'Just now';
+    if (diffMins < 60) return `${diffMins}m ago`;
+    if (diffHours < 24) return `${diffHours}h ago`;
+    if (diffDays < 7) return `${diffDays}d ago`;
+    return date.toLocaleDateString();
+}
+
+function selectEntry(cachekey) {
+    selectedCacheKey = cachekey;
+
+    document.querySelectorAll('#history-body tr').forEach(row => {
+        const isSelected = row.dataset.cachekey === cachekey;
+        row.classList.toggle('selected', isSelected);
+        const radio = row.querySelector('input[type="radio"]');
+        if (radio) radio.checked = isSelected;
+    });
+
+    updateButtons();
+}
+
+function updateButtons() {
+    const hasSelection = selectedCacheKey !== null;
+    const btnAnd = document.getElementById('btn-combine-and');
+    const btnNot = document.getElementById('btn-combine-not');
+    const btnMain = document.getElementById('btn-main-search');
+    if (btnAnd) btnAnd.disabled = !hasSelection;
+    if (btnNot) btnNot.disabled = !hasSelection;
+    const btnQuery = document.getElementById('btn-add-query');
+    if (btnQuery) btnQuery.disabled = !hasSelection;
+    if (btnMain) btnMain.disabled = !hasSelection;
+}
+
+function addSelectedToQuery() {
+    if (!selectedCacheKey) return;
+    const input = document.getElementById('query-input');
+    const operand = 'search:' + selectedCacheKey;
+    input.value = input.value.trim() ? input.value.trim() + ' AND ' + operand : operand;
+    const content = document.getElementById('query-section');
+    if (content && !content.classList.contains('open')) toggleSection('query-section');
+    input.focus();
+}
+
+async function runQuery(btn) {
+    const query = document.getElementById('query-input').value.trim();
+    if (!query) return;
+    const originalText = btn.innerHTML;
+    btn.disabled = true;
+    btn.innerHTML = '<span class="loading"></span> Running...';
+    try {
+        const resp = await fetch('/api/query', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({query: query}),
+        });
+        const data = await resp.json();
+        if (data.error) {
+            alert(data.error);
+        } else if (data.filter_id) {
+            window.location.href = '/results?filter_id=' + data.filter_id;
+            return;
+        }
+    } catch (e) {
+        alert('Error: ' + e.message);
+    } finally {
+        btn.disabled = false;
+        btn.innerHTML = originalText;
+    }
+}
+
+// --- Batch search ---
+const BATCH_COLUMNS = ['Query', 'Type', 'PubChem CIDs', 'In Inventory', 'Matched CIDs', 'Names', 'CAS', 'Locations', 'Error'];
+let batchRows = [];
+
+function loadBatchFile(input) {
+    const file = input.files[0];
+    if (!file) return;
+    const reader = new FileReader();
+    reader.onload = () => { document.getElementById('batch-input').value = reader.result; };
+    reader.readAsText(file);
+    input.value = '';
+}
+
+function addBatchRow(row) {
+    const tr = document.getElementById('batch-body').insertRow();
+    const cells = [row['Query'], row['Type'], row['PubChem CIDs'], row['In Inventory'],
+                   row['Names'], row['Error'] ? 'Error: ' + row['Error'] : row['Locations']];
+    cells.forEach(value => { tr.insertCell().textContent = value; });
+    if (row['In Inventory'] > 0) tr.style.fontWeight = 'bold';
+    else tr.classList.add('text-dim');
+}
+
+async function runBatchSearch(btn) {
+    const text = document.getElementById('batch-input').value;
+    if (!text.trim()) return;
+    const status = document.getElementById('batch-status');
+    const view = document.getElementById('batch-view');
+    const originalText = btn.innerHTML;
+    btn.disabled = true;
+    btn.innerHTML = '<span class="loading"></span> Searching...';
+    view.style.display = 'none';
+    document.getElementById('batch-download').style.display = 'none';
+    document.getElementById('batch-body').innerHTML = '';
+    document.getElementById('batch-table').style.display = '';
+    batchRows = [];
+    let held = 0;
+
+    try {
+        const resp = await fetch('/api/batch-search', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({queries: text}),
+        });
+        if ((resp.headers.get('Content-Type') || '').startsWith('application/json')) {
+            const data = await resp.json();
+            status.textContent = data.error || '';
+            return;
+        }
+        const reader = resp.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let total = 0;
+        while (true) {
+            const {done, value} = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, {stream: true});
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            for (const line of lines) {
+                if (!line.trim()) continue;
+                const msg = JSON.parse(line);
+                if (msg.event === 'start') {
+                    total = msg.total;
+                } else if (msg.event === 'result') {
+                    batchRows[msg.index] = msg.row;
+                    if (msg.row['In Inventory'] > 0) held++;
+                    addBatchRow(msg.row);
+                    status.textContent = `${batchRows.filter(Boolean).length}/${total} done, ${held} held`;
+                } else if (msg.event === 'done') {
+                    status.textContent = `${held} of ${total} held (${msg.match_count} compounds)`;
+                    view.href = '/results?filter_id=' + msg.filter_id;
+                    view.style.display = '';
+                    document.getElementById('batch-download').style.display = '';
+                }
+            }
+        }
+    } catch (e) {
+        status.textContent = 'Error: ' + e.message;
+    } finally {
+        btn.disabled = false;
+        btn.innerHTML = originalText;
+    }
+}
+
+function downloadBatchReport() {
+    const quote = v => '"' + String(v ?? '').replace(/"/g, '""') + '"';
+    const lines = [BATCH_COLUMNS.map(quote).join(',')];
+    batchRows.filter(Boolean).forEach(row => lines.push(BATCH_COLUMNS.map(c => quote(row[c])).join(',')));
+    const blob = new Blob([lines.join('\r\n')], {type: 'text/csv'});
+    const a = document.createElement('a');
+    a.href = URL.createObjectURL(blob);
+    a.download = 'batch_report.csv';
+    a.click();
+    URL.revokeObjectURL(a.href);
+}
+
+async function combineSelectedSearch(operation, btn) {
+    if (!selectedCacheKey) {
+        alert('Please select a search from the list first.');
+        return;
+    }
+
+    const originalText = btn.innerHTML;
+    btn.disabled = true;
+    btn.innerHTML = '<span class="loading"></span> Searching...';
+
+    try {
+        const resp = await fetch('/api/combine-pubchem/' + operation +
+                                 '?cachekey=' + encodeURIComponent(selectedCacheKey),
+                                 { method: 'POST' });
+        const data = await resp.json();
+
+        if (data.error === 'stale_search') {
+            // Handle stale search specially
+            alert(data.message || 'This search has expired and is no longer available.');
+
+            // Mark as stale server-side (blacklist it)
+            await fetch('/api/mark-stale-search', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({cache_key: data.cache_key})
+            });
+
+            // Refresh history to remove it
+            await refreshHistory();
+        } else if (data.error) {
+            alert('Error: ' + data.error);
+        } else if (data.filter_id) {
+            window.location.href = '/results?filter_id=' + data.filter_id;
+            return;
+        }
+    } catch (e) {
+        alert('Error: ' + e.message);
+    } finally {
+        btn.disabled = false;
+        btn.innerHTML = originalText;
+        updateButtons();
+    }
+}
+
+async function refreshHistory() {
+    const tbody = document.getElementById('history-body');
+    if (tbody) {
+        tbody.innerHTML = `<tr><td colspan="5" class="text-dim" style="text-align: center; padding: 20px;">
+            <span class="loading" style="width: 14px; height: 14px;"></span> Refreshing...
+        </td></tr>`;
+    }
+    const previousKey = selectedCacheKey;
+    selectedCacheKey = null;
+    await loadHistory();
+    // Try to re-select previous selection
+    if (previousKey && searchHistory.find(h => h.cachekey === previousKey)) {
+        selectEntry(previousKey);
+    }
+}
+
+function toggleSection(id) {
+    const content = document.getElementById(id);
+    const icon = document.getElementById(id + '-icon');
+    if (content.classList.contains('open')) {
+        content.classList.remove('open');
+        icon.textContent = '+ expand';
+    } else {
+        content.classList.add('open');
+        icon.textContent = '- collapse';
+    }
+}
+
+// --- Direct PubChem search ---
+const SEARCH_MODE_INFO = {
+    'name': {placeholder: 'Enter name, CAS, or keyword...', hint: 'Search your lab chemicals by name or CAS number (typos are tolerated). Toggle All PubChem to search PubChem names instead.'},
+    'name-pubchem': {placeholder: 'Enter name, CAS, or keyword...', hint: 'Search PubChem by name, CAS number, or keyword. Results will be combined with your lab chemicals.'},
+    'smiles': {placeholder: 'Enter SMILES or draw...', hint: 'Find exact compound match by SMILES notation.'},
+    'substructure': {placeholder: 'Enter SMILES or draw...', hint: 'Find compounds containing this structure as a substructure.'},
+    'superstructure': {placeholder: 'Enter SMILES or draw...', hint: 'Find compounds where query is a superstructure (contains the target).'},
+    'similarity': {placeholder: 'Enter SMILES or draw...', hint: 'Find compounds with similar 2D structure (Tanimoto similarity).'},
+    'formula': {placeholder: 'e.g. C6H6, Hg, halogen, C=6 N=1 dbe>=4', hint: 'Match lab chemicals by element composition: exact formula, has/lacks elements (Hg, -N, only:CHNO), counts (C>=6, Cl:1-3, X>=2) and dbe>=4.'},
+};
+
+let currentSearchMode = 'name';
+
+function selectMode(mode, pill) {
+    currentSearchMode = mode;
+    document.querySelectorAll('.mode-pill').forEach(p => p.classList.remove('active'));
+    pill.classList.add('active');
+    updateSearchPlaceholder();
+}
+
+function updateSearchPlaceholder() {
+    const mode = currentSearchMode;
+    const input = document.getElementById('direct-search-input');
+    const hint = document.getElementById('search-mode-hint');
+    const allPubchem = mode === 'name' && document.getElementById('pubchem-toggle').checked;
+    const info = SEARCH_MODE_INFO[allPubchem ? 'name-pubchem' : mode] || SEARCH_MODE_INFO['name'];
+    input.placeholder = info.placeholder;
+    hint.textContent = info.hint;
+}
+
+// Structure searches run as background jobs so slow PubChem searches
+// don't tie up the server; the UI polls until the job finishes.
+const STRUCTURE_MODES = ['substructure', 'superstructure', 'similarity'];
+let currentSearchJob = null;
+
+async function runSearchJob(body) {
+    const resp = await fetch('/api/search-jobs', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify(body)
+    });
+    let job = await resp.json();
+    if (job.error) return job;
+    currentSearchJob = job.job_id;
+    const cancel = document.getElementById('search-cancel');
+    cancel.style.display = '';
+    try {
+        while (job.status === 'running') {
+            await new Promise(r => setTimeout(r, 700));
+            job = await (await fetch('/api/search-jobs/' + job.job_id)).json();
+            if (job.error) return job;
+        }
+    } finally {
+        cancel.style.display = 'none';
+        currentSearchJob = null;
+    }
+    return job.status === 'cancelled' ? null : job.result;
+}
+
+async function cancelSearchJob() {
+    if (currentSearchJob) {
+        await fetch('/api/search-jobs/' + currentSearchJob, {method: 'DELETE'});
+    }
+}
+
+async function directPubchemSearch(btn, historyOnly) {
+    const input = document.getElementById('direct-search-input');
+    const query = input.value.trim();
+    const mode = currentSearchMode;
+
+    if (!query) {
+        alert('Enter a search query');
+        return;
+    }
+
+    btn.disabled = true;
+    const originalText = btn.textContent;
+    btn.innerHTML = '<span class="loading"></span> Searching...';
+    const excludeOn = document.getElementById('exclude-toggle').checked;
+    const operation = excludeOn ? 'NOT' : 'AND';
+
+    try {
+        // Searches held locally are combined server-side in the same request
+        const body = historyOnly ? {query, mode} : {query, mode, operation};
+        body.pubchem = document.getElementById('pubchem-toggle').checked;
+        let data;
+        if (STRUCTURE_MODES.includes(mode)) {
+            data = await runSearchJob(body);
+            if (!data) return;  // cancelled
+        } else {
+            const resp = await fetch('/api/pubchem-search', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify(body)
+            });
+            data = await resp.json();
+        }
+
+        if (data.success) {
+            if (historyOnly) {
+                input.value = '';
+                await refreshHistory();
+                selectEntry(data.cache_key);
+            } else if (data.filter_id) {
+                input.value = '';
+                window.location.href = '/results?filter_id=' + data.filter_id;
+                return;
+            } else {
+                // Structure search: combine and navigate to results
+                btn.innerHTML = '<span class="loading"></span> Combining...';
+                const combResp = await fetch('/api/combine-pubchem/' + operation +
+                    '?cachekey=' + encodeURIComponent(data.cache_key),
+                    { method: 'POST' });
+                const combData = await combResp.json();
+
+                if (combData.error === 'stale_search') {
+                    alert(combData.message || 'This search has expired.');
+                    await fetch('/api/mark-stale-search', {
+                        method: 'POST',
+                        headers: {'Content-Type': 'application/json'},
+                        body: JSON.stringify({cache_key: combData.cache_key})
+                    });
+                    input.value = '';
+                    await refreshHistory();
+                } else if (combData.error) {
+                    alert('Error: ' + combData.error);
+                    // Fall back to showing in history
+                    input.value = '';
+                    await refreshHistory();
+                    selectEntry(data.cache_key);
+                } else if (combData.filter_id) {
+                    input.value = '';
+                    window.location.href = '/results?filter_id=' + combData.filter_id;
+                    return;
+                }
+            }
+        } else {
+            alert(data.error || 'Search failed');
+        }
+    } catch (e) {
+        alert('Error: ' + e.message);
+    } finally {
+        btn.disabled = false;
+        btn.textContent = originalText;
+    }
+}
+
+// --- Smart auto-refresh: poll file fingerprint every 50s, full fetch only on change ---
+let lastFingerprint = null;
+const POLL_INTERVAL_MS = 50000;
+
+async function pollForChanges() {
+    try {
+        const resp = await fetch('/api/pubchem-history/check');
+        const data = await resp.json();
+        const fp = data.fingerprint;
+        if (lastFingerprint !== null && fp !== lastFingerprint) {
+            // Storage files changed — do a full refresh
+            const statusEl = document.getElementById('auto-refresh-status');
+            if (statusEl) statusEl.textContent = 'Updating...';
+            await refreshHistory();
+        }
+        lastFingerprint = fp;
+    } catch (e) {
+        // Network error — ignore, will retry next tick
+    }
+    const statusEl = document.getElementById('auto-refresh-status');
+    if (statusEl) statusEl.textContent = 'Watching for changes';
+}
+
+function startAutoRefresh() {
+    autoRefreshInterval = setInterval(pollForChanges, POLL_INTERVAL_MS);
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    loadHistory();
+    // Capture initial fingerprint, then start polling
+    pollForChanges().then(() => startAutoRefresh());
+});
+
+// Cleanup on page leave
+window.addEventListener('beforeunload', () => {
+    if (autoRefreshInterval) clearInterval(autoRefreshInterval);
+});
+
+// --- Structure Drawer (Kekule.js) ---
+let composer = null;
+
+function openStructureDrawer() {
+    const modal = document.getElementById('structure-drawer-modal');
+    modal.style.display = 'flex';
+
+    // Initialize composer if not already done
+    if (!composer) {
+        const container = document.getElementById('kekule-composer-container');
+        composer = new Kekule.Editor.Composer(container);
+        composer.setDimension('100%', '400px');
+    }
+}
+
+function closeStructureDrawer() {
+    document.getElementById('structure-drawer-modal').style.display = 'none';
+}
+
+function useDrawnStructure() {
+    if (!composer) return;
+
+    const mol = composer.getChemObj();
+    if (!mol) {
+        alert('Please draw a structure first');
+        return;
+    }
+
+    let smiles;
+    try {
+        smiles = Kekule.IO.saveFormatData(mol, 'smi');
+    } catch (e) {
+        alert('Could not convert structure to SMILES: ' + e.message);
+        return;
+    }
+
+    if (!smiles) {
+        alert('Could not convert structure to SMILES');
+        return;
+    }
+
+    // Populate the search input
+    document.getElementById('direct-search-input').value = smiles;
+
+    // Set the search mode based on drawer dropdown selection
+    const searchType = document.getElementById('structure-search-type').value;
+    currentSearchMode = searchType;
+    document.querySelectorAll('.mode-pill').forEach(p => {
+        p.classList.toggle('active', p.dataset.mode === searchType);
+    });
+    updateSearchPlaceholder();
+
+    closeStructureDrawer();
+}
+
+// Close modal on escape key or clicking outside
+document.addEventListener('keydown', (e) => {
+    if (e.key === 'Escape') closeStructureDrawer();
+});
+
+document.addEventListener('click', (e) => {
+    const modal = document.getElementById('structure-drawer-modal');
+    if (e.target === modal) closeStructureDrawer();
+});
@@ -0,0 +1,341 @@
+// Session state for two-phase browser refresh
+let rugSessionId = null;
+
+async function openRugLogin(btn) {
+    if (!confirm('This will open a Chrome browser window.\n\nYou will need to:\n1. Log in to the RUG system (including MFA)\n2. Click Continue here when done\n\nContinue?')) {
+        return;
+    }
+
+    const statusDiv = document.getElementById('browser-refresh-status');
+    const statusText = document.getElementById('refresh-status-text');
+    const btnContinue = document.getElementById('btn-continue');
+    const instructions = document.getElementById('rug-instructions');
+    const spinner = document.getElementById('status-spinner');
+
+    btn.disabled = true;
+    statusDiv.style.display = 'block';
+    statusText.textContent = 'Opening browser... Check your desktop for Chrome window.';
+
+    try {
+        const resp = await fetch(REFRESH_START_URL, { method: 'POST' });
+        const data = await resp.json();
+
+        if (data.error) {
+            statusText.textContent = 'Error: ' + data.error;
+            btn.disabled = false;
+        } else if (data.session_id) {
+            rugSessionId = data.session_id;
+            spinner.style.display = 'none';
+            statusText.textContent = 'Browser opened. Log in to RUG (including MFA), then click Continue.';
+            instructions.textContent = 'Complete login in the Chrome window, then click Continue below.';
+            btnContinue.style.display = 'inline-block';
+        }
+    } catch (e) {
+        statusText.textContent = 'Error: ' + e.message;
+        btn.disabled = false;
+    }
+}
+
+async function continueAfterLogin(btn) {
+    if (!rugSessionId) {
+        alert('No active session. Please click "Fetch from RUG System" first.');
+        return;
+    }
+
+    const statusText = document.getElementById('refresh-status-text');
+    const spinner = document.getElementById('status-spinner');
+    const btnOpen = document.getElementById('btn-open-login');
+
+    btn.disabled = true;
+    spinner.style.display = 'inline-block';
+    statusText.textContent = 'Fetching chemicals data... This may take a moment.';
+
+    try {
+        const resp = await fetch(REFRESH_CONTINUE_URL.replace('SESSION_ID_PLACEHOLDER', rugSessionId), { method: 'POST' });
+        const data = await resp.json();
+
+        if (data.error) {
+            spinner.style.display = 'none';
+            statusText.textContent = 'Error: ' + data.error;
+            btn.disabled = false;
+            btnOpen.disabled = false;
+            btn.style.display = 'none';
+            rugSessionId = null;
+        } else if (data.success) {
+            statusText.textContent = 'Success! Saved: ' + data.snapshot;
+            setTimeout(() => window.location.reload(), 1500);
+        }
+    } catch (e) {
+        spinner.style.display = 'none';
+        statusText.textContent = 'Error: ' + e.message;
+        btn.disabled = false;
+        btnOpen.disabled = false;
+        btn.style.display = 'none';
+        rugSessionId = null;
+    }
+}
+
+function toggleSection(id) {
+    const content = document.getElementById(id);
+    const icon = document.getElementById(id + '-icon');
+    if (content.classList.contains('open')) {
+        content.classList.remove('open');
+        icon.textContent = '+ expand';
+    } else {
+        content.classList.add('open');
+        icon.textContent = '- collapse';
+    }
+}
+
+// Poll compound-info background fetch status
+async function pollCompoundInfoSetup() {
+    const el = document.getElementById('compound-info-status');
+    const text = document.getElementById('ci-status-text');
+    const spinner = document.getElementById('ci-spinner');
+    if (!el) return;
+    try {
+        const resp = await fetch('/api/compound-info-status');
+        const data = await resp.json();
+        if (data.status === 'running') {
+            el.style.display = 'block';
+            spinner.style.display = 'inline-block';
+            text.textContent = data.phase === 'ingest'
+                ? 'Reading PubChem extract files... ' + data.progress
+                : 'Fetching compound info (structures, hazards)... ' + data.progress;
+            setTimeout(pollCompoundInfoSetup, 3000);
+        } else if (data.status === 'done') {
+            el.style.display = 'block';
+            spinner.style.display = 'none';
+            text.innerHTML = '<span class="text-success">Compound info (structures, hazards) ready.</span>';
+        } else {
+            el.style.display = 'none';
+        }
+    } catch(e) {}
+}
+document.addEventListener('DOMContentLoaded', pollCompoundInfoSetup);
+
+async function ingestExtracts(btn) {
+    const directory = document.getElementById('extracts-dir').value.trim();
+    if (!directory) { alert('Enter the folder containing the extract files'); return; }
+    btn.disabled = true;
+    try {
+        const resp = await fetch('/api/ingest-extracts', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({directory: directory}),
+        });
+        const data = await resp.json();
+        if (data.error) { alert('Error: ' + data.error); return; }
+        pollCompoundInfoSetup();
+    } catch (e) {
+        alert('Error: ' + e.message);
+    } finally {
+        btn.disabled = false;
+    }
+}
+
+function filterTable() {
+    const filter = document.getElementById('filter-select').value;
+    const rows = document.querySelectorAll('#results-body tr');
+    rows.forEach(row => {
+        const status = row.dataset.status;
+        if (filter === 'all') {
+            row.style.display = '';
+        } else if (filter === 'found' && status === 'found') {
+            row.style.display = '';
+        } else if (filter === 'not_found' && status === 'not_found') {
+            row.style.display = '';
+        } else {
+            row.style.display = 'none';
+        }
+    });
+}
+
+// ---- Repair unmatched entries ----
+async function startRepair() {
+    if (!confirm('This will search PubChem for matches and let you review them before saving.\n\nContinue?')) return;
+
+    const statusBox = document.getElementById('repair-status-box');
+    const statusText = document.getElementById('repair-status-text');
+    const btn = document.getElementById('btn-repair');
+
+    btn.disabled = true;
+    statusBox.style.display = 'flex';
+    statusText.textContent = 'Starting repair...';
+
+    try {
+        const startResp = await fetch('/api/repair-unmatched/start', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({})
+        });
+        const startData = await startResp.json();
+
+        if (startData.error) {
+            alert('Error: ' + startData.error);
+            btn.disabled = false;
+            statusBox.style.display = 'none';
+            return;
+        }
+
+        pollRepairStatus();
+    } catch (e) {
+        alert('Error: ' + e.message);
+        btn.disabled = false;
+        statusBox.style.display = 'none';
+    }
+}
+
+async function pollRepairStatus() {
+    const statusBox = document.getElementById('repair-status-box');
+    const statusText = document.getElementById('repair-status-text');
+    const spinner = document.getElementById('repair-spinner');
+    const btn = document.getElementById('btn-repair');
+
+    try {
+        const resp = await fetch('/api/repair-unmatched/status');
+        const data = await resp.json();
+
+        if (data.status === 'running') {
+            statusText.textContent = 'Repairing... ' + data.progress;
+            setTimeout(() => pollRepairStatus(), 2000);
+        } else if (data.status === 'done') {
+            spinner.style.display = 'none';
+            statusText.textContent = 'Repair scan complete! Loading results...';
+            setTimeout(async () => {
+                const hasPending = await loadPendingRepairs();
+                if (hasPending) {
+                    statusBox.style.display = 'none';
+                    document.getElementById('review-repairs-card').scrollIntoView({behavior: 'smooth'});
+                } else {
+                    statusText.textContent = 'No matches found.';
+                }
+                btn.disabled = false;
+            }, 500);
+        } else {
+            statusBox.style.display = 'none';
+            btn.disabled = false;
+        }
+    } catch (e) {
+        statusText.textContent = 'Error checking status';
+        btn.disabled = false;
+    }
+}
+
+async function loadPendingRepairs() {
+    try {
+        const resp = await fetch('/api/repair-unmatched/pending');
+        const data = await resp.json();
+        if (data.repaired_entries && data.repaired_entries.length > 0) {
+            displayPendingRepairs(data.repaired_entries);
+            document.getElementById('review-repairs-card').style.display = 'block';
+            return true;
+        }
+    } catch (e) {
+        console.error('Failed to load pending repairs:', e);
+    }
+    return false;
+}
+
+function displayPendingRepairs(entries) {
+    const tbody = document.getElementById('pending-repairs-body');
+    tbody.innerHTML = entries.map(entry =>
+        '<tr>' +
+        '<td><input type="checkbox" class="repair-checkbox" value="' + entry.row_index + '" checked></td>' +
+        '<td>' + entry.name + '</td>' +
+        '<td class="mono">' + entry.cas + '</td>' +
+        '<td class="mono">' + (entry.real_cas || '<span class="text-dim">-</span>') + '</td>' +
+        '<td><a href="https://pubchem.ncbi.nlm.nih.gov/compound/' + entry.cid + '" target="_blank" class="mono" style="color: var(--success);">' + entry.cid + '</a></td>' +
+        '<td><img src="/img/' + entry.cid + '" style="width: 40px; height: 40px; background: white; border-radius: 2px;" alt="structure"></td>' +
+        '</tr>'
+    ).join('');
+}
+
+function toggleAllRepairs(checked) {
+    document.querySelectorAll('.repair-checkbox').forEach(cb => cb.checked = checked);
+}
+
+async function applySelectedRepairs(btn) {
+    const selected = Array.from(document.querySelectorAll('.repair-checkbox:checked')).map(cb => cb.value);
+    if (selected.length === 0) { alert('No repairs selected'); return; }
+    if (!confirm('Apply ' + selected.length + ' repairs?')) return;
+
+    btn.disabled = true;
+    const originalText = btn.textContent;
+    btn.textContent = 'Applying...';
+
+    try {
+        const resp = await fetch('/api/repair-unmatched/apply', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({approved: selected})
+        });
+        const data = await resp.json();
+        if (data.success) {
+            alert('Applied ' + data.applied + ' repairs successfully!');
+            window.location.reload();
+        } else {
+            alert('Error: ' + (data.error || 'Unknown error'));
+        }
+    } catch (e) {
+        alert('Error: ' + e.message);
+    } finally {
+        btn.disabled = false;
+        btn.textContent = originalText;
+    }
+}
+
+// --- Quick Import ---
+async function importFromUrl(btn) {
+    const url = document.getElementById('import-url').value.trim();
+    if (!url) { alert('Enter a URL'); return; }
+    btn.disabled = true; btn.textContent = 'Importing...';
+    try {
+        const resp = await fetch('/api/import-database-url', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({url})
+        });
+        const data = await resp.json();
+        if (data.success) {
+            window.location.reload();
+        } else if (data.auth_required) {
+            window.open(data.url, '_blank');
+            alert('Authentication required. The file is opening in your browser.\nDownload it, then use the file picker to import.');
+            btn.disabled = false; btn.textContent = 'Import from URL';
+        } else {
+            alert('Import failed: ' + data.error);
+            btn.disabled = false; btn.textContent = 'Import from URL';
+        }
+    } catch (e) {
+        alert('Import failed: ' + e.message);
+        btn.disabled = false; btn.textContent = 'Import from URL';
+    }
+}
+
+async function importFromFile(input) {
+    const file = input.files[0];
+    if (!file) return;
+    const statusDiv = document.getElementById('import-status');
+    const statusText = document.getElementById('import-status-text');
+    statusDiv.style.display = '';
+    statusText.textContent = 'Reading file...';
+    try {
+        const text = await file.text();
+        statusText.textContent = 'Importing...';
+        const resp = await fetch('/api/import-database', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: text
+        });
+        const data = await resp.json();
+        if (data.success) { window.location.reload(); }
+        else { alert('Import failed: ' + data.error); statusDiv.style.display = 'none'; }
+    } catch (e) {
+        alert('Import failed: ' + e.message);
+        statusDiv.style.display = 'none';
+    }
+}
+
+// Check for pending repairs on page load
+document.addEventListener('DOMContentLoaded', loadPendingRepairs);
@@ -25,26 +25,41 @@ if sys.stdout is None:
 
 APP_VERSION = "1.0.5"
 
+import copy
+import gzip
+import hashlib
 import json
 from datetime import datetime
 from pathlib import Path
 
-from flask import Flask, render_template_string, jsonify, request, redirect, url_for, Response
+from flask import Flask, render_template, jsonify, request, redirect, url_for, Response, send_file, stream_with_context
 
 # Import functions from the main script
 import logging
 
+import aiohttp
+import numpy as np
+import pandas as pd
 import requests as _requests
+from jinja2 import ChoiceLoader, DictLoader, FileSystemBytecodeCache
 
 from extract_chemicals import (
+    BUNDLE_DIR,
     DATA_DIR,
     SNAPSHOTS_DIR,
     CID_CACHE_FILE,
     RUG_TABLE_FILE,
     COMPOUND_INFO_FILE,
+    FILTER_RESULTS_FILE,
+    APP_SEARCHES_FILE,
+    STALE_SEARCHES_FILE,
     LATEST_POINTER,
     list_snapshots,
     load_cid_cache,
+    write_json_file,
+    json_file_version,
+    get_rug_row_index,
+    rug_row_positions,
     is_cid_cache_valid,
     compute_file_hash,
     save_cid_cache,
@@ -52,6 +67,10 @@ from extract_chemicals import (
     extract_cas_numbers,
     lookup_cas_to_cid_optimized,
     upload_cids_to_pubchem_cache,
+    get_inventory_cache_key,
+    invalidate_inventory_cache_key,
+    PUBCHEM_CACHE_KEY_TTL,
+    combine_cid_sets,
     refresh_html_from_browser,
     start_browser_session,
     complete_browser_session,
@@ -65,13 +84,59 @@ from extract_chemicals import (
     save_rug_table,
     load_rug_table,
     fetch_cids_from_listkey,
+    is_expired_search_key,
+    search_key_alive,
     save_filter_result,
     load_filter_results,
+    get_filter_cids,
+    cid_array,
+    parse_query,
+    run_query,
+    evaluate_predicate,
+    QUERY_LOCAL_KINDS,
+    get_cached_cid_set,
+    has_cached_cid_set,
+    store_cid_set,
+    get_search_cids,
+    local_search_key,
+    is_local_search_key,
+    has_rdkit,
+    get_structure_index,
+    local_structure_search,
+    similar_compounds,
+    SIMILARITY_MIN_THRESHOLD,
+    find_near_duplicates,
+    formula_query_cids,
+    get_name_index,
+    local_name_search,
+    name_search_cids,
+    wait_for_pubchem_slot,
+    wait_for_pubchem_slot_async,
+    read_batch_queries,
+    batch_search,
+    index_rows_by_cid,
+    batch_report_row,
+    BATCH_MAX_QUERIES,
     toggle_saved_filter,
+    set_filter_pubchem_url,
     delete_filter_result,
     load_compound_info,
     save_compound_info,
     fetch_compound_properties,
+    select_stale_cids,
+    cids_for_request_budget,
+    refresh_compound_info,
+    COMPOUND_INFO_MAX_AGE_DAYS,
+    COMPOUND_REFRESH_BUDGET,
+    COMPOUND_REFRESH_INTERVAL,
+    GHS_CODES,
+    structure_image_url,
+    get_structure_image,
+    prefetch_structure_images,
+    get_ghs_pictogram,
+    build_ghs_sprite,
+    ingest_pubchem_extracts,
+    find_extract_files,
     load_app_searches,
     save_app_search,
     save_app_search_with_metadata,
@@ -92,71 +157,276 @@ def inject_version():
 # Background compound info fetch
 # ============================================================================
 import asyncio
+import queue
 import threading
+import time
+import uuid
 
-_compound_info_status = {"status": "idle", "fetched": 0, "total": 0}
+_compound_info_status = {"status": "idle", "phase": "", "fetched": 0, "total": 0}
 _compound_info_lock = threading.Lock()
-_compound_info_force = False
+
+# Background refresh of stale compound info (see _bg_refresh_scheduler)
+_refresh_status = {"status": "idle", "refreshed": 0, "total": 0, "last_run": None}
+_refresh_budget = COMPOUND_REFRESH_BUDGET
+_refresh_wakeup = threading.Event()
+
+# Structure thumbnail prefetch state
+_image_prefetch_status = {"status": "idle", "fetched": 0, "total": 0}
+
+# Background download of PubChem search CID sets into the local cache
+_cid_set_queue: "queue.Queue[str]" = queue.Queue()
+_cid_set_pending: set[str] = set()
+_cid_set_failed: set[str] = set()  # confirmed expired on PubChem; don't retry
+_cid_set_worker_lock = threading.Lock()  # guards the two sets and the worker start
+_cid_set_worker_started = False
 
 # Repair task state
 _repair_status = {"status": "idle", "processed": 0, "total": 0, "current_name": ""}
 _repair_lock = threading.Lock()
 
 
+def _inventory_cids() -> list[int]:
+    """All CIDs currently matched in the CID cache."""
+    cache = load_cid_cache()
+    if not cache or "results" not in cache:
+        return []
+    return [
+        int(r["cid"])
+        for r in cache["results"].values()
+        if r.get("cid") is not None
+    ]
+
+
 def _bg_fetch_compound_info():
-    """Background thread: fetch compound properties + GHS for all CIDs."""
-    global _compound_info_force
+    """Background thread: fetch compound properties + GHS for new CIDs."""
     with _compound_info_lock:
         _compound_info_status["status"] = "running"
+        _compound_info_status["phase"] = "fetch"
         _compound_info_status["fetched"] = 0
         _compound_info_status["total"] = 0
-        force = _compound_info_force
-        _compound_info_force = False
 
     try:
-        existing = {} if force else load_compound_info().get("compounds", {})
-        cache = load_cid_cache()
-        if not cache or "results" not in cache:
-            logger.info("compound-info bg: no CID cache, nothing to do")
-            return
-
-        all_cids = [
-            int(r["cid"])
-            for r in cache["results"].values()
-            if r.get("cid") is not None
-        ]
+        existing = load_compound_info().get("compounds", {})
+        all_cids = _inventory_cids()
         if not all_cids:
+            logger.info("compound-info bg: no CIDs, nothing to do")
             return
 
         def progress_cb(fetched, total):
             _compound_info_status["fetched"] = fetched
             _compound_info_status["total"] = total
 
+        def save_fetched(result):
+            # Merge only what this fetch added into a fresh copy — a refresh
+            # cycle may have saved since the fetch started
+            fetched = {cid: entry for cid, entry in result.items() if existing.get(cid) != entry}
+            with _compound_info_lock:
+                info = load_compound_info()
+                merged = {**info.get("compounds", {}), **fetched}
+                save_compound_info({**info, "version": 1, "compounds": merged})
+            return merged
+
         loop = asyncio.new_event_loop()
         result = loop.run_until_complete(
-            fetch_compound_properties(all_cids, existing, progress_cb)
+            fetch_compound_properties(all_cids, existing, progress_cb, save_fetched)
         )
         loop.close()
 
-        save_compound_info({"version": 1, "compounds": result})
+        result = save_fetched(result)
         logger.info("compound-info bg: done, %d compounds", len(result))
+        if has_rdkit():
+            # Fingerprint new structures now rather than on the first search
+            get_structure_index(all_cids, result)
+        get_name_index((load_rug_table() or {}).get("rows", []), result)
     except Exception:
         logger.exception("compound-info bg: error")
     finally:
         _compound_info_status["status"] = "done"
+        # New CIDs may have made older entries due; let the scheduler look
+        _refresh_wakeup.set()
+        start_image_prefetch()
 
 
-def start_compound_info_fetch(force=False):
-    """Kick off background compound info fetch if not already running."""
-    global _compound_info_force
+def start_compound_info_fetch():
+    """Kick off background fetch of compound info for CIDs not yet cached."""
     if _compound_info_status["status"] == "running":
         return
-    if force:
-        _compound_info_force = True
     t = threading.Thread(target=_bg_fetch_compound_info, daemon=True)
     t.start()
 
 
+def _bg_ingest_extracts(directory: Path):
+    """Background thread: fill compound info from PubChem extract files."""
+    try:
+        def progress_cb(done, total):
+            _compound_info_status["fetched"] = done
+            _compound_info_status["total"] = total
+
+        existing = load_compound_info().get("compounds", {})
+        compounds, stats = ingest_pubchem_extracts(directory, _inventory_cids(), existing, progress_cb)
+        # Merge only the ingested entries into a fresh copy, like the fetch
+        ingested = {cid: entry for cid, entry in compounds.items() if existing.get(cid) != entry}
+        with _compound_info_lock:
+            info = load_compound_info()
+            save_compound_info({**info, "version": 1, "compounds": {**info.get("compounds", {}), **ingested}})
+        logger.info("extract-ingest bg: done %s", stats)
+    except Exception:
+        logger.exception("extract-ingest bg: error")
+    finally:
+        _compound_info_status["status"] = "done"
+    # Whatever the extracts lack (GHS, CIDs not in the files) comes from PubChem
+    start_compound_info_fetch()
+
+
+def start_extract_ingest(directory: Path) -> bool:
+    """Kick off extract ingestion; False if a compound info job is running."""
+    with _compound_info_lock:
+        if _compound_info_status["status"] == "running":
+            return False
+        _compound_info_status["status"] = "running"
+        _compound_info_status["phase"] = "ingest"
+        _compound_info_status["fetched"] = 0
+        _compound_info_status["total"] = 0
+    t = threading.Thread(target=_bg_ingest_extracts, args=(directory,), daemon=True)
+    t.start()
+    return True
+
+
+def _bg_prefetch_images():
+    """Background thread: download structure thumbnails for all CIDs."""
+    _image_prefetch_status["status"] = "running"
+    _image_prefetch_status["fetched"] = 0
+    _image_prefetch_status["total"] = 0
+    try:
+        def progress_cb(fetched, total):
+            _image_prefetch_status["fetched"] = fetched
+            _image_prefetch_status["total"] = total
+
+        loop = asyncio.new_event_loop()
+        try:
+            n = loop.run_until_complete(
+                prefetch_structure_images(_inventory_cids(), "s", progress_cb)
+            )
+        finally:
+            loop.close()
+        logger.info("image-prefetch bg: done, %d thumbnails downloaded", n)
+    except Exception:
+        logger.exception("image-prefetch bg: error")
+    finally:
+        _image_prefetch_status["status"] = "done"
+
+
+def start_image_prefetch():
+    """Kick off background thumbnail prefetch if not already running."""
+    if _image_prefetch_status["status"] == "running":
+        return
+    t = threading.Thread(target=_bg_prefetch_images, daemon=True)
+    t.start()
+
+
+def _bg_cid_set_worker():
+    """Background thread: download queued searches' CID sets, one at a time."""
+    while True:
+        cache_key = _cid_set_queue.get()
+        try:
+            if not has_cached_cid_set(cache_key):
+                wait_for_pubchem_slot()
+                if get_search_cids(cache_key) is not None:
+                    logger.info("cid-set bg: cached search %s...", cache_key[:20])
+                elif is_expired_search_key(cache_key):
+                    with _cid_set_worker_lock:
+                        _cid_set_failed.add(cache_key)
+                else:
+                    # Network / rate limit: left to a later queue_cid_set_downloads
+                    logger.info("cid-set bg: download of %s... failed, will retry", cache_key[:20])
+        except Exception:
+            logger.exception("cid-set bg: error for %s...", cache_key[:20])
+        finally:
+            with _cid_set_worker_lock:
+                _cid_set_pending.discard(cache_key)
+
+
+def queue_cid_set_downloads(cache_keys):
+    """Queue searches for background download into the local CID-set cache."""
+    global _cid_set_worker_started
+    for cache_key in cache_keys:
+        if is_local_search_key(cache_key) or has_cached_cid_set(cache_key):
+            continue
+        with _cid_set_worker_lock:
+            if cache_key in _cid_set_pending or cache_key in _cid_set_failed:
+                continue
+            _cid_set_pending.add(cache_key)
+        _cid_set_queue.put(cache_key)
+    with _cid_set_worker_lock:
+        if not _cid_set_worker_started:
+            _cid_set_worker_started = True
+            threading.Thread(target=_bg_cid_set_worker, daemon=True).start()
+
+
+def _run_compound_refresh():
+    """Refresh the oldest compound info entries within the request budget."""
+    max_cids = cids_for_request_budget(_refresh_budget)
+    if not max_cids:
+        return
+    compounds = load_compound_info().get("compounds", {})
+    stale = select_stale_cids(compounds, _inventory_cids(), limit=max_cids)
+    if not stale:
+        return
+
+    logger.info("compound-refresh: refreshing %d stale entries", len(stale))
+    _refresh_status["status"] = "running"
+    _refresh_status["refreshed"] = 0
+    _refresh_status["total"] = len(stale)
+
+    def progress_cb(done, total):
+        _refresh_status["refreshed"] = done
+
+    loop = asyncio.new_event_loop()
+    try:
+        refreshed = loop.run_until_complete(
+            refresh_compound_info(stale, compounds, progress_cb)
+        )
+    finally:
+        loop.close()
+
+    # Merge into a fresh copy — the main fetch may have saved in the meantime
+    with _compound_info_lock:
+        info = load_compound_info()
+        save_compound_info({**info, "compounds": {**info.get("compounds", {}), **refreshed}})
+    logger.info("compound-refresh: done")
+
+
+def _bg_refresh_scheduler():
+    """Background thread: periodically refresh stale compound info.
+
+    Low priority — it stays out of the way while the main fetch runs and
+    spends at most _refresh_budget PubChem requests per cycle.
+    """
+    while True:
+        _refresh_wakeup.wait(COMPOUND_REFRESH_INTERVAL)
+        _refresh_wakeup.clear()
+        if _compound_info_status["status"] == "running":
+            continue
+        try:
+            _run_compound_refresh()
+        except Exception:
+            logger.exception("compound-refresh: error")
+        finally:
+            _refresh_status["status"] = "idle"
+            _refresh_status["last_run"] = datetime.now().isoformat()
+
+
+def start_refresh_scheduler(budget: int = COMPOUND_REFRESH_BUDGET):
+    """Start the stale compound info refresh thread (budget 0 disables it)."""
+    global _refresh_budget
+    _refresh_budget = budget
+    if budget <= 0:
+        logger.info("compound-refresh: disabled")
+        return
+    t = threading.Thread(target=_bg_refresh_scheduler, daemon=True)
+    t.start()
+
+
 def _bg_repair_unmatched():
     """Background thread: repair unmatched entries via text search (always review mode)."""
     from extract_chemicals import repair_unmatched_entries, load_rug_table, save_cid_cache, load_cid_cache
@@ -186,7 +456,7 @@ def _bg_repair_unmatched():
         # Mark failed entries on rug_table rows
         failed_indices = result.get("failed_indices", [])
         if failed_indices:
-            rug_table = load_rug_table()
+            rug_table = copy.deepcopy(load_rug_table())
             if rug_table:
                 rows = rug_table.get("rows", [])
                 for ri in failed_indices:
@@ -194,7 +464,7 @@ def _bg_repair_unmatched():
                         rows[ri]["_repair_status"] = "failed"
                 # Save updated rug_table
                 from extract_chemicals import RUG_TABLE_FILE
-                RUG_TABLE_FILE.write_text(_json.dumps(rug_table, indent=2, default=str))
+                write_json_file(RUG_TABLE_FILE, rug_table, default=str)
 
         # Always save pending repairs for review
         if result.get("repaired_entries"):
@@ -246,387 +516,7 @@ BASE_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>{{ title }} - RUG Chemical Search</title>
-    <style>
-        :root, [data-theme="dark"] {
-            --bg: #1a1a2e;
-            --bg-light: #16213e;
-            --accent: #0f3460;
-            --highlight: #e94560;
-            --text: #eee;
-            --text-dim: #888;
-            --success: #4ecca3;
-            --warning: #ffc107;
-        }
-        [data-theme="light"] {
-            --bg: #f0f2f5;
-            --bg-light: #ffffff;
-            --accent: #d8dde6;
-            --highlight: #d63031;
-            --text: #1a1a2e;
-            --text-dim: #636e72;
-            --success: #00b894;
-            --warning: #e17055;
-        }
-        * { box-sizing: border-box; margin: 0; padding: 0; }
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background: var(--bg);
-            color: var(--text);
-            line-height: 1.6;
-            min-height: 100vh;
-        }
-        .container { max-width: 1200px; margin: 0 auto; padding: 20px; }
-        header {
-            background: var(--bg-light);
-            padding: 15px 0;
-            margin-bottom: 30px;
-            border-bottom: 2px solid var(--accent);
-        }
-        header .container {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-        h1 { font-size: 1.5rem; }
-        h1 span { color: var(--highlight); }
-        nav { display: flex; align-items: center; gap: 10px; }
-        nav a {
-            color: var(--text);
-            text-decoration: none;
-            padding: 8px 16px;
-            border-radius: 4px;
-            transition: background 0.2s;
-        }
-        nav a:hover { background: var(--accent); }
-        nav a.active { background: var(--highlight); }
-        .nav-divider { width: 1px; height: 24px; background: var(--accent); margin: 0 5px; }
-        .btn-quit {
-            background: transparent;
-            border: 1px solid var(--text-dim);
-            color: var(--text-dim);
-            padding: 6px 12px;
-            border-radius: 4px;
-            cursor: pointer;
-            font-size: 0.8rem;
-            transition: all 0.2s;
-        }
-        .btn-quit:hover { border-color: var(--highlight); color: var(--highlight); }
-
-        .card {
-            background: var(--bg-light);
-            border-radius: 8px;
-            padding: 20px;
-            margin-bottom: 20px;
-        }
-        .card h2 {
-            font-size: 1.1rem;
-            margin-bottom: 15px;
-            color: var(--highlight);
-            border-bottom: 1px solid var(--accent);
-            padding-bottom: 10px;
-        }
-
-        .stats {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(150px, 1fr));
-            gap: 15px;
-            margin-bottom: 20px;
-        }
-        .stat {
-            background: var(--accent);
-            padding: 15px;
-            border-radius: 6px;
-            text-align: center;
-        }
-        .stat-value {
-            font-size: 2rem;
-            font-weight: bold;
-            color: var(--success);
-        }
-        .stat-label { font-size: 0.85rem; color: var(--text-dim); }
-
-        /* Tooltip styles */
-        .info {
-            display: inline-flex;
-            align-items: center;
-            justify-content: center;
-            width: 16px;
-            height: 16px;
-            background: var(--accent);
-            color: var(--text-dim);
-            border-radius: 50%;
-            font-size: 11px;
-            cursor: help;
-            margin-left: 6px;
-            position: relative;
-            vertical-align: middle;
-        }
-        .info:hover { color: var(--text); background: var(--highlight); }
-        .info .tip {
-            display: none;
-            position: absolute;
-            bottom: calc(100% + 8px);
-            left: 50%;
-            transform: translateX(-50%);
-            background: var(--bg);
-            border: 1px solid var(--accent);
-            padding: 10px 14px;
-            border-radius: 6px;
-            font-size: 0.85rem;
-            width: 280px;
-            text-align: left;
-            color: var(--text);
-            font-weight: normal;
-            line-height: 1.5;
-            z-index: 100;
-            box-shadow: 0 4px 12px rgba(0,0,0,0.3);
-        }
-        .info .tip::after {
-            content: '';
-            position: absolute;
-            top: 100%;
-            left: 50%;
-            transform: translateX(-50%);
-            border: 6px solid transparent;
-            border-top-color: var(--accent);
-        }
-        .info:hover .tip { display: block; }
-        .card-header {
-            display: flex;
-            align-items: center;
-            font-size: 1.1rem;
-            margin-bottom: 15px;
-            color: var(--highlight);
-            border-bottom: 1px solid var(--accent);
-            padding-bottom: 10px;
-        }
-        .card-header h2 { margin: 0; border: none; padding: 0; }
-
-        table {
-            width: 100%;
-            border-collapse: collapse;
-            font-size: 0.9rem;
-        }
-        th, td {
-            padding: 10px 12px;
-            text-align: left;
-            border-bottom: 1px solid var(--accent);
-        }
-        th { color: var(--text-dim); font-weight: 500; }
-        #results-data-table tbody tr:nth-child(odd) { background: rgba(128,128,128,0.04); }
-        tr:hover { background: var(--accent); }
-        tr.selected { background: var(--accent); border-left: 3px solid var(--highlight); }
-
-        .btn {
-            display: inline-block;
-            padding: 10px 20px;
-            background: var(--highlight);
-            color: white;
-            border: none;
-            border-radius: 4px;
-            cursor: pointer;
-            text-decoration: none;
-            font-size: 0.9rem;
-            transition: opacity 0.2s;
-        }
-        .btn:hover { opacity: 0.9; }
-        .btn:disabled { opacity: 0.5; cursor: not-allowed; }
-        .btn-secondary { background: var(--accent); color: var(--text); }
-        .btn-success { background: var(--success); color: #000; }
-        .btn-large {
-            padding: 16px 32px;
-            font-size: 1.1rem;
-            font-weight: 500;
-        }
-
-        .badge {
-            display: inline-block;
-            padding: 2px 8px;
-            border-radius: 12px;
-            font-size: 0.75rem;
-            font-weight: 500;
-        }
-        .badge-success { background: var(--success); color: #000; }
-        .badge-warning { background: var(--warning); color: #000; }
-        .badge-dim { background: var(--accent); }
-
-        .alert {
-            padding: 15px;
-            border-radius: 6px;
-            margin-bottom: 20px;
-        }
-        .alert-info { background: var(--accent); border-left: 4px solid var(--highlight); }
-        .alert-success { background: rgba(78, 204, 163, 0.2); border-left: 4px solid var(--success); }
-
-        .actions { display: flex; gap: 10px; flex-wrap: wrap; }
-
-        .loading {
-            display: inline-block;
-            width: 20px;
-            height: 20px;
-            border: 2px solid var(--text-dim);
-            border-top-color: var(--highlight);
-            border-radius: 50%;
-            animation: spin 1s linear infinite;
-        }
-        @keyframes spin { to { transform: rotate(360deg); } }
-
-        #results-table { max-height: 400px; overflow-y: auto; }
-
-        .mono { font-family: 'SF Mono', Monaco, monospace; font-size: 0.85rem; }
-        .text-dim { color: var(--text-dim); }
-        .text-success { color: var(--success); }
-        .text-warning { color: var(--warning); }
-
-        select, input[type="file"] {
-            background: var(--accent);
-            color: var(--text);
-            border: 1px solid var(--bg);
-            padding: 8px 12px;
-            border-radius: 4px;
-            font-size: 0.9rem;
-        }
-        select:focus, input:focus { outline: 2px solid var(--highlight); }
-
-        /* Collapsible sections */
-        .collapsible-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            cursor: pointer;
-            padding: 10px 0;
-        }
-        .collapsible-header:hover { opacity: 0.8; }
-        .collapsible-content { display: none; padding-top: 15px; }
-        .collapsible-content.open { display: block; }
-        .toggle-icon { font-size: 0.8rem; color: var(--text-dim); }
-
-        /* Search page specific */
-        .search-hero {
-            padding: 24px;
-            background: linear-gradient(135deg, color-mix(in srgb, var(--highlight) 15%, var(--bg-light)) 0%, color-mix(in srgb, var(--highlight) 6%, var(--bg-light)) 100%);
-            border: 1.5px solid color-mix(in srgb, var(--highlight) 40%, transparent);
-            border-radius: 12px;
-            margin-bottom: 25px;
-            box-shadow: 0 0 20px color-mix(in srgb, var(--highlight) 15%, transparent), 0 2px 8px rgba(0,0,0,0.2);
-        }
-        .search-hero h2 {
-            font-size: 1.15rem;
-            margin-bottom: 15px;
-            color: var(--highlight);
-            border-bottom: 1px solid color-mix(in srgb, var(--highlight) 30%, transparent);
-            padding-bottom: 10px;
-        }
-        .search-status {
-            font-size: 0.9rem;
-            color: var(--text-dim);
-            margin-top: 15px;
-        }
-
-        /* Search input with inline draw button */
-        .search-input-wrapper {
-            position: relative;
-            display: flex;
-            flex: 1;
-        }
-        .search-input-wrapper input {
-            width: 100%;
-            padding: 14px 80px 14px 16px;
-            border-radius: 8px;
-            border: 1px solid var(--accent);
-            background: var(--bg);
-            color: var(--text);
-            font-size: 1.05rem;
-        }
-        .draw-btn {
-            position: absolute;
-            right: 8px;
-            top: 50%;
-            transform: translateY(-50%);
-            background: transparent;
-            border: none;
-            opacity: 0.5;
-            transition: opacity 0.2s;
-            cursor: pointer;
-            display: flex;
-            flex-direction: column;
-            align-items: center;
-            gap: 1px;
-            padding: 4px 6px;
-            color: var(--text);
-        }
-        .draw-btn:hover { opacity: 0.85; }
-        .draw-btn .draw-label { font-size: 0.6rem; }
-
-        /* Mode selector pills */
-        .mode-selector {
-            display: flex;
-            gap: 6px;
-            flex-wrap: wrap;
-            margin-top: 10px;
-        }
-        .mode-pill {
-            padding: 6px 14px;
-            border: 1px solid var(--accent);
-            border-radius: 6px;
-            background: transparent;
-            cursor: pointer;
-            color: var(--text);
-            font-size: 0.85rem;
-            transition: all 0.2s;
-        }
-        .mode-pill:hover { border-color: var(--highlight); }
-        .mode-pill.active {
-            background: var(--highlight);
-            color: white;
-            border-color: var(--highlight);
-        }
-
-        /* Structure drawer modal */
-        .modal {
-            display: none;
-            position: fixed;
-            top: 0; left: 0; right: 0; bottom: 0;
-            background: rgba(0,0,0,0.7);
-            z-index: 1000;
-            align-items: center;
-            justify-content: center;
-        }
-        .modal-content {
-            background: var(--bg-light);
-            border-radius: 8px;
-            max-width: 600px;
-            width: 90%;
-        }
-        .modal-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            padding: 15px 20px;
-            border-bottom: 1px solid var(--accent);
-        }
-        .modal-header h3 { margin: 0; }
-        .modal-close {
-            background: none; border: none;
-            font-size: 1.5rem; cursor: pointer;
-            color: var(--text-dim);
-        }
-        .modal-close:hover { color: var(--highlight); }
-        .modal-footer {
-            padding: 15px 20px;
-            border-top: 1px solid var(--accent);
-            display: flex;
-            gap: 10px;
-            justify-content: flex-end;
-            align-items: center;
-            flex-wrap: wrap;
-        }
-        #kekule-composer-container {
-            padding: 10px;
-            background: white;
-            min-height: 400px;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('css/app.css') }}">
     <!-- DataTables CSS -->
     <link rel="stylesheet" href="https://cdn.datatables.net/2.2.1/css/dataTables.dataTables.min.css">
     <link rel="stylesheet" href="https://cdn.datatables.net/buttons/3.2.0/css/buttons.dataTables.min.css">
@@ -677,108 +567,7 @@ BASE_TEMPLATE = """
     <main class="container">
         {% block content %}{% endblock %}
     </main>
-    <script>
-        // Helper for async actions with loading state
-        async function runAction(url, btn, options = {}) {
-            const originalText = btn.innerHTML;
-            btn.disabled = true;
-            btn.innerHTML = '<span class="loading"></span> ' + (options.loadingText || 'Processing...');
-
-            try {
-                const resp = await fetch(url, { method: 'POST' });
-                const data = await resp.json();
-                if (data.pubchem_url) {
-                    window.open(data.pubchem_url, '_blank');
-                } else if (data.redirect) {
-                    window.location.href = data.redirect;
-                } else if (data.error) {
-                    alert('Error: ' + data.error);
-                } else {
-                    window.location.reload();
-                }
-            } catch (e) {
-                alert('Error: ' + e.message);
-            } finally {
-                btn.disabled = false;
-                btn.innerHTML = originalText;
-            }
-        }
-
-        function toggleTheme() {
-            const html = document.documentElement;
-            const current = html.getAttribute('data-theme') || 'dark';
-            const next = current === 'dark' ? 'light' : 'dark';
-            html.setAttribute('data-theme', next);
-            localStorage.setItem('theme', next);
-            updateThemeButton();
-        }
-        function updateThemeButton() {
-            const btn = document.getElementById('theme-toggle');
-            if (!btn) return;
-            const current = document.documentElement.getAttribute('data-theme') || 'dark';
-            btn.textContent = current === 'dark' ? '☀️' : '🌙';
-        }
-        document.addEventListener('DOMContentLoaded', updateThemeButton);
-
-        async function quitApp() {
-            if (confirm('Quit the Chemical Search application?')) {
-                try {
-                    await fetch('/api/quit', { method: 'POST' });
-                } catch (e) {
-                    // Expected - server shuts down
-                }
-                document.body.innerHTML = '<div style="display:flex;align-items:center;justify-content:center;height:100vh;color:#888;"><p>Application closed. You can close this tab.</p></div>';
-            }
-        }
-    </script>
-    <script>
-    function checkForUpdates() {
-        const el = document.getElementById('update-result');
-        el.innerHTML = 'Checking...';
-        fetch('/api/check-update')
-            .then(r => r.json())
-            .then(data => {
-                if (data.error) {
-                    el.innerHTML = 'Could not check for updates: ' + data.error;
-                } else if (!data.update_available) {
-                    el.innerHTML = data.message || '<span style="color:#4caf50;">\u2714</span> You\u2019re on the latest version (v' + data.current + ').';
-                } else {
-                    let notes = data.release_notes ? '<p style="margin:8px 0;white-space:pre-wrap;max-height:120px;overflow:auto;font-size:0.8rem;background:var(--bg-card);padding:8px;border-radius:4px;">' + data.release_notes.replace(/</g,'&lt;') + '</p>' : '';
-                    let action = '';
-                    if (data.is_git) {
-                        action = '<button onclick="gitPullUpdate(this)" class="btn" style="font-size:0.85rem;padding:6px 14px;margin-top:6px;">Update via git pull</button>' +
-                            '<p style="margin-top:8px;font-size:0.8rem;color:var(--text-dim);">This will run <code>git pull</code> to update your local copy. Restart the app afterwards.</p>';
-                    } else {
-                        action = '<a href="' + data.download_url + '" target="_blank" class="btn" style="font-size:0.85rem;padding:6px 14px;margin-top:6px;display:inline-block;">Download</a>' +
-                            '<p style="margin-top:8px;font-size:0.8rem;color:var(--text-dim);">Download the zip, close this app, replace your ChemicalExtractor folder contents with the new files, and relaunch.</p>';
-                    }
-                    el.innerHTML = '<strong>v' + data.latest + ' is available!</strong> (you have v' + data.current + ')' +
-                        notes + action;
-                }
-            })
-            .catch(() => { el.innerHTML = 'Could not check for updates (no internet?).'; });
-    }
-    function gitPullUpdate(btn) {
-        btn.disabled = true;
-        btn.textContent = 'Updating...';
-        fetch('/api/git-pull', {method:'POST'})
-            .then(r => r.json())
-            .then(data => {
-                if (data.success) {
-                    btn.textContent = 'Updated! Restarting...';
-                    btn.parentElement.querySelector('p').innerHTML = 'The app is restarting. This page will reload automatically.';
-                    // Wait for the server to come back, then reload
-                    setTimeout(function tryReload() {
-                        fetch('/api/check-update').then(() => location.reload()).catch(() => setTimeout(tryReload, 500));
-                    }, 2000);
-                } else {
-                    btn.textContent = 'Update failed';
-                    btn.parentElement.querySelector('p').textContent = data.error || 'Unknown error';
-                }
-            })
-            .catch(() => { btn.textContent = 'Update failed'; });
-    }
-    </script>
+    <script src="{{ asset_url('js/base.js') }}"></script>
     {% block scripts %}{% endblock %}
 
 <!-- About modal -->
@@ -815,7 +604,7 @@ BASE_TEMPLATE = """
 """
 
 SEARCH_TEMPLATE = """
-{% extends "base" %}
+{% extends "base.html" %}
 {% block content %}
 {% if not has_cids %}
 <div class="alert alert-info">
@@ -842,8 +631,11 @@ SEARCH_TEMPLATE = """
             </button>
         </div>
         <button class="btn btn-success" id="direct-search-btn" onclick="directPubchemSearch(this, false)">Search</button>
+        <a href="#" id="search-cancel" onclick="cancelSearchJob(); return false;" style="display: none; font-size: 0.85rem; color: var(--text-dim); text-decoration: underline;">Cancel</a>
         <input type="checkbox" id="exclude-toggle" style="display:none;">
         <button class="mode-pill" id="exclude-pill" onclick="let c=document.getElementById('exclude-toggle');c.checked=!c.checked;this.classList.toggle('active',c.checked);">Exclude</button>
+        <input type="checkbox" id="pubchem-toggle" style="display:none;">
+        <button class="mode-pill" id="pubchem-pill" title="Search names on PubChem instead of your lab chemicals" onclick="let c=document.getElementById('pubchem-toggle');c.checked=!c.checked;this.classList.toggle('active',c.checked);updateSearchPlaceholder();">All PubChem</button>
     </div>
     <div style="display: flex; align-items: center; gap: 10px; flex-wrap: wrap;">
         <div class="mode-selector" style="margin-bottom: 0;">
@@ -852,6 +644,7 @@ SEARCH_TEMPLATE = """
             <button class="mode-pill" data-mode="substructure" onclick="selectMode('substructure', this)">Substructure</button>
             <button class="mode-pill" data-mode="superstructure" onclick="selectMode('superstructure', this)">Superstructure</button>
             <button class="mode-pill" data-mode="similarity" onclick="selectMode('similarity', this)">Similarity</button>
+            <button class="mode-pill" data-mode="formula" onclick="selectMode('formula', this)">Formula</button>
         </div>
         <a href="#" onclick="directPubchemSearch(document.getElementById('direct-search-btn'), true); return false;" style="font-size: 0.8rem; color: var(--text-dim); text-decoration: underline;">Add to history only</a>
     </div>
@@ -860,6 +653,60 @@ SEARCH_TEMPLATE = """
     </p>
 </div>
 
+<div class="card">
+    <div class="collapsible-header" onclick="toggleSection('query-section')">
+        <h2 style="margin: 0; border: none; padding: 0;">Advanced Query</h2>
+        <span class="toggle-icon" id="query-section-icon">+ expand</span>
+    </div>
+    <div class="collapsible-content" id="query-section">
+        <div style="display: flex; gap: 10px; align-items: center;">
+            <input type="text" id="query-input" placeholder='e.g. ("benzene" AND ghs:GHS02) OR NOT location:"Cold room"'
+                   style="flex: 1; padding: 8px 12px; border: 1px solid var(--border); border-radius: 4px; background: var(--bg); color: var(--text); font-family: monospace;"
+                   onkeydown="if(event.key==='Enter'){runQuery(document.getElementById('query-btn'));}">
+            <button class="btn btn-success" id="query-btn" onclick="runQuery(this)">Run Query</button>
+        </div>
+        <p class="text-dim" style="font-size: 0.85rem; margin-top: 10px;">
+            Combine with <strong>AND</strong>, <strong>OR</strong>, <strong>NOT</strong> and parentheses. Operands:
+            <code>"search or filter name"</code>, <code>search:&lt;key&gt;</code> (use <em>Add to Query</em> in Search History),
+            <code>filter:&lt;id&gt;</code>, <code>formula:Cl</code>, <code>elements:"C=6 N=1"</code>, <code>location:text</code>, <code>owner:text</code>,
+            <code>ghs:GHS02</code>, <code>mw:100-200</code> / <code>mw:&lt;300</code>, <code>all</code>.
+        </p>
+    </div>
+</div>
+
+<div class="card">
+    <div class="collapsible-header" onclick="toggleSection('batch-section')">
+        <h2 style="margin: 0; border: none; padding: 0;">Batch Search</h2>
+        <span class="toggle-icon" id="batch-section-icon">+ expand</span>
+    </div>
+    <div class="collapsible-content" id="batch-section">
+        <p class="text-dim" style="font-size: 0.85rem; margin-bottom: 10px;">
+            Check a whole list at once: one name, CAS number or SMILES per line (prefix with
+            <code>name:</code>, <code>cas:</code> or <code>smiles:</code> to force the type).
+            Results appear as they come in.
+        </p>
+        <textarea id="batch-input" rows="6" placeholder="benzene&#10;67-64-1&#10;CC(=O)Oc1ccccc1C(=O)O"
+                  style="width: 100%; padding: 8px 12px; border: 1px solid var(--border); border-radius: 4px; background: var(--bg); color: var(--text); font-family: monospace;"></textarea>
+        <div style="display: flex; gap: 10px; align-items: center; margin-top: 10px; flex-wrap: wrap;">
+            <button class="btn btn-success" id="batch-btn" onclick="runBatchSearch(this)">Run Batch</button>
+            <label class="btn btn-secondary" style="cursor: pointer;">
+                Load File<input type="file" accept=".txt,.csv,.tsv" style="display: none;" onchange="loadBatchFile(this)">
+            </label>
+            <span class="text-dim" style="font-size: 0.85rem;" id="batch-status"></span>
+            <a href="#" id="batch-view" style="display: none; color: var(--link);">View matches</a>
+            <a href="#" id="batch-download" style="display: none; color: var(--link);" onclick="downloadBatchReport(); return false;">Download CSV</a>
+        </div>
+        <div style="max-height: 400px; overflow-y: auto; margin-top: 12px;">
+            <table id="batch-table" style="display: none;">
+                <thead>
+                    <tr><th>Query</th><th>Type</th><th>PubChem</th><th>Held</th><th>Names</th><th>Locations</th></tr>
+                </thead>
+                <tbody id="batch-body"></tbody>
+            </table>
+        </div>
+    </div>
+</div>
+
 <div class="card">
     <div class="collapsible-header" onclick="toggleSection('history-section')">
         <h2 style="margin: 0; border: none; padding: 0;">Search History</h2>
@@ -906,6 +753,9 @@ SEARCH_TEMPLATE = """
             <button class="btn btn-secondary" onclick="combineSelectedSearch('NOT', this)" disabled id="btn-combine-not">
                 Exclude from My Chemicals (NOT)
             </button>
+            <button class="btn btn-secondary" onclick="addSelectedToQuery()" disabled id="btn-add-query">
+                Add to Query
+            </button>
             <span style="margin-left: auto; display: flex; align-items: center; gap: 6px;">
                 <span id="toggle-app-searches" onclick="toggleAppSearches()" style="cursor: pointer; font-size: 0.8rem; padding: 4px 10px; border-radius: 12px; border: 1px solid var(--accent); color: var(--text-dim); user-select: none;">App searches</span>
                 <span class="info">i
@@ -944,436 +794,7 @@ SEARCH_TEMPLATE = """
 {% endblock %}
 
 {% block scripts %}
-<script>
-let selectedCacheKey = null;
-let searchHistory = [];
-let allHistory = [];  // Stores both filtered and unfiltered
-let autoRefreshInterval = null;
-
-function getShowAppSearches() {
-    try {
-        const stored = localStorage.getItem('show_app_searches');
-        return stored === 'true';
-    } catch(e) { return false; }
-}
-
-function saveShowAppSearches(show) {
-    localStorage.setItem('show_app_searches', show ? 'true' : 'false');
-}
-
-function toggleAppSearches() {
-    const toggle = document.getElementById('toggle-app-searches');
-    const wasActive = toggle.dataset.active === '1';
-    const show = !wasActive;
-    toggle.dataset.active = show ? '1' : '0';
-    toggle.style.background = show ? 'var(--highlight)' : 'transparent';
-    toggle.style.color = show ? '#fff' : 'var(--text-dim)';
-    saveShowAppSearches(show);
-
-    // Filter and re-render
-    searchHistory = show ? allHistory : allHistory.filter(entry => !entry._is_app_search);
-    renderHistoryTable();
-}
-
-async function loadHistory() {
-    const tbody = document.getElementById('history-body');
-    if (!tbody) return;
-
-    try {
-        const resp = await fetch('/api/pubchem-history');
-        const data = await resp.json();
-
-        // Store both lists
-        allHistory = data.all_history || [];
-        const filteredHistory = data.history || [];
-
-        // Mark app searches
-        const filteredKeys = new Set(filteredHistory.map(e => e.cachekey));
-        allHistory.forEach(entry => {
-            entry._is_app_search = !filteredKeys.has(entry.cachekey);
-        });
-
-        // Browser warning
-        const warningEl = document.getElementById('browser-warning');
-        if (data.browser_warning && warningEl) {
-            warningEl.textContent = data.browser_warning;
-            warningEl.style.display = 'block';
-        } else if (warningEl) {
-            warningEl.style.display = 'none';
-        }
-
-        // Apply user preference
-        const showAppSearches = getShowAppSearches();
-        const toggle = document.getElementById('toggle-app-searches');
-        if (toggle) {
-            toggle.dataset.active = showAppSearches ? '1' : '0';
-            toggle.style.background = showAppSearches ? 'var(--highlight)' : 'transparent';
-            toggle.style.color = showAppSearches ? '#fff' : 'var(--text-dim)';
-        }
-
-        searchHistory = showAppSearches ? allHistory : filteredHistory;
-
-        renderHistoryTable();
-    } catch (e) {
-        tbody.innerHTML = `<tr><td colspan="5" class="text-warning" style="text-align: center;">
-            Error loading search history: ${e.message}
-        </td></tr>`;
-    }
-}
-
-function renderHistoryTable() {
-    const tbody = document.getElementById('history-body');
-    if (!tbody) return;
-
-    if (searchHistory.length === 0) {
-        tbody.innerHTML = `<tr><td colspan="5" class="text-dim" style="text-align: center; padding: 30px;">
-            No recent PubChem searches found.<br><br>
-            <button class="btn" onclick="window.open('https://pubchem.ncbi.nlm.nih.gov/', '_blank')">
-                Search on PubChem
-            </button>
-        </td></tr>`;
-        updateButtons();
-        return;
-    }
-
-    tbody.innerHTML = searchHistory.map((entry, idx) => `
-        <tr onclick="selectEntry('${entry.cachekey}')" data-cachekey="${entry.cachekey}"
-            style="cursor: pointer;" class="${idx === 0 ? 'selected' : ''}">
-            <td style="text-align: center;">
-                <input type="radio" name="search-select" value="${entry.cachekey}"
-                       ${idx === 0 ? 'checked' : ''}
-                       onclick="event.stopPropagation(); selectEntry('${entry.cachekey}')">
-            </td>
-            <td style="max-width: 350px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap;"
-                title="${entry.name}">
-                ${entry.name}${entry._is_app_search ? ' <span class="badge badge-dim">APP</span>' : ''}
-            </td>
-            <td>${entry.browser || '?'}</td>
-            <td class="text-dim" style="font-size: 0.85rem;">${formatTime(entry.timestamp)}</td>
-            <td style="white-space: nowrap;">
-                <a href="${entry.url}" target="_blank" onclick="event.stopPropagation();"
-                   style="color: var(--highlight); font-size: 0.85rem;">PubChem</a>
-            </td>
-        </tr>
-    `).join('');
-
-    // Select first entry by default
-    if (searchHistory.length > 0) {
-        selectedCacheKey = searchHistory[0].cachekey;
-    }
-    updateButtons();
-}
-
-function formatTime(isoTimestamp) {
-    if (!isoTimestamp) return 'Unknown';
-    const date = new Date(isoTimestamp);
-    const now = new Date();
-    const diffMs = now - date;
-    const diffMins = Math.floor(diffMs / 60000);
-    const diffHours = Math.floor(diffMs / 3600000);
-    const diffDays = Math.floor(diffMs / 86400000);
-
-    if (diffMins < 1) return 'Just now';
-    if (diffMins < 60) return `${diffMins}m ago`;
-    if (diffHours < 24) return `${diffHours}h ago`;
-    if (diffDays < 7) return `${diffDays}d ago`;
-    return date.toLocaleDateString();
-}
-
-function selectEntry(cachekey) {
-    selectedCacheKey = cachekey;
-
-    document.querySelectorAll('#history-body tr').forEach(row => {
-        const isSelected = row.dataset.cachekey === cachekey;
-        row.classList.toggle('selected', isSelected);
-        const radio = row.querySelector('input[type="radio"]');
-        if (radio) radio.checked = isSelected;
-    });
-
-    updateButtons();
-}
-
-function updateButtons() {
-    const hasSelection = selectedCacheKey !== null;
-    const btnAnd = document.getElementById('btn-combine-and');
-    const btnNot = document.getElementById('btn-combine-not');
-    const btnMain = document.getElementById('btn-main-search');
-    if (btnAnd) btnAnd.disabled = !hasSelection;
-    if (btnNot) btnNot.disabled = !hasSelection;
-    if (btnMain) btnMain.disabled = !hasSelection;
-}
-
-async function combineSelectedSearch(operation, btn) {
-    if (!selectedCacheKey) {
-        alert('Please select a search from the list first.');
-        return;
-    }
-
-    const originalText = btn.innerHTML;
-    btn.disabled = true;
-    btn.innerHTML = '<span class="loading"></span> Searching...';
-
-    try {
-        const resp = await fetch('/api/combine-pubchem/' + operation +
-                                 '?cachekey=' + encodeURIComponent(selectedCacheKey),
-                                 { method: 'POST' });
-        const data = await resp.json();
-
-        if (data.error === 'stale_search') {
-            // Handle stale search specially
-            alert(data.message || 'This search has expired and is no longer available.');
-
-            // Mark as stale server-side (blacklist it)
-            await fetch('/api/mark-stale-search', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({cache_key: data.cache_key})
-            });
-
-            // Refresh history to remove it
-            await refreshHistory();
-        } else if (data.error) {
-            alert('Error: ' + data.error);
-        } else if (data.filter_id) {
-            window.location.href = '/results?filter_id=' + data.filter_id;
-            return;
-        }
-    } catch (e) {
-        alert('Error: ' + e.message);
-    } finally {
-        btn.disabled = false;
-        btn.innerHTML = originalText;
-        updateButtons();
-    }
-}
-
-async function refreshHistory() {
-    const tbody = document.getElementById('history-body');
-    if (tbody) {
-        tbody.innerHTML = `<tr><td colspan="5" class="text-dim" style="text-align: center; padding: 20px;">
-            <span class="loading" style="width: 14px; height: 14px;"></span> Refreshing...
-        </td></tr>`;
-    }
-    const previousKey = selectedCacheKey;
-    selectedCacheKey = null;
-    await loadHistory();
-    // Try to re-select previous selection
-    if (previousKey && searchHistory.find(h => h.cachekey === previousKey)) {
-        selectEntry(previousKey);
-    }
-}
-
-function toggleSection(id) {
-    const content = document.getElementById(id);
-    const icon = document.getElementById(id + '-icon');
-    if (content.classList.contains('open')) {
-        content.classList.remove('open');
-        icon.textContent = '+ expand';
-    } else {
-        content.classList.add('open');
-        icon.textContent = '- collapse';
-    }
-}
-
-// --- Direct PubChem search ---
-const SEARCH_MODE_INFO = {
-    'name': {placeholder: 'Enter name, CAS, or keyword...', hint: 'Search by name, CAS number, or keyword. Results will be combined with your lab chemicals.'},
-    'smiles': {placeholder: 'Enter SMILES or draw...', hint: 'Find exact compound match by SMILES notation.'},
-    'substructure': {placeholder: 'Enter SMILES or draw...', hint: 'Find compounds containing this structure as a substructure.'},
-    'superstructure': {placeholder: 'Enter SMILES or draw...', hint: 'Find compounds where query is a superstructure (contains the target).'},
-    'similarity': {placeholder: 'Enter SMILES or draw...', hint: 'Find compounds with similar 2D structure (Tanimoto similarity).'},
-};
-
-let currentSearchMode = 'name';
-
-function selectMode(mode, pill) {
-    currentSearchMode = mode;
-    document.querySelectorAll('.mode-pill').forEach(p => p.classList.remove('active'));
-    pill.classList.add('active');
-    updateSearchPlaceholder();
-}
-
-function updateSearchPlaceholder() {
-    const mode = currentSearchMode;
-    const input = document.getElementById('direct-search-input');
-    const hint = document.getElementById('search-mode-hint');
-    const info = SEARCH_MODE_INFO[mode] || SEARCH_MODE_INFO['name'];
-    input.placeholder = info.placeholder;
-    hint.textContent = info.hint;
-}
-
-async function directPubchemSearch(btn, historyOnly) {
-    const input = document.getElementById('direct-search-input');
-    const query = input.value.trim();
-    const mode = currentSearchMode;
-
-    if (!query) {
-        alert('Enter a search query');
-        return;
-    }
-
-    btn.disabled = true;
-    const originalText = btn.textContent;
-    btn.innerHTML = '<span class="loading"></span> Searching...';
-
-    try {
-        const resp = await fetch('/api/pubchem-search', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({query, mode})
-        });
-        const data = await resp.json();
-
-        if (data.success) {
-            if (historyOnly) {
-                input.value = '';
-                await refreshHistory();
-                selectEntry(data.cache_key);
-            } else {
-                // Combine and navigate to results
-                btn.innerHTML = '<span class="loading"></span> Combining...';
-                const excludeOn = document.getElementById('exclude-toggle').checked;
-                const operation = excludeOn ? 'NOT' : 'AND';
-                const combResp = await fetch('/api/combine-pubchem/' + operation +
-                    '?cachekey=' + encodeURIComponent(data.cache_key),
-                    { method: 'POST' });
-                const combData = await combResp.json();
-
-                if (combData.error === 'stale_search') {
-                    alert(combData.message || 'This search has expired.');
-                    await fetch('/api/mark-stale-search', {
-                        method: 'POST',
-                        headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({cache_key: combData.cache_key})
-                    });
-                    input.value = '';
-                    await refreshHistory();
-                } else if (combData.error) {
-                    alert('Error: ' + combData.error);
-                    // Fall back to showing in history
-                    input.value = '';
-                    await refreshHistory();
-                    selectEntry(data.cache_key);
-                } else if (combData.filter_id) {
-                    input.value = '';
-                    window.location.href = '/results?filter_id=' + combData.filter_id;
-                    return;
-                }
-            }
-        } else {
-            alert(data.error || 'Search failed');
-        }
-    } catch (e) {
-        alert('Error: ' + e.message);
-    } finally {
-        btn.disabled = false;
-        btn.textContent = originalText;
-    }
-}
-
-// --- Smart auto-refresh: poll file fingerprint every 50s, full fetch only on change ---
-let lastFingerprint = null;
-const POLL_INTERVAL_MS = 50000;
-
-async function pollForChanges() {
-    try {
-        const resp = await fetch('/api/pubchem-history/check');
-        const data = await resp.json();
-        const fp = data.fingerprint;
-        if (lastFingerprint !== null && fp !== lastFingerprint) {
-            // Storage files changed — do a full refresh
-            const statusEl = document.getElementById('auto-refresh-status');
-            if (statusEl) statusEl.textContent = 'Updating...';
-            await refreshHistory();
-        }
-        lastFingerprint = fp;
-    } catch (e) {
-        // Network error — ignore, will retry next tick
-    }
-    const statusEl = document.getElementById('auto-refresh-status');
-    if (statusEl) statusEl.textContent = 'Watching for changes';
-}
-
-function startAutoRefresh() {
-    autoRefreshInterval = setInterval(pollForChanges, POLL_INTERVAL_MS);
-}
-
-document.addEventListener('DOMContentLoaded', () => {
-    loadHistory();
-    // Capture initial fingerprint, then start polling
-    pollForChanges().then(() => startAutoRefresh());
-});
-
-// Cleanup on page leave
-window.addEventListener('beforeunload', () => {
-    if (autoRefreshInterval) clearInterval(autoRefreshInterval);
-});
-
-// --- Structure Drawer (Kekule.js) ---
-let composer = null;
-
-function openStructureDrawer() {
-    const modal = document.getElementById('structure-drawer-modal');
-    modal.style.display = 'flex';
-
-    // Initialize composer if not already done
-    if (!composer) {
-        const container = document.getElementById('kekule-composer-container');
-        composer = new Kekule.Editor.Composer(container);
-        composer.setDimension('100%', '400px');
-    }
-}
-
-function closeStructureDrawer() {
-    document.getElementById('structure-drawer-modal').style.display = 'none';
-}
-
-function useDrawnStructure() {
-    if (!composer) return;
-
-    const mol = composer.getChemObj();
-    if (!mol) {
-        alert('Please draw a structure first');
-        return;
-    }
-
-    let smiles;
-    try {
-        smiles = Kekule.IO.saveFormatData(mol, 'smi');
-    } catch (e) {
-        alert('Could not convert structure to SMILES: ' + e.message);
-        return;
-    }
-
-    if (!smiles) {
-        alert('Could not convert structure to SMILES');
-        return;
-    }
-
-    // Populate the search input
-    document.getElementById('direct-search-input').value = smiles;
-
-    // Set the search mode based on drawer dropdown selection
-    const searchType = document.getElementById('structure-search-type').value;
-    currentSearchMode = searchType;
-    document.querySelectorAll('.mode-pill').forEach(p => {
-        p.classList.toggle('active', p.dataset.mode === searchType);
-    });
-    updateSearchPlaceholder();
-
-    closeStructureDrawer();
-}
-
-// Close modal on escape key or clicking outside
-document.addEventListener('keydown', (e) => {
-    if (e.key === 'Escape') closeStructureDrawer();
-});
-
-document.addEventListener('click', (e) => {
-    const modal = document.getElementById('structure-drawer-modal');
-    if (e.target === modal) closeStructureDrawer();
-});
-</script>
+<script src="{{ asset_url('js/search.js') }}"></script>
 {% endblock %}
 """
 
@@ -1400,147 +821,8 @@ ALL_RESULTS_COLUMNS = DEFAULT_RESULTS_COLUMNS + [
 ]
 
 RESULTS_TEMPLATE = """
-{% extends "base" %}
+{% extends "base.html" %}
 {% block content %}
-<style>
-    .structure-cell { position: relative; }
-    .structure-thumb { width: 50px; height: 50px; background: white; border-radius: 2px; }
-    .structure-large { display: none; position: absolute; z-index: 100; width: 250px; height: 250px; box-shadow: 0 4px 20px rgba(0,0,0,0.5); background: white; border-radius: 4px; top: 0; left: 0; }
-    .structure-cell:hover .structure-large { display: block; }
-    .structure-cell:hover .structure-thumb { visibility: hidden; }
-    .ghs-icon { width: 24px; height: 24px; margin-right: 2px; vertical-align: middle; background: white; }
-    .smiles-cell { font-family: 'SF Mono', Monaco, monospace; font-size: 0.75rem; max-width: 150px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
-    .col-picker { background: var(--bg-light); border: 1px solid var(--accent); border-radius: 6px; padding: 10px 15px; margin-bottom: 15px; display: none; }
-    .col-picker.open { display: flex; flex-wrap: wrap; gap: 8px 16px; }
-    .col-picker label { font-size: 0.85rem; cursor: pointer; display: flex; align-items: center; gap: 4px; }
-
-    /* DataTables dark theme customization */
-    div.dt-container div.dt-layout-row { margin-top: 0.2em; margin-bottom: 0; }
-    .dataTables_wrapper { color: var(--text); }
-    .dataTables_wrapper .dataTables_length,
-    .dataTables_wrapper .dataTables_filter,
-    .dataTables_wrapper .dataTables_info,
-    .dataTables_wrapper .dataTables_paginate { color: var(--text-dim); }
-
-    .dataTables_wrapper input[type="search"] {
-        background: var(--accent);
-        color: var(--text);
-        border: 1px solid var(--bg);
-        padding: 4px 8px;
-        border-radius: 4px;
-    }
-
-    .dataTables_wrapper .dataTables_paginate .paginate_button {
-        background: var(--accent) !important;
-        color: var(--text) !important;
-        border: 1px solid var(--bg) !important;
-    }
-
-    .dataTables_wrapper .dataTables_paginate .paginate_button.current {
-        background: var(--highlight) !important;
-    }
-
-    .dt-toolbar {
-        display: flex !important;
-        flex-wrap: wrap;
-        align-items: center;
-        gap: 12px;
-        margin-bottom: 12px;
-        width: 100%;
-    }
-    .dt-toolbar .dt-buttons { margin-bottom: 0; }
-    .dt-toolbar .dataTables_length { margin: 0; }
-    .dt-toolbar .dataTables_filter { margin: 0; margin-left: auto; flex: 1; }
-    .dt-toolbar .dataTables_filter label { display: flex; align-items: center; gap: 6px; }
-    .dt-toolbar .dataTables_filter input { flex: 1; }
-
-    .dt-buttons {
-        display: flex;
-        gap: 5px;
-    }
-
-    .dt-button {
-        background: var(--accent) !important;
-        color: var(--text) !important;
-        border: 1px solid var(--bg) !important;
-        padding: 6px 12px !important;
-        border-radius: 4px !important;
-        font-size: 0.85rem !important;
-    }
-
-    .dt-button:hover {
-        background: var(--highlight) !important;
-    }
-
-    .table-responsive {
-        overflow-x: auto;
-        width: 100%;
-    }
-
-    .print-header { display: none; }
-
-    #mw-slider { margin: 0 8px; }
-    #mw-slider .noUi-connect { background: #8c8c8c; }
-    #mw-slider .noUi-handle { border-color: var(--highlight); background: var(--card-bg); }
-    #mw-slider .noUi-tooltip { background: var(--card-bg); color: var(--text); border-color: var(--border); font-size: 0.75rem; }
-    #mw-slider .noUi-pips { color: var(--text-dim); }
-    #mw-slider .noUi-marker { background: var(--border); }
-    #mw-slider .noUi-value { color: var(--text-dim); font-size: 0.7rem; }
-    #mw-slider .noUi-pips { top: 100%; padding-top: 2px; }
-
-    @media print {
-        @page {
-            size: landscape;
-            margin: 0.5cm;
-        }
-
-        body {
-            font-size: 10pt;
-        }
-
-        /* Hide page header/footer elements */
-        nav, .dt-buttons, #advanced-filters, .dataTables_length, .dataTables_filter,
-        .dataTables_info, .dataTables_paginate, .btn, .btn-secondary, select,
-        label.text-dim, #compound-info-badge, .alert, .advanced-filters, .filter-info { display: none !important; }
-
-        .print-header { display: block !important; }
-        body, .card { background: white !important; color: black !important; }
-        .structure-large { display: none !important; }
-        .structure-cell:hover .structure-large { display: none !important; }
-        .structure-cell:hover .structure-thumb { visibility: visible !important; }
-        tr { page-break-inside: avoid; }
-        * { color: black !important; border-color: #ccc !important; }
-
-        /* Default: normal size for tables with few columns */
-        .table-responsive {
-            overflow: visible !important;
-        }
-
-        #results-data-table th,
-        #results-data-table td {
-            padding: 4px 6px !important;
-            white-space: nowrap;
-        }
-
-        /* Scale down only when many columns are visible */
-        .table-responsive.print-scale-many {
-            width: fit-content !important;
-            max-width: none !important;
-            transform-origin: top left;
-            transform: scale(0.6);
-        }
-
-        .print-scale-many #results-data-table {
-            font-size: 8pt;
-        }
-
-        .print-scale-many #results-data-table th,
-        .print-scale-many #results-data-table td {
-            padding: 2px 3px !important;
-        }
-    }
-</style>
-
 {% if not rug_table %}
 <div class="alert alert-info">
     <p><strong>RUG table not loaded.</strong> Complete Setup first to import your chemicals and look them up in PubChem.</p>
@@ -1569,9 +851,25 @@ RESULTS_TEMPLATE = """
                 {% if current_filter.get('saved') %}&#9733; Saved{% else %}&#9734; Save{% endif %}
             </button>
             {% endif %}
-            {% if current_filter.pubchem_url %}
-            <a href="{{ current_filter.pubchem_url }}" target="_blank" class="btn btn-secondary" style="font-size: 0.85rem;">Open on PubChem</a>
+            {% if similarity_available and current_filter.match_count > 1 %}
+            <button id="duplicates-btn" class="btn btn-secondary" style="font-size: 0.85rem;" onclick="findDuplicates(this)">Near-duplicates</button>
             {% endif %}
+            {% if current_filter.match_count %}
+            <a href="{{ url_for('open_filter_in_pubchem', filter_id=current_filter.id) }}" target="_blank" class="btn btn-secondary" style="font-size: 0.85rem;">Open on PubChem</a>
+            {% endif %}
+        </div>
+    </div>
+
+    <div class="card" id="duplicates-card" style="display: none; margin-bottom: 15px;">
+        <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 10px;">
+            <h3 style="margin: 0;">Near-duplicates <span class="text-dim" style="font-size: 0.8rem;" id="duplicates-summary"></span></h3>
+            <button class="btn btn-secondary" style="font-size: 0.8rem;" onclick="document.getElementById('duplicates-card').style.display='none'">Close</button>
+        </div>
+        <div style="max-height: 300px; overflow-y: auto;">
+            <table>
+                <thead><tr><th>Compound</th><th>Compound</th><th>Similarity</th></tr></thead>
+                <tbody id="duplicates-body"></tbody>
+            </table>
         </div>
     </div>
 
@@ -1617,23 +915,26 @@ RESULTS_TEMPLATE = """
         <div style="display: flex; flex-wrap: wrap; gap: 20px; align-items: flex-start;">
             <div style="min-width: 280px; flex: 1;">
                 <label class="text-dim" style="font-size: 0.8rem; display: block; margin-bottom: 8px; text-align: center;">Molecular Weight</label>
+                <div id="mw-histogram" class="mw-histogram"></div>
                 <div id="mw-slider" style="margin-bottom: 20px;"></div>
             </div>
             <div>
                 <label class="text-dim" style="font-size: 0.8rem; display: block; margin-bottom: 4px;">Formula</label>
                 <input type="text" id="formula-filter" placeholder="e.g. C6" style="width: 100px; font-size: 0.85rem; padding: 4px 8px; border: 1px solid var(--border); border-radius: 4px; background: var(--bg); color: var(--text);">
             </div>
-            {% if unique_locations %}
+            {% for facet, label, all_label in [('location', 'Location', 'All locations'), ('owner', 'Owner', 'All owners'), ('ghs', 'Hazard', 'All hazards')] %}
+            {% if facets and facets[facet]|selectattr('count')|list %}
             <div>
-                <label class="text-dim" style="font-size: 0.8rem; display: block; margin-bottom: 4px;">Location</label>
-                <select id="location-filter" style="font-size: 0.85rem; padding: 4px 8px; border: 1px solid var(--border); border-radius: 4px; background: var(--bg); color: var(--text);">
-                    <option value="">All locations</option>
-                    {% for loc in unique_locations %}
-                    <option value="{{ loc }}">{{ loc }}</option>
+                <label class="text-dim" style="font-size: 0.8rem; display: block; margin-bottom: 4px;">{{ label }}</label>
+                <select id="{{ facet }}-filter" class="facet-filter" style="font-size: 0.85rem; padding: 4px 8px; border: 1px solid var(--border); border-radius: 4px; background: var(--bg); color: var(--text); max-width: 220px;">
+                    <option value="">{{ all_label }}</option>
+                    {% for f in facets[facet] if f.count %}
+                    <option value="{{ f.value }}" data-label="{{ f.name or f.value }}">{{ f.name or f.value }} ({{ f.count }})</option>
                     {% endfor %}
                 </select>
             </div>
             {% endif %}
+            {% endfor %}
             <div style="display: flex; gap: 6px; align-self: center;">
                 <button class="btn" style="font-size: 0.8rem;" id="apply-filters-btn">Apply Filters</button>
                 <button class="btn btn-secondary" style="font-size: 0.8rem; background: var(--bg-light);" id="clear-filters-btn">Clear</button>
@@ -1642,63 +943,8 @@ RESULTS_TEMPLATE = """
     </div>
     </div>
 
-    {% if filtered_rows %}
-    {% macro render_cell(row, col, grouped=false) %}
-        {% if col == 'Structure' %}
-        <div class="structure-cell">
-            {% if row._cid_int %}
-            <img class="structure-thumb" src="https://pubchem.ncbi.nlm.nih.gov/image/imgsrv.fcgi?cid={{ row._cid_int }}&amp;t=s" alt="structure" loading="lazy">
-            <img class="structure-large" src="https://pubchem.ncbi.nlm.nih.gov/image/imgsrv.fcgi?cid={{ row._cid_int }}&amp;t=l" alt="structure" loading="lazy">
-            {% else %}-{% endif %}
-        </div>
-        {% elif col == 'CID' %}
-            {% if row._cid_int %}
-            <a href="https://pubchem.ncbi.nlm.nih.gov/compound/{{ row._cid_int }}" target="_blank" style="color: var(--success);" class="mono">{{ row._cid_int }}</a>
-            {% else %}-{% endif %}
-        {% elif col == 'Name' %}
-            {{ row._ci.get('title', '') or '-' }}{% if row._repair_status == 'repaired' %} <span class="badge badge-warning" title="Found via text search (repaired)" style="margin-left: 4px; font-size: 0.7rem;">&#128295;</span>{% endif %}{% if grouped and row._group_count > 1 %} <span class="badge" style="background: var(--accent); color: var(--bg); font-size: 0.7rem; padding: 1px 5px; border-radius: 8px; margin-left: 4px;">&times;{{ row._group_count }}</span>{% endif %}
-        {% elif col == 'GROSname' %}
-            {% if grouped and col in row._group_varying %}
-                <span class="vary-pop text-dim" style="font-size:0.75rem;cursor:pointer;text-decoration:underline dotted;" title="Click to view">{{ row._group_varying[col]|length }} values</span><span class="vary-pop-content" style="display:none;">{{ row._group_varying[col]|join(', ') }}</span>
-            {% else %}{{ row.get('Name', '') or '-' }}{% endif %}
-        {% elif col == 'CAS' %}
-            {% if row._cid_int %}
-                {% if row.get('_original_cas') %}
-                    <s>{{ row._original_cas }}</s> <a href="https://pubchem.ncbi.nlm.nih.gov/compound/{{ row._cid_int }}" target="_blank" style="color: var(--success);">{{ row.get('Casnr', '') }}</a>
-                {% else %}
-                    <a href="https://pubchem.ncbi.nlm.nih.gov/compound/{{ row._cid_int }}" target="_blank" style="color: var(--success);">{{ row.get('Casnr', '') }}</a>
-                {% endif %}
-            {% else %}
-                {% if row.get('_original_cas') %}<s>{{ row._original_cas }}</s> {{ row.get('Casnr', '') }}{% else %}{{ row.get('Casnr', '') or '-' }}{% endif %}
-            {% endif %}
-        {% elif col == 'Formula' %}
-            {% set formula = row._ci.get('formula', '') or row.get('Formula', '') or '-' %}
-            {% if formula != '-' %}
-                <span data-plaintext="{{ formula }}">{{ formula|replace('0', '<sub>0</sub>')|replace('1', '<sub>1</sub>')|replace('2', '<sub>2</sub>')|replace('3', '<sub>3</sub>')|replace('4', '<sub>4</sub>')|replace('5', '<sub>5</sub>')|replace('6', '<sub>6</sub>')|replace('7', '<sub>7</sub>')|replace('8', '<sub>8</sub>')|replace('9', '<sub>9</sub>')|safe }}
-                </span>
-            {% else %}
-                -
-            {% endif %}
-        {% elif col == 'MW' %}{{ row._ci.get('mw', '') or '-' }}
-        {% elif col == 'SMILES' %}<span class="smiles-cell" title="{{ row._ci.get('smiles', '') }}">{{ row._ci.get('smiles', '') or '-' }}</span>
-        {% elif col == 'IUPAC' %}{{ row._ci.get('iupac', '') or '-' }}
-        {% elif col == 'Hazards' %}
-            {% for code in row._ci.get('ghs_pictograms', []) %}
-            <img class="ghs-icon" src="https://pubchem.ncbi.nlm.nih.gov/images/ghs/{{ code }}.svg" title="{{ ghs_names.get(code, code) }}" alt="{{ code }}" loading="lazy">
-            {% endfor %}
-            {% if not row._ci.get('ghs_pictograms') %}-{% endif %}
-        {% elif col == 'Location' %}
-            {% if grouped and col in row._group_varying %}
-                <span class="vary-pop text-dim" style="font-size:0.75rem;cursor:pointer;text-decoration:underline dotted;" title="Click to view">{{ row._group_varying[col]|length }} values</span><span class="vary-pop-content" style="display:none;">{{ row._group_varying[col]|join(', ') }}</span>
-            {% else %}{{ row.get('Location', '') or '-' }}{% endif %}
-        {% else %}
-            {% if grouped and col in row.get('_group_varying', {}) %}
-                <span class="vary-pop text-dim" style="font-size:0.75rem;cursor:pointer;text-decoration:underline dotted;" title="Click to view">{{ row._group_varying[col]|length }} values</span><span class="vary-pop-content" style="display:none;">{{ row._group_varying[col]|join(', ') }}</span>
-            {% else %}{{ row.get(col, '') or '-' }}{% endif %}
-        {% endif %}
-    {% endmacro %}
-
-    <div class="table-responsive" id="individual-table-wrapper">
+    {% if row_count %}
+    <div class="table-responsive">
         <table id="results-data-table" class="display" style="width:100%">
             <thead>
                 <tr>
@@ -1707,36 +953,6 @@ RESULTS_TEMPLATE = """
                     {% endfor %}
                 </tr>
             </thead>
-            <tbody>
-                {% for row in filtered_rows %}
-                <tr>
-                    {% for col in all_columns %}
-                    <td data-column="{{ col }}">{{ render_cell(row, col) }}</td>
-                    {% endfor %}
-                </tr>
-                {% endfor %}
-            </tbody>
-        </table>
-    </div>
-
-    <div class="table-responsive" id="grouped-table-wrapper">
-        <table id="results-grouped-table" class="display" style="width:100%">
-            <thead>
-                <tr>
-                    {% for col in all_columns %}
-                    <th>{{ col }}</th>
-                    {% endfor %}
-                </tr>
-            </thead>
-            <tbody>
-                {% for row in grouped_rows %}
-                <tr>
-                    {% for col in all_columns %}
-                    <td data-column="{{ col }}">{{ render_cell(row, col, grouped=true) }}</td>
-                    {% endfor %}
-                </tr>
-                {% endfor %}
-            </tbody>
         </table>
     </div>
     {% else %}
@@ -1751,401 +967,78 @@ RESULTS_TEMPLATE = """
 const DEFAULT_COLS = {{ default_columns|tojson }};
 const ALL_COLS = {{ all_columns|tojson }};
 const GHS_NAMES = {{ ghs_names|tojson }};
-
-$(document).ready(function() {
-    // Load visible columns from localStorage
-    let visibleCols = DEFAULT_COLS;
-    try {
-        const stored = localStorage.getItem('results_visible_cols');
-        if (stored) visibleCols = JSON.parse(stored);
-    } catch(e) {}
-
-    // Build column definitions
-    function buildColumnDefs() {
-        return ALL_COLS.map((col, idx) => {
-            let def = {
-                targets: idx,
-                title: col,
-                visible: visibleCols.includes(col),
-                className: 'col-' + col
-            };
-
-            if (col === 'Structure') {
-                def.orderable = false;
-                def.searchable = false;
-                def.exportOptions = { format: { body: function() { return ''; } } };
-            } else if (col === 'Hazards') {
-                def.orderable = false;
-                def.exportOptions = {
-                    format: {
-                        body: function(data) {
-                            const matches = data.match(/alt="(GHS\d+)"/g);
-                            return matches ? matches.map(m => m.match(/GHS\d+/)[0]).join(', ') : '';
-                        }
-                    }
-                };
-            } else if (col === 'CAS') {
-                def.exportOptions = {
-                    format: {
-                        body: function(data) {
-                            const linkMatch = data.match(/>([^<]+)<\/a>/);
-                            if (linkMatch) return linkMatch[1];
-                            const plainMatch = data.match(/<\/s>\s*([^<]+)/);
-                            if (plainMatch) return plainMatch[1];
-                            return data.replace(/<[^>]*>/g, '').trim() || '';
-                        }
-                    }
-                };
-            } else if (col === 'Formula') {
-                def.exportOptions = {
-                    format: {
-                        body: function(data) {
-                            const match = data.match(/data-plaintext="([^"]*)"/);
-                            return match ? match[1] : data.replace(/<[^>]*>/g, '').trim();
-                        }
-                    }
-                };
-            } else if (col === 'CID') {
-                def.type = 'num';
-                def.exportOptions = {
-                    format: {
-                        body: function(data) {
-                            const match = data.match(/>\s*(\d+)\s*</);
-                            return match ? match[1] : '';
-                        }
-                    }
-                };
-            } else if (col === 'MW') {
-                def.type = 'num';
-            } else if (col === 'SMILES') {
-                def.render = function(data, type) {
-                    if (type === 'display' && data.length > 50) {
-                        return '<span class="smiles-cell" title="' + data + '">' + data.substring(0, 50) + '...</span>';
-                    }
-                    return data;
-                };
-            }
-
-            return def;
-        });
-    }
-
-    function buildDTConfig(tableId) {
-        return {
-            pageLength: 25,
-            lengthMenu: [[10, 25, 50, 100, -1], [10, 25, 50, 100, "All"]],
-            order: [[ALL_COLS.indexOf('Name'), 'asc']],
-            columnDefs: buildColumnDefs(),
-            layout: {
-                topStart: ['buttons', 'pageLength'],
-                topEnd: 'search'
-            },
-            buttons: [
-                {
-                    extend: 'colvis',
-                    text: 'Columns',
-                    columns: ':not(.no-export)'
-                },
-                {
-                    extend: 'collection',
-                    text: 'Export',
-                    buttons: [
-                        {
-                            extend: 'csvHtml5',
-                            text: 'CSV',
-                            title: '{{ current_filter.search_name if current_filter else "Results" }} - {{ current_filter.created[:10] if current_filter else "" }}',
-                            exportOptions: { columns: ':visible:not(.col-Structure)' }
-                        },
-                        {
-                            extend: 'excelHtml5',
-                            text: 'Excel',
-                            title: '{{ current_filter.search_name if current_filter else "Results" }} - {{ current_filter.created[:10] if current_filter else "" }}',
-                            exportOptions: { columns: ':visible:not(.col-Structure)' }
-                        },
-                        {
-                            extend: 'copyHtml5',
-                            text: 'Copy to Clipboard',
-                            exportOptions: { columns: ':visible:not(.col-Structure)' }
-                        },
-                        {
-                            text: 'Print / PDF',
-                            action: function(e, dt) {
-                                const visibleCount = dt.columns(':visible').count();
-                                const $tableWrapper = $('.table-responsive:visible');
-                                if (visibleCount > 7) {
-                                    $tableWrapper.addClass('print-scale-many');
-                                }
-                                dt.page.len(-1).draw();
-                                setTimeout(function() {
-                                    window.print();
-                                    setTimeout(function() {
-                                        $tableWrapper.removeClass('print-scale-many');
-                                    }, 1000);
-                                }, 500);
-                            }
-                        }
-                    ]
-                }
-            ],
-            stateSave: true,
-            stateSaveCallback: function(settings, data) {
-                const visible = [];
-                settings.aoColumns.forEach((col, idx) => {
-                    if (col.bVisible) visible.push(ALL_COLS[idx]);
-                });
-                visibleCols = visible;
-                localStorage.setItem('results_visible_cols', JSON.stringify(visible));
-                localStorage.setItem('DataTables_' + tableId, JSON.stringify(data));
-            },
-            stateLoadCallback: function() {
-                try {
-                    return JSON.parse(localStorage.getItem('DataTables_' + tableId));
-                } catch(e) {
-                    return null;
-                }
-            },
-            language: {
-                search: "Search chemicals:",
-                lengthMenu: "Show _MENU_ rows",
-                info: "Showing _START_ to _END_ of _TOTAL_ chemicals",
-                infoEmpty: "No chemicals found",
-                infoFiltered: "(filtered from _MAX_ total)",
-                zeroRecords: "No matching chemicals found"
-            },
-            initComplete: function() {
-                var $btnGroup = $(this.api().table().container()).find('.dt-buttons');
-                var active = localStorage.getItem('results_group_identical') !== 'false';
-                var $pill = $('<span id="group-toggle" style="cursor:pointer;font-size:0.8rem;padding:4px 10px;border-radius:12px;border:1px solid var(--accent);user-select:none;margin-left:8px;align-content:center;"></span>').text('Group identical');
-                function applyStyle() {
-                    if (active) {
-                        $pill.css({background:'var(--highlight)',color:'#fff'});
-                    } else {
-                        $pill.css({background:'transparent',color:'var(--text-dim)'});
-                    }
-                }
-                applyStyle();
-                $pill.on('click', function() {
-                    grouped = !grouped;
-                    active = grouped;
-                    localStorage.setItem('results_group_identical', grouped ? 'true' : 'false');
-                    if (activeTable) { activeTable.destroy(); activeTable = null; }
-                    initActiveTable();
-                });
-                $btnGroup.append($pill);
-            }
-        };
-    }
-
-    // Group toggle logic
-    var grouped = localStorage.getItem('results_group_identical') !== 'false';
-    var activeTable = null;
-
-    function initActiveTable() {
-        if (grouped) {
-            $('#individual-table-wrapper').hide();
-            $('#grouped-table-wrapper').show();
-            if ($.fn.dataTable.isDataTable('#results-data-table')) {
-                $('#results-data-table').DataTable().destroy();
-            }
-            activeTable = $('#results-grouped-table').DataTable(buildDTConfig('results-grouped'));
-            activeTable.on('column-visibility.dt', function(e, settings) {
-                var visible = [];
-                settings.aoColumns.forEach(function(col, idx) {
-                    if (col.bVisible) visible.push(ALL_COLS[idx]);
-                });
-                visibleCols = visible;
-                localStorage.setItem('results_visible_cols', JSON.stringify(visible));
-            });
-        } else {
-            $('#grouped-table-wrapper').hide();
-            $('#individual-table-wrapper').show();
-            if ($.fn.dataTable.isDataTable('#results-grouped-table')) {
-                $('#results-grouped-table').DataTable().destroy();
-            }
-            activeTable = $('#results-data-table').DataTable(buildDTConfig('results'));
-            activeTable.on('column-visibility.dt', function(e, settings) {
-                var visible = [];
-                settings.aoColumns.forEach(function(col, idx) {
-                    if (col.bVisible) visible.push(ALL_COLS[idx]);
-                });
-                visibleCols = visible;
-                localStorage.setItem('results_visible_cols', JSON.stringify(visible));
-            });
-        }
-        window._activeTable = activeTable;
-    }
-
-    initActiveTable();
-
-    $(document).on('click', '.vary-pop', function(e) {
-        $('.vary-popover').remove();
-        var content = $(this).next('.vary-pop-content').text();
-        var $pop = $('<div class="vary-popover"></div>').text(content)
-            .css({position:'absolute', background:'var(--bg-card)', border:'1px solid var(--border)',
-                  borderRadius:'6px', padding:'8px 12px', fontSize:'0.8rem', maxWidth:'300px',
-                  zIndex:1000, boxShadow:'0 2px 8px rgba(0,0,0,0.15)', wordBreak:'break-word'});
-        $('body').append($pop);
-        var rect = this.getBoundingClientRect();
-        $pop.css({top: rect.bottom + window.scrollY + 4, left: rect.left + window.scrollX});
-    });
-    $(document).on('click', function(e) {
-        if (!$(e.target).hasClass('vary-pop')) $('.vary-popover').remove();
-    });
-
-});
-
-// Keep compound info polling
-async function pollCompoundInfo() {
-    const badge = document.getElementById('compound-info-badge');
-    if (!badge) return;
-    try {
-        const resp = await fetch('/api/compound-info-status');
-        const data = await resp.json();
-        if (data.status === 'running') {
-            badge.innerHTML = '<span class="loading" style="width:12px;height:12px;"></span> Fetching compound info ' + data.progress;
-            setTimeout(pollCompoundInfo, 3000);
-        } else if (data.status === 'done') {
-            badge.textContent = '';
-        }
-    } catch(e) {}
-}
-document.addEventListener('DOMContentLoaded', pollCompoundInfo);
-
-// --- Save/Unsave toggle ---
-console.log('[Script] toggleSave and filter code starting to parse');
-function toggleSave() {
-    const filterId = '{{ current_filter.id if current_filter else "" }}';
-    if (!filterId || filterId === 'all') return;
-    const isSaved = {{ 'true' if current_filter and current_filter.get('saved') else 'false' }};
-    const action = isSaved ? 'unsave' : 'save';
-    fetch('/api/filter-results/' + filterId + '/' + action, { method: 'POST' })
-        .then(r => r.json())
-        .then(data => { if (data.success) location.reload(); });
-}
-
-// --- Advanced property filters ---
-console.log('[Filters] Script tag loaded');
-console.log('[Filters] jQuery?', typeof $);
-console.log('[Filters] noUiSlider?', typeof noUiSlider);
-console.log('[Filters] DataTable?', typeof $.fn.dataTable);
-
-window._filterState = { mwLo: null, mwHi: null, formula: '', location: '' };
-window._fIdx = { mw: -1, formula: -1, loc: -1 };
-window._mwSlider = null;
-
-$(document).ready(function() {
-    if (!window._activeTable) { console.log('[Filters] No results table found, skipping'); return; }
-
-    var tbl = window._activeTable;
-    var tbl = window._activeTable;
-    var headers = [];
-    tbl.columns().header().each(function(h) { headers.push($(h).text().trim()); });
-    window._fIdx.mw = headers.indexOf('MW');
-    window._fIdx.formula = headers.indexOf('Formula');
-    window._fIdx.loc = headers.indexOf('Location');
-    console.log('[Filters] Column indices — MW:', window._fIdx.mw, 'Formula:', window._fIdx.formula, 'Location:', window._fIdx.loc);
-
-    // --- noUiSlider for MW ---
-    var sliderEl = document.getElementById('mw-slider');
-    if (sliderEl && window._fIdx.mw >= 0) {
-        var dataMin = Infinity, dataMax = -Infinity;
-        tbl.column(window._fIdx.mw).data().each(function(val) {
-            var n = parseFloat(val);
-            if (!isNaN(n)) {
-                if (n < dataMin) dataMin = n;
-                if (n > dataMax) dataMax = n;
-            }
-        });
-        if (!isFinite(dataMin)) { dataMin = 0; dataMax = 1000; }
-        dataMin = Math.floor(dataMin);
-        dataMax = Math.ceil(dataMax);
-        window._mwDataMin = dataMin;
-        window._mwDataMax = dataMax;
-        window._filterState.mwLo = dataMin;
-        window._filterState.mwHi = dataMax;
-
-        noUiSlider.create(sliderEl, {
-            start: [dataMin, dataMax],
-            connect: true,
-            range: { 'min': dataMin, 'max': dataMax },
-            step: 1,
-            tooltips: [
-                { to: function(v) { return Math.round(v); } },
-                { to: function(v) { return Math.round(v); } }
-            ],
-            pips: {
-                mode: 'count',
-                values: 5,
-                density: 4,
-                format: { to: function(v) { return Math.round(v); } }
-            }
-        });
-        window._mwSlider = sliderEl.noUiSlider;
-        console.log('[Filters] MW slider created, range:', dataMin, '-', dataMax);
-    } else {
-        console.log('[Filters] MW slider skipped — element:', !!sliderEl, 'mwIdx:', window._fIdx.mw);
-    }
-
-    // --- Register DataTables custom search function ---
-    $.fn.dataTable.ext.search.push(function(settings, data) {
-        if (settings.nTable.id !== 'results-data-table' && settings.nTable.id !== 'results-grouped-table') return true;
-        var fs = window._filterState;
-        var idx = window._fIdx;
-
-        if (idx.mw >= 0 && fs.mwLo !== null && fs.mwHi !== null) {
-            if (fs.mwLo > window._mwDataMin || fs.mwHi < window._mwDataMax) {
-                var mw = parseFloat(data[idx.mw]);
-                if (isNaN(mw) || mw < fs.mwLo || mw > fs.mwHi) return false;
-            }
-        }
-        if (idx.formula >= 0 && fs.formula) {
-            const cellData = data[idx.formula];
-            const plaintext = cellData && cellData.match(/data-plaintext="([^"]*)"/) ? cellData.match(/data-plaintext="([^"]*)"/)[1] : cellData;
-            if ((plaintext || '').toLowerCase().indexOf(fs.formula) === -1) return false;
-        }
-        if (idx.loc >= 0 && fs.location) {
-            if ((data[idx.loc] || '').trim() !== fs.location) return false;
-        }
-        return true;
-    });
-    console.log('[Filters] Custom search function registered');
-
-    // --- Button handlers ---
-    $('#apply-filters-btn').on('click', function() {
-        console.log('[Filters] Apply clicked');
-        if (window._mwSlider) {
-            var vals = window._mwSlider.get();
-            window._filterState.mwLo = parseFloat(vals[0]);
-            window._filterState.mwHi = parseFloat(vals[1]);
-            console.log('[Filters] MW range:', window._filterState.mwLo, '-', window._filterState.mwHi);
-        }
-        window._filterState.formula = ($('#formula-filter').val() || '').toLowerCase();
-        window._filterState.location = $('#location-filter').val() || '';
-        console.log('[Filters] Formula:', window._filterState.formula, 'Location:', window._filterState.location);
-        if (window._activeTable) window._activeTable.draw();
-        console.log('[Filters] Table redrawn');
-    });
-
-    $('#clear-filters-btn').on('click', function() {
-        console.log('[Filters] Clear clicked');
-        if (window._mwSlider) {
-            window._mwSlider.set([window._mwDataMin, window._mwDataMax]);
-        }
-        $('#formula-filter').val('');
-        $('#location-filter').val('');
-        window._filterState = { mwLo: window._mwDataMin, mwHi: window._mwDataMax, formula: '', location: '' };
-        if (window._activeTable) window._activeTable.draw();
-        console.log('[Filters] Filters cleared, table redrawn');
-    });
-
-    console.log('[Filters] Button handlers bound');
-});
+const FILTER_ID = {{ (current_filter.id if current_filter else '')|tojson }};
+const MW_RANGE = {{ mw_range|list|tojson }};
+const FACETS = {{ facets|tojson }};
+const IS_SAVED = {{ 'true' if current_filter and current_filter.get('saved') else 'false' }};
+const EXPORT_TITLE = {{ ((current_filter.search_name if current_filter else 'Results') ~ ' - ' ~ (current_filter.created[:10] if current_filter else ''))|tojson }};
 </script>
+<script src="{{ asset_url('js/results.js') }}"></script>
 {% endblock %}
 """
 
+
+# Cells of the results table, rendered per page by results_rows_api
+RESULT_CELLS_TEMPLATE = """
+{% macro render_cell(row, col, grouped=false) %}
+    {% if col == 'Structure' %}
+    <div class="structure-cell">
+        {% if row._cid_int %}
+        <img class="structure-thumb" src="{{ url_for('structure_image', cid=row._cid_int) }}" alt="structure" loading="lazy">
+        <img class="structure-large" src="{{ url_for('structure_image', cid=row._cid_int, t='l') }}" alt="structure" loading="lazy">
+        {% else %}-{% endif %}
+    </div>
+    {% elif col == 'CID' %}
+        {% if row._cid_int %}
+        <a href="https://pubchem.ncbi.nlm.nih.gov/compound/{{ row._cid_int }}" target="_blank" style="color: var(--success);" class="mono">{{ row._cid_int }}</a>
+        {% if similarity_available %}<a href="#" onclick="openSimilar({{ row._cid_int }}); return false;" title="Most similar chemicals you hold" style="color: var(--text-dim); text-decoration: none;">&asymp;</a>{% endif %}
+        {% else %}-{% endif %}
+    {% elif col == 'Name' %}
+        {{ row._ci.get('title', '') or '-' }}{% if row._repair_status == 'repaired' %} <span class="badge badge-warning" title="Found via text search (repaired)" style="margin-left: 4px; font-size: 0.7rem;">&#128295;</span>{% endif %}{% if grouped and row._group_count > 1 %} <span class="badge" style="background: var(--accent); color: var(--bg); font-size: 0.7rem; padding: 1px 5px; border-radius: 8px; margin-left: 4px;">&times;{{ row._group_count }}</span>{% endif %}
+    {% elif col == 'GROSname' %}
+        {% if grouped and col in row._group_varying %}
+            <span class="vary-pop text-dim" style="font-size:0.75rem;cursor:pointer;text-decoration:underline dotted;" title="Click to view">{{ row._group_varying[col]|length }} values</span><span class="vary-pop-content" style="display:none;">{{ row._group_varying[col]|join(', ') }}</span>
+        {% else %}{{ row.get('Name', '') or '-' }}{% endif %}
+    {% elif col == 'CAS' %}
+        {% if row._cid_int %}
+            {% if row.get('_original_cas') %}
+                <s>{{ row._original_cas }}</s> <a href="https://pubchem.ncbi.nlm.nih.gov/compound/{{ row._cid_int }}" target="_blank" style="color: var(--success);">{{ row.get('Casnr', '') }}</a>
+            {% else %}
+                <a href="https://pubchem.ncbi.nlm.nih.gov/compound/{{ row._cid_int }}" target="_blank" style="color: var(--success);">{{ row.get('Casnr', '') }}</a>
+            {% endif %}
+        {% else %}
+            {% if row.get('_original_cas') %}<s>{{ row._original_cas }}</s> {{ row.get('Casnr', '') }}{% else %}{{ row.get('Casnr', '') or '-' }}{% endif %}
+        {% endif %}
+    {% elif col == 'Formula' %}
+        {% set formula = row._ci.get('formula', '') or row.get('Formula', '') or '-' %}
+        {% if formula != '-' %}
+            <span data-plaintext="{{ formula }}">{{ formula|replace('0', '<sub>0</sub>')|replace('1', '<sub>1</sub>')|replace('2', '<sub>2</sub>')|replace('3', '<sub>3</sub>')|replace('4', '<sub>4</sub>')|replace('5', '<sub>5</sub>')|replace('6', '<sub>6</sub>')|replace('7', '<sub>7</sub>')|replace('8', '<sub>8</sub>')|replace('9', '<sub>9</sub>')|safe }}
+            </span>
+        {% else %}
+            -
+        {% endif %}
+    {% elif col == 'MW' %}{{ row._ci.get('mw', '') or '-' }}
+    {% elif col == 'SMILES' %}<span class="smiles-cell" title="{{ row._ci.get('smiles', '') }}">{{ row._ci.get('smiles', '') or '-' }}</span>
+    {% elif col == 'IUPAC' %}{{ row._ci.get('iupac', '') or '-' }}
+    {% elif col == 'Hazards' %}
+        {% for code in row._ci.get('ghs_pictograms', []) %}
+        <img class="ghs-icon" src="{{ url_for('ghs_pictogram', code=code) }}" title="{{ ghs_names.get(code, code) }}" alt="{{ code }}" loading="lazy">
+        {% endfor %}
+        {% if not row._ci.get('ghs_pictograms') %}-{% endif %}
+    {% elif col == 'Location' %}
+        {% if grouped and col in row._group_varying %}
+            <span class="vary-pop text-dim" style="font-size:0.75rem;cursor:pointer;text-decoration:underline dotted;" title="Click to view">{{ row._group_varying[col]|length }} values</span><span class="vary-pop-content" style="display:none;">{{ row._group_varying[col]|join(', ') }}</span>
+        {% else %}{{ row.get('Location', '') or '-' }}{% endif %}
+    {% else %}
+        {% if grouped and col in row.get('_group_varying', {}) %}
+            <span class="vary-pop text-dim" style="font-size:0.75rem;cursor:pointer;text-decoration:underline dotted;" title="Click to view">{{ row._group_varying[col]|length }} values</span><span class="vary-pop-content" style="display:none;">{{ row._group_varying[col]|join(', ') }}</span>
+        {% else %}{{ row.get(col, '') or '-' }}{% endif %}
+    {% endif %}
+{% endmacro %}
+"""
+
 SETUP_TEMPLATE = """
-{% extends "base" %}
+{% extends "base.html" %}
 {% block content %}
 <div class="stats">
     <div class="stat">
@@ -2266,6 +1159,16 @@ SETUP_TEMPLATE = """
             </form>
         </div>
         {% endif %}
+        {% if cache_valid %}
+        <div style="margin-bottom: 20px;">
+            <h3 style="font-size: 0.95rem; color: var(--text-dim); margin-bottom: 10px;">Import PubChem Extract Files</h3>
+            <p class="text-dim" style="margin-bottom: 10px; font-size: 0.85rem;">Fill compound info offline from downloaded PubChem files (CID-Title, CID-SMILES, CID-IUPAC, CID-Mass, optionally .gz) instead of querying PubChem.</p>
+            <div style="display: flex; gap: 10px; align-items: center;">
+                <input type="text" id="extracts-dir" placeholder="Folder containing the extract files" style="flex: 1; padding: 6px 10px; border: 1px solid var(--border); border-radius: 4px; background: var(--bg); color: var(--text);">
+                <button class="btn btn-secondary" onclick="ingestExtracts(this)">Import</button>
+            </div>
+        </div>
+        {% endif %}
         <div style="margin-bottom: 20px;">
             <h3 style="font-size: 0.95rem; color: var(--text-dim); margin-bottom: 10px;">Upload HTML File</h3>
             <form action="{{ url_for('upload_snapshot') }}" method="post" enctype="multipart/form-data" style="display: flex; gap: 10px; align-items: center;">
@@ -2481,362 +1384,185 @@ SETUP_TEMPLATE = """
 
 {% block scripts %}
 <script>
-// Session state for two-phase browser refresh
-let rugSessionId = null;
-
-async function openRugLogin(btn) {
-    if (!confirm('This will open a Chrome browser window.\\n\\nYou will need to:\\n1. Log in to the RUG system (including MFA)\\n2. Click Continue here when done\\n\\nContinue?')) {
-        return;
-    }
-
-    const statusDiv = document.getElementById('browser-refresh-status');
-    const statusText = document.getElementById('refresh-status-text');
-    const btnContinue = document.getElementById('btn-continue');
-    const instructions = document.getElementById('rug-instructions');
-    const spinner = document.getElementById('status-spinner');
-
-    btn.disabled = true;
-    statusDiv.style.display = 'block';
-    statusText.textContent = 'Opening browser... Check your desktop for Chrome window.';
-
-    try {
-        const resp = await fetch('{{ url_for("refresh_html_start") }}', { method: 'POST' });
-        const data = await resp.json();
-
-        if (data.error) {
-            statusText.textContent = 'Error: ' + data.error;
-            btn.disabled = false;
-        } else if (data.session_id) {
-            rugSessionId = data.session_id;
-            spinner.style.display = 'none';
-            statusText.textContent = 'Browser opened. Log in to RUG (including MFA), then click Continue.';
-            instructions.textContent = 'Complete login in the Chrome window, then click Continue below.';
-            btnContinue.style.display = 'inline-block';
-        }
-    } catch (e) {
-        statusText.textContent = 'Error: ' + e.message;
-        btn.disabled = false;
-    }
-}
-
-async function continueAfterLogin(btn) {
-    if (!rugSessionId) {
-        alert('No active session. Please click "Fetch from RUG System" first.');
-        return;
-    }
-
-    const statusText = document.getElementById('refresh-status-text');
-    const spinner = document.getElementById('status-spinner');
-    const btnOpen = document.getElementById('btn-open-login');
-
-    btn.disabled = true;
-    spinner.style.display = 'inline-block';
-    statusText.textContent = 'Fetching chemicals data... This may take a moment.';
-
-    try {
-        const resp = await fetch('{{ url_for("refresh_html_continue", session_id="SESSION_ID_PLACEHOLDER") }}'.replace('SESSION_ID_PLACEHOLDER', rugSessionId), { method: 'POST' });
-        const data = await resp.json();
-
-        if (data.error) {
-            spinner.style.display = 'none';
-            statusText.textContent = 'Error: ' + data.error;
-            btn.disabled = false;
-            btnOpen.disabled = false;
-            btn.style.display = 'none';
-            rugSessionId = null;
-        } else if (data.success) {
-            statusText.textContent = 'Success! Saved: ' + data.snapshot;
-            setTimeout(() => window.location.reload(), 1500);
-        }
-    } catch (e) {
-        spinner.style.display = 'none';
-        statusText.textContent = 'Error: ' + e.message;
-        btn.disabled = false;
-        btnOpen.disabled = false;
-        btn.style.display = 'none';
-        rugSessionId = null;
-    }
-}
+const REFRESH_START_URL = {{ url_for("refresh_html_start")|tojson }};
+const REFRESH_CONTINUE_URL = {{ url_for("refresh_html_continue", session_id="SESSION_ID_PLACEHOLDER")|tojson }};
+</script>
+<script src="{{ asset_url('js/setup.js') }}"></script>
+{% endblock %}
+"""
 
-function toggleSection(id) {
-    const content = document.getElementById(id);
-    const icon = document.getElementById(id + '-icon');
-    if (content.classList.contains('open')) {
-        content.classList.remove('open');
-        icon.textContent = '+ expand';
-    } else {
-        content.classList.add('open');
-        icon.textContent = '- collapse';
-    }
-}
+# ============================================================================
+# Template rendering helper
+# ============================================================================
 
-// Poll compound-info background fetch status
-async function pollCompoundInfoSetup() {
-    const el = document.getElementById('compound-info-status');
-    const text = document.getElementById('ci-status-text');
-    const spinner = document.getElementById('ci-spinner');
-    if (!el) return;
-    try {
-        const resp = await fetch('/api/compound-info-status');
-        const data = await resp.json();
-        if (data.status === 'running') {
-            el.style.display = 'block';
-            spinner.style.display = 'inline-block';
-            text.textContent = 'Fetching compound info (structures, hazards)... ' + data.progress;
-            setTimeout(pollCompoundInfoSetup, 3000);
-        } else if (data.status === 'done') {
-            el.style.display = 'block';
-            spinner.style.display = 'none';
-            text.innerHTML = '<span class="text-success">Compound info (structures, hazards) ready.</span>';
-        } else {
-            el.style.display = 'none';
-        }
-    } catch(e) {}
-}
-document.addEventListener('DOMContentLoaded', pollCompoundInfoSetup);
-
-function filterTable() {
-    const filter = document.getElementById('filter-select').value;
-    const rows = document.querySelectorAll('#results-body tr');
-    rows.forEach(row => {
-        const status = row.dataset.status;
-        if (filter === 'all') {
-            row.style.display = '';
-        } else if (filter === 'found' && status === 'found') {
-            row.style.display = '';
-        } else if (filter === 'not_found' && status === 'not_found') {
-            row.style.display = '';
-        } else {
-            row.style.display = 'none';
-        }
-    });
+TEMPLATES = {
+    "base.html": BASE_TEMPLATE,
+    "search.html": SEARCH_TEMPLATE,
+    "results.html": RESULTS_TEMPLATE,
+    "result_cells.html": RESULT_CELLS_TEMPLATE,
+    "setup.html": SETUP_TEMPLATE,
 }
 
-// ---- Repair unmatched entries ----
-async function startRepair() {
-    if (!confirm('This will search PubChem for matches and let you review them before saving.\\n\\nContinue?')) return;
-
-    const statusBox = document.getElementById('repair-status-box');
-    const statusText = document.getElementById('repair-status-text');
-    const btn = document.getElementById('btn-repair');
-
-    btn.disabled = true;
-    statusBox.style.display = 'flex';
-    statusText.textContent = 'Starting repair...';
-
-    try {
-        const startResp = await fetch('/api/repair-unmatched/start', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({})
-        });
-        const startData = await startResp.json();
-
-        if (startData.error) {
-            alert('Error: ' + startData.error);
-            btn.disabled = false;
-            statusBox.style.display = 'none';
-            return;
-        }
+# The templates are served to Jinja by name, so {% extends "base.html" %}
+# works natively and each template is compiled once and kept in the
+# environment's cache. The names must end in .html: Flask only autoescapes
+# templates by extension. The bytecode cache (in the system temp dir)
+# spares the compile after a restart. Templates are only re-checked for
+# changes in debug mode.
+app.jinja_env.loader = ChoiceLoader([DictLoader(TEMPLATES), app.jinja_env.loader])
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+app.jinja_env.auto_reload = app.debug
 
-        pollRepairStatus();
-    } catch (e) {
-        alert('Error: ' + e.message);
-        btn.disabled = false;
-        statusBox.style.display = 'none';
-    }
-}
 
-async function pollRepairStatus() {
-    const statusBox = document.getElementById('repair-status-box');
-    const statusText = document.getElementById('repair-status-text');
-    const spinner = document.getElementById('repair-spinner');
-    const btn = document.getElementById('btn-repair');
-
-    try {
-        const resp = await fetch('/api/repair-unmatched/status');
-        const data = await resp.json();
-
-        if (data.status === 'running') {
-            statusText.textContent = 'Repairing... ' + data.progress;
-            setTimeout(() => pollRepairStatus(), 2000);
-        } else if (data.status === 'done') {
-            spinner.style.display = 'none';
-            statusText.textContent = 'Repair scan complete! Loading results...';
-            setTimeout(async () => {
-                const hasPending = await loadPendingRepairs();
-                if (hasPending) {
-                    statusBox.style.display = 'none';
-                    document.getElementById('review-repairs-card').scrollIntoView({behavior: 'smooth'});
-                } else {
-                    statusText.textContent = 'No matches found.';
-                }
-                btn.disabled = false;
-            }, 500);
-        } else {
-            statusBox.style.display = 'none';
-            btn.disabled = false;
-        }
-    } catch (e) {
-        statusText.textContent = 'Error checking status';
-        btn.disabled = false;
-    }
-}
+def render(template_name, **kwargs):
+    """Render one of TEMPLATES."""
+    return render_template(template_name, **kwargs)
 
-async function loadPendingRepairs() {
-    try {
-        const resp = await fetch('/api/repair-unmatched/pending');
-        const data = await resp.json();
-        if (data.repaired_entries && data.repaired_entries.length > 0) {
-            displayPendingRepairs(data.repaired_entries);
-            document.getElementById('review-repairs-card').style.display = 'block';
-            return true;
-        }
-    } catch (e) {
-        console.error('Failed to load pending repairs:', e);
-    }
-    return false;
-}
 
-function displayPendingRepairs(entries) {
-    const tbody = document.getElementById('pending-repairs-body');
-    tbody.innerHTML = entries.map(entry =>
-        '<tr>' +
-        '<td><input type="checkbox" class="repair-checkbox" value="' + entry.row_index + '" checked></td>' +
-        '<td>' + entry.name + '</td>' +
-        '<td class="mono">' + entry.cas + '</td>' +
-        '<td class="mono">' + (entry.real_cas || '<span class="text-dim">-</span>') + '</td>' +
-        '<td><a href="https://pubchem.ncbi.nlm.nih.gov/compound/' + entry.cid + '" target="_blank" class="mono" style="color: var(--success);">' + entry.cid + '</a></td>' +
-        '<td><img src="https://pubchem.ncbi.nlm.nih.gov/image/imgsrv.fcgi?cid=' + entry.cid + '&t=s" style="width: 40px; height: 40px; background: white; border-radius: 2px;" alt="structure"></td>' +
-        '</tr>'
-    ).join('');
-}
+# ============================================================================
+# Static assets (CSS / JS)
+# ============================================================================
 
-function toggleAllRepairs(checked) {
-    document.querySelectorAll('.repair-checkbox').forEach(cb => cb.checked = checked);
-}
+# The page styles and scripts live in static/css and static/js. They are
+# linked with a content fingerprint in the URL (asset_url), so the browser
+# can keep them for good and only re-fetches after the file changes. Each
+# file is read and compressed (gzip, and brotli when installed) once and
+# served from memory.
+ASSET_DIR = BUNDLE_DIR / "static"
+ASSET_MIMETYPES = {".css": "text/css", ".js": "text/javascript"}
 
-async function applySelectedRepairs(btn) {
-    const selected = Array.from(document.querySelectorAll('.repair-checkbox:checked')).map(cb => cb.value);
-    if (selected.length === 0) { alert('No repairs selected'); return; }
-    if (!confirm('Apply ' + selected.length + ' repairs?')) return;
-
-    btn.disabled = true;
-    const originalText = btn.textContent;
-    btn.textContent = 'Applying...';
-
-    try {
-        const resp = await fetch('/api/repair-unmatched/apply', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({approved: selected})
-        });
-        const data = await resp.json();
-        if (data.success) {
-            alert('Applied ' + data.applied + ' repairs successfully!');
-            window.location.reload();
-        } else {
-            alert('Error: ' + (data.error || 'Unknown error'));
-        }
-    } catch (e) {
-        alert('Error: ' + e.message);
-    } finally {
-        btn.disabled = false;
-        btn.textContent = originalText;
-    }
-}
+_assets: dict[str, dict] = {}
+_assets_lock = threading.Lock()
 
-// --- Quick Import ---
-async function importFromUrl(btn) {
-    const url = document.getElementById('import-url').value.trim();
-    if (!url) { alert('Enter a URL'); return; }
-    btn.disabled = true; btn.textContent = 'Importing...';
-    try {
-        const resp = await fetch('/api/import-database-url', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({url})
-        });
-        const data = await resp.json();
-        if (data.success) {
-            window.location.reload();
-        } else if (data.auth_required) {
-            window.open(data.url, '_blank');
-            alert('Authentication required. The file is opening in your browser.\\nDownload it, then use the file picker to import.');
-            btn.disabled = false; btn.textContent = 'Import from URL';
-        } else {
-            alert('Import failed: ' + data.error);
-            btn.disabled = false; btn.textContent = 'Import from URL';
-        }
-    } catch (e) {
-        alert('Import failed: ' + e.message);
-        btn.disabled = false; btn.textContent = 'Import from URL';
-    }
-}
 
-async function importFromFile(input) {
-    const file = input.files[0];
-    if (!file) return;
-    const statusDiv = document.getElementById('import-status');
-    const statusText = document.getElementById('import-status-text');
-    statusDiv.style.display = '';
-    statusText.textContent = 'Reading file...';
-    try {
-        const text = await file.text();
-        statusText.textContent = 'Importing...';
-        const resp = await fetch('/api/import-database', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: text
-        });
-        const data = await resp.json();
-        if (data.success) { window.location.reload(); }
-        else { alert('Import failed: ' + data.error); statusDiv.style.display = 'none'; }
-    } catch (e) {
-        alert('Import failed: ' + e.message);
-        statusDiv.style.display = 'none';
-    }
-}
+def _brotli():
+    """Import brotli lazily; returns the module or None."""
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
 
-// Check for pending repairs on page load
-document.addEventListener('DOMContentLoaded', loadPendingRepairs);
 
+def _asset(filename):
+    """Fingerprint and precompressed variants of a static asset (None if missing)."""
+    if Path(filename).suffix not in ASSET_MIMETYPES or ".." in Path(filename).parts:
+        return None
+    path = ASSET_DIR / filename
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except OSError:
+        return None
+    with _assets_lock:
+        entry = _assets.get(filename)
+        if entry is None or entry["mtime_ns"] != mtime_ns:
+            data = path.read_bytes()
+            entry = {
+                "mtime_ns": mtime_ns,
+                "digest": hashlib.sha256(data).hexdigest()[:12],
+                "identity": data,
+                "gzip": gzip.compress(data, compresslevel=9, mtime=0),
+            }
+            brotli = _brotli()
+            if brotli is not None:
+                entry["br"] = brotli.compress(data, quality=11)
+            _assets[filename] = entry
+    return entry
+
+
+def asset_url(filename):
+    """Fingerprinted URL of a static asset, for use in templates."""
+    entry = _asset(filename)
+    digest = entry["digest"] if entry else "missing"
+    return url_for("static_asset", digest=digest, filename=filename)
+
+
+app.jinja_env.globals["asset_url"] = asset_url
+
+
+@app.route("/assets/<digest>/<path:filename>")
+def static_asset(digest, filename):
+    """Static CSS / JS, precompressed; cached for good when the fingerprint matches."""
+    entry = _asset(filename)
+    if entry is None:
+        return "Unknown asset", 404
+    accepted = request.accept_encodings
+    encoding = next((e for e in ("br", "gzip") if e in entry and accepted[e]), None)
+    resp = Response(entry[encoding or "identity"], mimetype=ASSET_MIMETYPES[Path(filename).suffix])
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    resp.headers["Vary"] = "Accept-Encoding"
+    if digest != entry["digest"]:
+        # Stale link (the file changed since the page was rendered)
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
+    return _immutable(resp)
 
-</script>
-{% endblock %}
-"""
 
 # ============================================================================
-# Template rendering helper
+# Response compression and conditional requests
 # ============================================================================
 
-TEMPLATES = {
-    "base": BASE_TEMPLATE,
-    "search": SEARCH_TEMPLATE,
-    "results": RESULTS_TEMPLATE,
-    "setup": SETUP_TEMPLATE,
-}
-
-def render(template_name, **kwargs):
-    """Render a template with the base template."""
-    # Jinja2 doesn't support extends with render_template_string directly,
-    # so we do a simple string replacement approach
-    base = TEMPLATES["base"]
-    content = TEMPLATES[template_name]
-
-    # Extract the content block
-    import re
-    content_match = re.search(r'{%\s*block\s+content\s*%}(.*?){%\s*endblock\s*%}', content, re.DOTALL)
-    scripts_match = re.search(r'{%\s*block\s+scripts\s*%}(.*?){%\s*endblock\s*%}', content, re.DOTALL)
-
-    content_block = content_match.group(1) if content_match else ""
-    scripts_block = scripts_match.group(1) if scripts_match else ""
-
-    # Replace in base
-    html = base.replace("{% block content %}{% endblock %}", content_block)
-    html = html.replace("{% block scripts %}{% endblock %}", scripts_block)
-
-    return render_template_string(html, **kwargs)
+# Large JSON / HTML responses are compressed on the way out. Polled JSON
+# endpoints also carry a strong ETag derived from the versions of the data
+# files they are built from (see _versions_etag), so an unchanged poll is
+# answered with 304 without rebuilding the payload. The process token keeps
+# ETags from a previous run (other code, empty download queue) from matching.
+COMPRESS_MIN_SIZE = 1024  # bytes
+COMPRESS_MIMETYPES = ("application/json", "text/html")
+ETAG_PROCESS_TOKEN = uuid.uuid4().hex[:8]
+
+
+def _versions_etag(*versions) -> str:
+    """Strong ETag for the current request path and the given data versions."""
+    key = repr((ETAG_PROCESS_TOKEN, request.path, versions))
+    return hashlib.sha256(key.encode()).hexdigest()[:24]
+
+
+def _not_modified(etag):
+    """A 304 response if the client already holds etag (any encoding), else None."""
+    for tag in (etag, f"{etag}-br", f"{etag}-gzip"):
+        if request.if_none_match.contains(tag):
+            resp = Response(status=304)
+            resp.set_etag(tag)
+            resp.headers["Cache-Control"] = "no-cache"
+            resp.headers["Vary"] = "Accept-Encoding"
+            return resp
+    return None
+
+
+def _with_etag(resp, etag):
+    """Tag a response for revalidation on every use."""
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+@app.after_request
+def compress_response(resp):
+    """gzip / brotli compress large JSON and HTML responses."""
+    if (resp.status_code != 200 or resp.direct_passthrough or resp.is_streamed
+            or "Content-Encoding" in resp.headers or resp.mimetype not in COMPRESS_MIMETYPES):
+        return resp
+    accepted = request.accept_encodings
+    brotli = _brotli() if accepted["br"] else None
+    if brotli is None and not accepted["gzip"]:
+        return resp
+    data = resp.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return resp
+    if brotli is not None:
+        encoding, data = "br", brotli.compress(data, quality=5)
+    else:
+        encoding, data = "gzip", gzip.compress(data, compresslevel=6)
+    resp.set_data(data)
+    resp.headers["Content-Encoding"] = encoding
+    resp.vary.add("Accept-Encoding")
+    etag, weak = resp.get_etag()
+    if etag and not weak:
+        # A strong ETag names one representation
+        resp.set_etag(f"{etag}-{encoding}")
+    return resp
 
 
 # ============================================================================
@@ -2863,7 +1589,7 @@ def search():
         has_cids = len(cids) > 0
         cid_count = len(cids)
 
-    return render("search",
+    return render("search.html",
         title="Search",
         active_page="search",
         has_cids=has_cids,
@@ -2877,168 +1603,521 @@ def setup():
     snapshots = list_snapshots()
     cache = load_cid_cache()
 
-    latest_snapshot = None
-    cache_valid = False
+    latest_snapshot = None
+    cache_valid = False
+
+    latest_path = get_latest_snapshot()
+    if latest_path:
+        latest_snapshot = {
+            "name": latest_path.name,
+            "path": latest_path,
+            "timestamp": datetime.fromtimestamp(latest_path.stat().st_mtime),
+            "size": latest_path.stat().st_size,
+        }
+        # Imported databases use source_hash="imported" — treat as valid
+        if cache and cache.get("source_hash") == "imported":
+            cache_valid = True
+        else:
+            cache_valid, _ = is_cid_cache_valid(latest_path)
+
+    results_list = []
+    if cache and "results" in cache:
+        results_list = list(cache["results"].items())
+
+    # Get no-match entries from RUG table
+    no_match_rows = []
+    rug_table = load_rug_table()
+    if rug_table:
+        for row in rug_table.get("rows", []):
+            cid_val = row.get("CID")
+            if cid_val is None or (isinstance(cid_val, float) and cid_val != cid_val):  # None or NaN
+                no_match_rows.append(row)
+
+    return render("setup.html",
+        title="Setup",
+        active_page="setup",
+        snapshot_count=len(snapshots),
+        snapshots=snapshots,
+        cache_stats=cache.get("stats") if cache else None,
+        cache_created=cache.get("created", "")[:19] if cache else None,
+        latest_snapshot=latest_snapshot,
+        cache_valid=cache_valid,
+        setup_complete=is_setup_complete(),
+        results=results_list,
+        no_match_rows=no_match_rows,
+        no_match_count=len(no_match_rows),
+    )
+
+
+# Legacy routes - redirect to new structure
+@app.route("/snapshots")
+def snapshots():
+    return redirect(url_for("setup"))
+
+
+def _rows_in_cid_set(rows: list[dict], cids) -> list[tuple[dict, int]]:
+    """RUG table rows whose CID is in a CID set, paired with the CID as int."""
+    index = get_rug_row_index(rows)
+    return [(rows[i], int(index["row_cids"][i])) for i in rug_row_positions(index, cids)]
+
+
+def _resolve_filter(filter_id, rug_table: dict, filter_results: list[dict], fallback: bool = True):
+    """
+    (filter, CID set) for a results page filter_id; "all" is the whole
+    inventory. Unknown ids fall back to the latest filter if *fallback*.
+    """
+    if filter_id == "all":
+        matching = get_rug_row_index(rug_table.get("rows", []))["cids"]
+        return {
+            "id": "all",
+            "search_name": "All Chemicals",
+            "operation": "None",
+            "match_count": len(matching),
+            "created": "",
+            "pubchem_url": "",
+        }, matching
+    current_filter = None
+    if filter_id:
+        current_filter = next((f for f in filter_results if f["id"] == filter_id), None)
+    if not current_filter and filter_results and fallback:
+        current_filter = filter_results[0]
+    if not current_filter:
+        return None, None
+    return current_filter, get_filter_cids(current_filter)
+
+
+# Columns that may differ between rows of one CAS group; shown as "n values"
+GROUP_VARYING_COLUMNS = ["GROSname", "Pot", "Location", "Owner", "OwnerRegNumber"]
+
+
+def _row_groups_of(rows: list[dict]) -> dict:
+    """
+    Group rows by CAS number, in order of first appearance.
+
+    Returns:
+        {"first": position of each group's representative row,
+         "count": rows per group, "varying": per group, the columns of
+         GROUP_VARYING_COLUMNS with more than one value -> their unique values}
+    """
+    codes, uniques = pd.factorize(pd.Series([row.get("Casnr", "") or "" for row in rows], dtype=object))
+    n_groups = len(uniques)
+    frame = pd.DataFrame({"group": codes})
+    varying = [{} for _ in range(n_groups)]
+    for col in GROUP_VARYING_COLUMNS:
+        frame["value"] = [row.get(col, "") or "-" for row in rows]
+        # First occurrence of each (group, value), still in row order
+        distinct = frame.drop_duplicates(["group", "value"])
+        group = distinct["group"].to_numpy()
+        multi = np.bincount(group, minlength=n_groups) > 1
+        keep = multi[group]
+        for g, value in zip(group[keep], distinct["value"].to_numpy()[keep]):
+            varying[g].setdefault(col, []).append(value)
+    return {
+        "first": np.unique(codes, return_index=True)[1],
+        "count": np.bincount(codes, minlength=n_groups),
+        "varying": varying,
+    }
+
+
+# The grouping only depends on the RUG rows, so it is kept per filter and
+# RUG table version and outlives the results views (which also change with
+# compound info). Repairs and new snapshots rewrite the table, which changes
+# its version.
+_row_groups: dict[tuple, dict] = {}
+_row_groups_lock = threading.Lock()
+
+
+def _grouped_rows(view: dict) -> list[dict]:
+    """One representative row per CAS number of a results view, noting which columns vary."""
+    key = (view["filter"]["id"], view["rug_version"])
+    with _row_groups_lock:
+        groups = _row_groups.get(key)
+    if groups is None:
+        groups = _row_groups_of(view["rows"])
+        with _row_groups_lock:
+            for stale in [k for k in _row_groups if k[0] == key[0] or k[1] != key[1]]:
+                del _row_groups[stale]
+            while len(_row_groups) >= _RESULTS_VIEW_LIMIT:
+                del _row_groups[next(iter(_row_groups))]
+            _row_groups[key] = groups
+
+    rows = view["rows"]
+    grouped_rows = []
+    for pos, count, varying in zip(groups["first"], groups["count"], groups["varying"]):
+        rep = dict(rows[pos])  # copy representative row
+        rep["_group_count"] = int(count)
+        rep["_group_varying"] = varying
+        grouped_rows.append(rep)
+    return grouped_rows
+
+
+def _cell_text(row: dict, col: str) -> str:
+    """Plain text of a results cell, as used for searching and sorting."""
+    ci = row["_ci"]
+    if col == "Structure":
+        return ""
+    if col == "Name":
+        return ci.get("title", "") or ""
+    if col == "GROSname":
+        col = "Name"  # the RUG name; "Name" shows the PubChem title
+    elif col == "CAS":
+        return " ".join(filter(None, [row.get("_original_cas"), row.get("Casnr")]))
+    elif col == "Formula":
+        return ci.get("formula", "") or row.get("Formula", "") or ""
+    elif col in ("MW", "SMILES"):
+        return str(ci.get(col.lower(), "") or "")
+    elif col == "IUPAC":
+        return ci.get("iupac", "") or ""
+    elif col == "Hazards":
+        return " ".join(f"{c} {GHS_NAMES.get(c, '')}" for c in ci.get("ghs_pictograms", []))
+    elif col == "CID":
+        return str(row["_cid_int"])
+    varying = row.get("_group_varying", {}).get("GROSname" if col == "Name" else col)
+    if varying:
+        return " ".join(varying)
+    return str(row.get(col, "") or "")
+
+
+def _float_or_nan(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _facet_column(values: list[str]) -> dict:
+    """Distinct values (sorted) and the code of each row's value."""
+    labels, codes = np.unique(np.array(values, dtype=object), return_inverse=True)
+    return {"labels": [str(label) for label in labels], "codes": codes.astype(np.int32)}
+
+
+def _ghs_bits(rows: list[dict]) -> np.ndarray:
+    """GHS pictograms of each row as a bit mask (bit i = GHS_CODES[i])."""
+    bit = {code: 1 << i for i, code in enumerate(GHS_CODES)}
+    bits = np.zeros(len(rows), dtype=np.uint16)
+    for i, row in enumerate(rows):
+        for code in row["_ci"].get("ghs_pictograms", []):
+            bits[i] |= bit.get(code, 0)
+    return bits
+
+
+def _results_table(rows: list[dict]) -> dict:
+    """
+    Search text and filter columns of a list of results rows.
+
+    Location and Owner are coded for facet counting (see _facet_counts);
+    sort ranks and the unfiltered facet counts are added lazily, under the
+    table's lock (tables are shared by concurrent requests).
+    """
+    return {
+        "rows": rows,
+        "search": [
+            "\t".join(_cell_text(row, col) for col in ALL_RESULTS_COLUMNS).lower()
+            for row in rows
+        ],
+        "mw": np.array([_float_or_nan(row["_ci"].get("mw")) for row in rows], dtype=np.float64),
+        "formula": [_cell_text(row, "Formula").lower() for row in rows],
+        "location": _facet_column([(row.get("Location", "") or "").strip() for row in rows]),
+        "owner": _facet_column([(row.get("Owner", "") or "").strip() for row in rows]),
+        "ghs": _ghs_bits(rows),
+        "ranks": {},
+        "facets": None,
+        "lock": threading.Lock(),
+    }
+
+
+MW_HISTOGRAM_BINS = 24
+
+
+def _filter_masks(table: dict, args, search: str) -> dict[str, np.ndarray]:
+    """
+    Row mask of each active results filter, by facet name.
+
+    Takes the property filters mw_lo / mw_hi, formula (substring), location,
+    owner (exact) and ghs (pictogram code) from args, plus the table search.
+    """
+    n = len(table["rows"])
+    masks = {}
+    terms = search.lower().split()
+    if terms:
+        mask = np.ones(n, dtype=bool)
+        for term in terms:
+            mask &= np.fromiter((term in text for text in table["search"]), dtype=bool, count=n)
+        masks["search"] = mask
+    mw_lo = args.get("mw_lo", type=float)
+    mw_hi = args.get("mw_hi", type=float)
+    if mw_lo is not None or mw_hi is not None:
+        mw = table["mw"]
+        with np.errstate(invalid="ignore"):
+            masks["mw"] = (mw >= (mw_lo if mw_lo is not None else -np.inf)) & (mw <= (mw_hi if mw_hi is not None else np.inf))
+    formula = args.get("formula", "").strip().lower()
+    if formula:
+        masks["formula"] = np.fromiter((formula in f for f in table["formula"]), dtype=bool, count=n)
+    for name in ("location", "owner"):
+        value = args.get(name, "")
+        if value:
+            column = table[name]
+            code = column["labels"].index(value) if value in column["labels"] else -1
+            masks[name] = column["codes"] == code
+    ghs = args.get("ghs", "")
+    if ghs:
+        bit = 1 << GHS_CODES.index(ghs) if ghs in GHS_CODES else 0
+        masks["ghs"] = (table["ghs"] & bit) != 0
+    return masks
+
+
+def _facet_counts(table: dict, masks: dict[str, np.ndarray], mw_range: tuple) -> dict:
+    """
+    Value counts of the Location, Owner and GHS facets and an MW histogram.
+
+    Each facet counts the rows that pass all the other filters, so the
+    options of an active facet keep their counts.
+    """
+    n = len(table["rows"])
+
+    def passing(exclude=None):
+        mask = np.ones(n, dtype=bool)
+        for name, facet_mask in masks.items():
+            if name != exclude:
+                mask &= facet_mask
+        return mask
+
+    facets = {"total": int(passing().sum())}
+    for name in ("location", "owner"):
+        column = table[name]
+        counts = np.bincount(column["codes"][passing(name)], minlength=len(column["labels"]))
+        facets[name] = [
+            {"value": value, "count": int(count)}
+            for value, count in zip(column["labels"], counts) if value
+        ]
+    bits = table["ghs"][passing("ghs")]
+    counts = ((bits[:, None] >> np.arange(len(GHS_CODES), dtype=np.uint16)) & 1).sum(axis=0)
+    facets["ghs"] = [
+        {"value": code, "name": GHS_NAMES.get(code, code), "count": int(count)}
+        for code, count in zip(GHS_CODES, counts)
+    ]
+    mw = table["mw"][passing("mw")]
+    lo, hi = mw_range
+    counts, edges = np.histogram(mw[~np.isnan(mw)], bins=MW_HISTOGRAM_BINS, range=(lo, max(hi, lo + 1)))
+    facets["mw"] = {"edges": edges.round(2).tolist(), "counts": counts.tolist()}
+    return facets
+
+
+def _table_facets(table: dict, mw_range: tuple) -> dict:
+    """Facet counts of a results table without filters (computed once per table)."""
+    with table["lock"]:
+        if table["facets"] is None:
+            table["facets"] = _facet_counts(table, {}, mw_range)
+        return table["facets"]
+
+
+def _view_table(view: dict, grouped: bool) -> dict:
+    """The individual or the CAS-grouped results table of a view."""
+    if not grouped:
+        return view["individual"]
+    with view["lock"]:
+        if view["grouped"] is None:
+            view["grouped"] = _results_table(_grouped_rows(view))
+        return view["grouped"]
+
+
+def _sort_ranks(table: dict, col: str) -> np.ndarray:
+    """Dense rank of every row by one column (equal values share a rank)."""
+    with table["lock"]:
+        ranks = table["ranks"].get(col)
+        if ranks is None:
+            rows = table["rows"]
+            if col in ("MW", "CID"):
+                values = [_float_or_nan(_cell_text(row, col)) for row in rows]
+                # NaN sorts last
+                keys = [(v != v, 0.0 if v != v else v) for v in values]
+            else:
+                keys = [_cell_text(row, col).casefold() for row in rows]
+            order = sorted(range(len(rows)), key=keys.__getitem__)
+            ranks = np.empty(len(rows), dtype=np.int64)
+            rank, previous = -1, object()
+            for i in order:
+                if keys[i] != previous:
+                    rank += 1
+                    previous = keys[i]
+                ranks[i] = rank
+            table["ranks"][col] = ranks
+        return ranks
+
 
-    latest_path = get_latest_snapshot()
-    if latest_path:
-        latest_snapshot = {
-            "name": latest_path.name,
-            "path": latest_path,
-            "timestamp": datetime.fromtimestamp(latest_path.stat().st_mtime),
-            "size": latest_path.stat().st_size,
-        }
-        # Imported databases use source_hash="imported" — treat as valid
-        if cache and cache.get("source_hash") == "imported":
-            cache_valid = True
-        else:
-            cache_valid, _ = is_cid_cache_valid(latest_path)
+_RESULTS_VIEW_LIMIT = 4  # filters kept in memory for /api/results/<id>/rows
+_results_views: dict[tuple, dict] = {}
+_results_views_lock = threading.Lock()
 
-    results_list = []
-    if cache and "results" in cache:
-        results_list = list(cache["results"].items())
 
-    # Get no-match entries from RUG table
-    no_match_rows = []
-    rug_table = load_rug_table()
-    if rug_table:
-        for row in rug_table.get("rows", []):
-            cid_val = row.get("CID")
-            if cid_val is None or (isinstance(cid_val, float) and cid_val != cid_val):  # None or NaN
-                no_match_rows.append(row)
+def _data_stamp() -> tuple:
+    """Versions of the data files a results view is built from."""
+    return json_file_version(RUG_TABLE_FILE), json_file_version(COMPOUND_INFO_FILE)
 
-    return render("setup",
-        title="Setup",
-        active_page="setup",
-        snapshot_count=len(snapshots),
-        snapshots=snapshots,
-        cache_stats=cache.get("stats") if cache else None,
-        cache_created=cache.get("created", "")[:19] if cache else None,
-        latest_snapshot=latest_snapshot,
-        cache_valid=cache_valid,
-        setup_complete=is_setup_complete(),
-        results=results_list,
-        no_match_rows=no_match_rows,
-        no_match_count=len(no_match_rows),
-    )
 
+def _results_view(filter_id, rug_table=None, filter_results=None, fallback: bool = True) -> dict | None:
+    """
+    Rows of one filter with their search and sort indexes.
+
+    Cached per filter and data version, so paging, sorting and searching a
+    large filter does not reload the RUG table or rebuild its rows.
 
-# Legacy routes - redirect to new structure
-@app.route("/snapshots")
-def snapshots():
-    return redirect(url_for("setup"))
+    Returns:
+        {"filter", "rows", "individual", "grouped" (built on first use),
+         "rug_version", "mw_range"}, or None if there is no such filter
+    """
+    stamp = _data_stamp()
+    if filter_id:
+        with _results_views_lock:
+            view = _results_views.get((filter_id, stamp))
+        if view is not None:
+            return view
+
+    if filter_results is None:
+        filter_results = load_filter_results()
+    if rug_table is None:
+        rug_table = load_rug_table()
+    if not rug_table or not filter_results:
+        return None
+    current_filter, matching = _resolve_filter(filter_id, rug_table, filter_results, fallback)
+    if current_filter is None:
+        return None
+    compound_info = load_compound_info().get("compounds", {})
+
+    filtered_rows = []
+    for row, cid_int in _rows_in_cid_set(rug_table.get("rows", []), matching):
+        # Enrich a copy: the loaded table is shared (see read_json_file)
+        row = dict(row)
+        row["_cid_int"] = cid_int
+        row["_ci"] = compound_info.get(str(cid_int), {})
+
+        # Repair status is already on the row if it was repaired
+        if not row.get("_repair_status"):
+            row["_repair_status"] = "original"
+
+        filtered_rows.append(row)
+
+    individual = _results_table(filtered_rows)
+    mw = individual["mw"][~np.isnan(individual["mw"])]
+    view = {
+        "filter": current_filter,
+        "rows": filtered_rows,
+        "individual": individual,
+        "grouped": None,
+        "lock": threading.Lock(),  # guards building "grouped"
+        "rug_version": stamp[0],
+        "mw_range": (float(np.floor(mw.min())), float(np.ceil(mw.max()))) if len(mw) else (0.0, 1000.0),
+    }
+    with _results_views_lock:
+        for key in [k for k in _results_views if k[0] == current_filter["id"] or k[1] != stamp]:
+            del _results_views[key]
+        while len(_results_views) >= _RESULTS_VIEW_LIMIT:
+            del _results_views[next(iter(_results_views))]
+        _results_views[(current_filter["id"], stamp)] = view
+    return view
 
 
 @app.route("/results")
 def results_page():
-    """Results page showing filtered RUG table with enriched compound info."""
+    """Results page; the table rows are loaded page by page from results_rows_api."""
     filter_id = request.args.get("filter_id")
     rug_table = load_rug_table()
     filter_results = load_filter_results()
-    compound_info = load_compound_info().get("compounds", {})
 
+    view = _results_view(filter_id, rug_table, filter_results) if rug_table else None
     current_filter = None
-    filtered_rows = []
-
-    if rug_table and filter_results:
-        # Handle "All Chemicals" synthetic filter
-        if filter_id == "all":
-            # Create synthetic "All Chemicals" filter
-            all_cids = []
-            for row in rug_table.get("rows", []):
-                cid_val = row.get("CID")
-                if cid_val is not None:
-                    try:
-                        all_cids.append(int(cid_val))
-                    except (TypeError, ValueError):
-                        pass
-
-            cache_key = upload_cids_to_pubchem_cache([str(c) for c in all_cids])
-            pubchem_url = f"https://pubchem.ncbi.nlm.nih.gov/#query={cache_key}" if cache_key else ""
-
-            current_filter = {
-                "id": "all",
-                "search_name": "All Chemicals",
-                "operation": "None",
-                "matching_cids": all_cids,
-                "match_count": len(all_cids),
-                "created": "",
-                "pubchem_url": pubchem_url
-            }
-        else:
-            # Existing filter logic
-            if filter_id:
-                current_filter = next((f for f in filter_results if f["id"] == filter_id), None)
-            if not current_filter and filter_results:
-                current_filter = filter_results[0]
-
-        if current_filter:
-            matching_cid_set = set(current_filter.get("matching_cids", []))
-            for row in rug_table.get("rows", []):
-                cid_val = row.get("CID")
-                if cid_val is None:
-                    continue
-                try:
-                    cid_int = int(cid_val)
-                except (TypeError, ValueError):
-                    continue
-                if cid_int in matching_cid_set:
-                    # Enrich row with compound info and helper
-                    row["_cid_int"] = cid_int
-                    row["_ci"] = compound_info.get(str(cid_int), {})
-
-                    # Repair status is already on the row if it was repaired
-                    if not row.get("_repair_status"):
-                        row["_repair_status"] = "original"
-
-                    filtered_rows.append(row)
-
-    # Build grouped rows (group by CAS number)
-    from collections import OrderedDict
-    identity_cols = {'Structure', 'Name', 'CAS', 'Formula', 'MW', 'Hazards', 'SMILES', 'IUPAC', 'CID'}
-    varying_cols = ['GROSname', 'Pot', 'Location', 'Owner', 'OwnerRegNumber']
-    cas_groups = OrderedDict()
-    for row in filtered_rows:
-        cas = row.get('Casnr', '') or ''
-        cas_groups.setdefault(cas, []).append(row)
-    grouped_rows = []
-    for cas, group in cas_groups.items():
-        rep = dict(group[0])  # copy representative row
-        rep['_group_count'] = len(group)
-        varying = {}
-        for vc in varying_cols:
-            unique_vals = list(OrderedDict.fromkeys(
-                r.get(vc, '') or '-' for r in group
-            ))
-            if len(unique_vals) > 1:
-                varying[vc] = unique_vals
-        rep['_group_varying'] = varying
-        grouped_rows.append(rep)
-
-    # Determine visible columns from defaults (JS will override via localStorage)
-    visible_columns = list(DEFAULT_RESULTS_COLUMNS)
-
-    # Collect unique locations for the filter dropdown
-    unique_locations = sorted(set(
-        row.get("Location", "").strip()
-        for row in filtered_rows
-        if row.get("Location", "").strip()
-    ))
+    if view:
+        # The cached view may predate a save/unsave of this filter
+        current_filter = next(
+            (f for f in filter_results if f["id"] == view["filter"]["id"]), view["filter"]
+        )
 
-    return render("results",
+    return render("results.html",
         title="Results",
         active_page="results",
         rug_table=rug_table,
         filter_results=filter_results,
         current_filter=current_filter,
-        filtered_rows=filtered_rows,
-        grouped_rows=grouped_rows,
+        row_count=len(view["rows"]) if view else 0,
         all_columns=ALL_RESULTS_COLUMNS,
         default_columns=DEFAULT_RESULTS_COLUMNS,
-        visible_columns=visible_columns,
         ghs_names=GHS_NAMES,
-        unique_locations=unique_locations,
+        facets=_table_facets(view["individual"], view["mw_range"]) if view else None,
+        mw_range=view["mw_range"] if view else (0.0, 1000.0),
+        similarity_available=has_rdkit(),
+    )
+
+
+@app.route("/api/results/<filter_id>/rows")
+def results_rows_api(filter_id):
+    """
+    DataTables server-side processing for the results table.
+
+    Takes the standard DataTables parameters (draw, start, length,
+    search[value], order[i][column] / order[i][dir]) plus grouped=1 for one
+    row per CAS number and the property filters of _filter_masks. Cells are
+    rendered to HTML here.
+    """
+    view = _results_view(filter_id, fallback=False)
+    if view is None:
+        return jsonify({"error": "Filter not found"}), 404
+    args = request.args
+
+    table = _view_table(view, args.get("grouped") == "1")
+    n = len(table["rows"])
+
+    mask = np.ones(n, dtype=bool)
+    for facet_mask in _filter_masks(table, args, args.get("search[value]", "")).values():
+        mask &= facet_mask
+
+    # Multi-column sort: lexsort takes the primary key last
+    keys = []
+    i = 0
+    while f"order[{i}][column]" in args:
+        col_idx = args.get(f"order[{i}][column]", type=int)
+        if col_idx is not None and 0 <= col_idx < len(ALL_RESULTS_COLUMNS):
+            ranks = _sort_ranks(table, ALL_RESULTS_COLUMNS[col_idx])
+            keys.append(-ranks if args.get(f"order[{i}][dir]") == "desc" else ranks)
+        i += 1
+    order = np.lexsort(keys[::-1]) if keys else np.arange(n)
+    hits = order[mask[order]]
+
+    start = max(args.get("start", 0, type=int), 0)
+    length = args.get("length", 25, type=int)
+    page = hits[start:] if length < 0 else hits[start:start + length]
+
+    cells = app.jinja_env.get_template("result_cells.html").make_module(
+        {"ghs_names": GHS_NAMES, "similarity_available": has_rdkit()}
     )
+    grouped = table is view["grouped"]
+    return jsonify({
+        "draw": args.get("draw", 0, type=int),
+        "recordsTotal": n,
+        "recordsFiltered": len(hits),
+        "data": [
+            [str(cells.render_cell(table["rows"][i], col, grouped)).strip() for col in ALL_RESULTS_COLUMNS]
+            for i in page
+        ],
+    })
+
+
+@app.route("/api/results/<filter_id>/facets")
+def results_facets_api(filter_id):
+    """
+    Facet counts (Location, Owner, GHS pictogram, MW histogram) of a filter.
+
+    Takes the same filters as results_rows_api (grouped, mw_lo / mw_hi,
+    formula, location, owner, ghs) with the table search as search=.
+    Without filters the precomputed counts are returned.
+    """
+    view = _results_view(filter_id, fallback=False)
+    if view is None:
+        return jsonify({"error": "Filter not found"}), 404
+    table = _view_table(view, request.args.get("grouped") == "1")
+    masks = _filter_masks(table, request.args, request.args.get("search", ""))
+    if not masks:
+        return jsonify(_table_facets(table, view["mw_range"]))
+    return jsonify(_facet_counts(table, masks, view["mw_range"]))
 
 
 @app.route("/combine")
@@ -3075,8 +2154,9 @@ def run_extraction():
         except Exception as e:
             return jsonify({"error": str(e)})
 
-    # Kick off background compound info fetch (force re-fetch on re-lookup)
-    start_compound_info_fetch(force=refresh_cids)
+    # Kick off background compound info fetch (new CIDs only; stale entries
+    # are picked up by the refresh scheduler)
+    start_compound_info_fetch()
 
     return jsonify({"redirect": url_for("setup")})
 
@@ -3178,8 +2258,8 @@ def open_pubchem():
     if not cids:
         return jsonify({"error": "No CIDs found"})
 
-    # Try to upload to PubChem cache
-    cache_key = upload_cids_to_pubchem_cache(cids)
+    # Reuse the inventory's PubChem cache key, uploading only if needed
+    cache_key = get_inventory_cache_key(cids)
 
     if cache_key:
         url = f"https://pubchem.ncbi.nlm.nih.gov/#query={cache_key}"
@@ -3202,6 +2282,90 @@ def _lookup_search_name(cache_key: str) -> str:
     return "Unknown search"
 
 
+def _stale_search_response(user_key: str):
+    search_name = _lookup_search_name(user_key)
+    return jsonify({
+        "error": "stale_search",
+        "cache_key": user_key,
+        "search_name": search_name,
+        "message": f"The search '{search_name}' is no longer available on PubChem (expired after ~12 hours).",
+    })
+
+
+def _fetch_inventory_overlap(user_key: str, cids: list[str]):
+    """CIDs of a PubChem search that are also in the inventory, or None.
+
+    Pushes the intersection down to SDQ using the inventory's cache key, so
+    only the overlap is downloaded. SDQ also answers an empty list when
+    either key has expired, so an empty overlap is only trusted once both
+    keys are known to be alive (search_key_alive, one CID each): an expired
+    inventory key is re-uploaded and the intersection retried, an expired
+    search returns None, and if either check fails the search is downloaded
+    in full (get_search_cids), which settles it.
+
+    Returns None if the search could not be downloaded (e.g. it expired) or
+    the inventory could not be uploaded; callers then fall back to the full
+    download / remote combine, which report an expired search.
+    """
+    our_key = get_inventory_cache_key(cids)
+    if not our_key:
+        return None
+    overlap = fetch_cids_from_listkey(user_key, intersect_key=our_key)
+    if overlap is None or len(overlap):
+        return overlap
+
+    our_alive = search_key_alive(our_key)
+    if our_alive is False:
+        # Our stored inventory key expired early - re-upload and retry once
+        invalidate_inventory_cache_key()
+        our_key = get_inventory_cache_key(cids, force_refresh=True)
+        if not our_key:
+            return None
+        overlap = fetch_cids_from_listkey(user_key, intersect_key=our_key)
+        if overlap is None or len(overlap):
+            return overlap
+        our_alive = True  # just uploaded
+
+    user_alive = search_key_alive(user_key)
+    if user_alive is False:
+        return None
+    if user_alive and our_alive:
+        return overlap  # really no overlap
+
+    user_cids = get_search_cids(user_key)
+    if user_cids is None:
+        return None
+    return combine_cid_sets(cids, user_cids, "AND")
+
+
+def _combine_remote(user_key: str, cids: list[str], operation: str):
+    """Combine on PubChem (list_refinement) and download the result.
+
+    Fallback for when the user's search cannot be downloaded directly.
+    Returns (matching_cids, pubchem_url), or None if PubChem rejected the search.
+    """
+    our_key = get_inventory_cache_key(cids)
+    if not our_key:
+        return None
+    combine_result = combine_pubchem_cache_keys(user_key, our_key, operation)
+    if not combine_result:
+        # Our stored key may have expired early - retry once with a fresh upload
+        our_key = get_inventory_cache_key(cids, force_refresh=True)
+        if our_key:
+            combine_result = combine_pubchem_cache_keys(user_key, our_key, operation)
+    if not combine_result:
+        return None
+
+    combined_key, list_size = combine_result
+    if not list_size:
+        return [], ""
+    matching_cids = fetch_cids_from_listkey(combined_key)
+    if matching_cids is None:
+        return None
+    save_app_search(combined_key)
+    return matching_cids, f"https://pubchem.ncbi.nlm.nih.gov/#query={combined_key}"
+
+
 @app.route("/api/combine-pubchem/<operation>", methods=["POST"])
 def combine_pubchem(operation):
     """Combine our CIDs with a selected PubChem search."""
@@ -3227,118 +2391,341 @@ def combine_pubchem(operation):
     if not cids:
         return jsonify({"error": "No CIDs found in results."})
 
-    # Upload our CIDs to PubChem cache
-    our_key = upload_cids_to_pubchem_cache(cids)
-    if not our_key:
-        return jsonify({"error": "Failed to upload CIDs to PubChem cache."})
+    # Local first: download the search's CIDs once and combine here. The
+    # PubChem cache key for the result is only created if the user opens it
+    # on PubChem (see open_filter_in_pubchem).
+    matching_cids = None
+    pubchem_url = ""
+    pushed_down = False
+    cached = get_cached_cid_set(user_key)
+    if cached is None and is_local_search_key(user_key):
+        # Only ever existed locally and has been evicted since
+        return _stale_search_response(user_key)
+    if cached is not None:
+        # Downloaded earlier - works even after PubChem expired the key
+        matching_cids = combine_cid_sets(cids, cached, operation)
+        logger.info("Combined with cached search: %d results for %s", len(matching_cids), operation)
+    elif operation in ("AND", "NOT"):
+        # Only the overlap with our inventory matters - let SDQ intersect
+        overlap = _fetch_inventory_overlap(user_key, cids)
+        pushed_down = True
+        if overlap is not None:
+            matching_cids = combine_cid_sets(cids, overlap, operation)
+            logger.info("Combined via SDQ intersection: %d results for %s", len(matching_cids), operation)
+            # Keep the full set locally for later combines
+            queue_cid_set_downloads([user_key])
+
+    if matching_cids is None:
+        user_cids = get_search_cids(user_key)
+        if user_cids is not None:
+            if pushed_down:
+                # The search is fine, so our stored inventory key must be stale
+                invalidate_inventory_cache_key()
+            matching_cids = combine_cid_sets(cids, user_cids, operation)
+            logger.info("Combined locally: %d results for %s", len(matching_cids), operation)
+        else:
+            logger.info("Could not download search CIDs, combining on PubChem instead...")
+            remote = _combine_remote(user_key, cids, operation)
+            if remote is None:
+                return _stale_search_response(user_key)
+            matching_cids, pubchem_url = remote
 
-    # Combine the two cache keys
-    combine_result = combine_pubchem_cache_keys(user_key, our_key, operation)
+    if not len(matching_cids):
+        logger.info("Combine succeeded but found 0 matching compounds")
+
+    search_name = _lookup_search_name(user_key)
+    filter_id = save_filter_result(search_name, operation, matching_cids, pubchem_url)
+    return jsonify({
+        "pubchem_url": pubchem_url,
+        "filter_id": filter_id,
+        "match_count": len(matching_cids),
+    })
 
-    combined_key = None
-    list_size = None
-    local_matching_cids = None  # Set if we computed results locally
 
-    if combine_result:
-        combined_key, list_size = combine_result
+@app.route("/filter/<filter_id>/pubchem")
+def open_filter_in_pubchem(filter_id):
+    """Open a filter result on PubChem, uploading its CIDs on first use."""
+    if filter_id == "all":
+        cache_key = get_inventory_cache_key(_inventory_cids())
     else:
-        # Combine API failed - try fallback: fetch both CID lists and compute locally
-        logger.info("Combine API failed, trying local fallback...")
+        current = next((f for f in load_filter_results() if f["id"] == filter_id), None)
+        if current is None:
+            return "Filter not found", 404
+        url = current.get("pubchem_url")
+        created = current.get("pubchem_url_created") or current.get("created")
+        try:
+            age = (datetime.now() - datetime.fromisoformat(created)).total_seconds()
+        except (TypeError, ValueError):
+            age = PUBCHEM_CACHE_KEY_TTL
+        if url and age < PUBCHEM_CACHE_KEY_TTL:
+            return redirect(url)
+        matching = get_filter_cids(current)
+        if not len(matching):
+            return redirect(url_for("results_page", filter_id=filter_id))
+        cache_key = upload_cids_to_pubchem_cache([str(c) for c in matching.tolist()])
+        if cache_key:
+            save_app_search(cache_key)
+            set_filter_pubchem_url(filter_id, f"https://pubchem.ncbi.nlm.nih.gov/#query={cache_key}")
 
-        user_cids = fetch_cids_from_listkey(user_key)
-        if user_cids is None:
-            # User search is stale/expired
-            search_name = _lookup_search_name(user_key)
-            return jsonify({
-                "error": "stale_search",
-                "cache_key": user_key,
-                "search_name": search_name,
-                "message": f"The search '{search_name}' is no longer available on PubChem (expired after ~12 hours).",
-            })
+    if not cache_key:
+        return "Could not upload the results to PubChem. Check your internet connection and try again.", 502
+    return redirect(f"https://pubchem.ncbi.nlm.nih.gov/#query={cache_key}")
+
+
+# local: search key -> (PubChem cache key, upload time)
+_local_search_uploads: dict[str, tuple[str, float]] = {}
+
+
+@app.route("/search/<path:cache_key>/pubchem")
+def open_search_in_pubchem(cache_key):
+    """Open a search on PubChem, uploading a local search's CIDs on first use."""
+    if not is_local_search_key(cache_key):
+        return redirect(f"https://pubchem.ncbi.nlm.nih.gov/#query={cache_key}")
+    uploaded = _local_search_uploads.get(cache_key)
+    if uploaded and time.time() - uploaded[1] < PUBCHEM_CACHE_KEY_TTL:
+        return redirect(f"https://pubchem.ncbi.nlm.nih.gov/#query={uploaded[0]}")
+    cids = get_cached_cid_set(cache_key)
+    if cids is None:
+        return "This search is no longer stored locally. Please run it again.", 404
+    if not len(cids):
+        return "This search found no compounds, so there is nothing to open on PubChem.", 404
+    remote_key = upload_cids_to_pubchem_cache([str(c) for c in cids.tolist()])
+    if not remote_key:
+        return "Could not upload the search to PubChem. Check your internet connection and try again.", 502
+    save_app_search(remote_key)  # the upload is not a new search, keep it out of history
+    _local_search_uploads[cache_key] = (remote_key, time.time())
+    return redirect(f"https://pubchem.ncbi.nlm.nih.gov/#query={remote_key}")
+
+
+def _known_searches() -> list[dict]:
+    """PubChem searches from browser history and the app, newest first."""
+    searches = [
+        {"cachekey": e["cachekey"], "name": e["name"], "list_size": e.get("list_size"),
+         "timestamp": e.get("timestamp") or ""}
+        for e in get_pubchem_history_details()
+    ]
+    for cache_key, meta in load_app_search_metadata().items():
+        searches.append({"cachekey": cache_key, "name": meta.get("query", ""),
+                         "list_size": meta.get("count"), "timestamp": meta.get("timestamp", "")})
+    searches.sort(key=lambda x: x["timestamp"], reverse=True)
+    return searches
+
+
+def _query_resolver(rug_table: dict, compounds: dict, inventory: np.ndarray):
+    """Build the (resolve, estimate) callbacks run_query() uses for operands."""
+    filters = {f["id"]: f for f in load_filter_results()}
+    inventory_strs = [str(c) for c in inventory.tolist()]
+    searches = None
+    local_sets: dict[tuple, np.ndarray] = {}
+
+    def search_info(cache_key):
+        nonlocal searches
+        if searches is None:
+            searches = _known_searches()
+        return next((s for s in searches if s["cachekey"] == cache_key), None)
+
+    def by_name(name):
+        nonlocal searches
+        if searches is None:
+            searches = _known_searches()
+        wanted = name.strip().lower()
+        for entry in searches:
+            if entry["name"].strip().lower() == wanted:
+                return "search", entry["cachekey"]
+        for f in filters.values():
+            if f.get("search_name", "").strip().lower() == wanted:
+                return "filter", f["id"]
+        raise ValueError(f'No search or filter named "{name}"')
+
+    def resolve(kind, value):
+        if kind == "name":
+            kind, value = by_name(value)
+        if kind == "filter":
+            if value not in filters:
+                raise ValueError(f"Filter '{value}' not found")
+            return get_filter_cids(filters[value])
+        if kind == "search":
+            cids = get_cached_cid_set(value)
+            if cids is None and not is_local_search_key(value):
+                cids = _fetch_inventory_overlap(value, inventory_strs)
+                if cids is not None:
+                    queue_cid_set_downloads([value])
+            if cids is None:
+                cids = get_search_cids(value)
+            if cids is None:
+                name = (search_info(value) or {}).get("name") or value[:20]
+                raise ValueError(f"The search '{name}' is no longer available on PubChem (expired after ~12 hours).")
+            return cid_array(cids)
+        if kind in QUERY_LOCAL_KINDS:
+            if (kind, value) not in local_sets:
+                local_sets[(kind, value)] = evaluate_predicate(kind, value, rug_table.get("rows", []), compounds)
+            return local_sets[(kind, value)]
+        raise ValueError(f"Unknown operand type '{kind}'")
+
+    def estimate(kind, value):
+        if kind == "name":
+            kind, value = by_name(value)
+        if kind == "filter":
+            return filters.get(value, {}).get("match_count", 0)
+        if kind == "search":
+            # Remote: unknown sizes go last so cheap operands can short-circuit
+            size = (search_info(value) or {}).get("list_size")
+            return int(size) if str(size or "").isdigit() else len(inventory) + 1
+        return len(resolve(kind, value))
+
+    return resolve, estimate
+
+
+@app.route("/api/query", methods=["POST"])
+def query_api():
+    """Evaluate a boolean query expression and save the result as a filter."""
+    text = ((request.get_json(silent=True) or {}).get("query") or "").strip()
+    try:
+        node = parse_query(text)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {e}"})
 
-        # Compute the operation locally
-        our_cid_set = set(int(c) for c in cids)
-        user_cid_set = set(user_cids)
+    rug_table = load_rug_table()
+    inventory = cid_array(_inventory_cids())
+    if not rug_table or not len(inventory):
+        return jsonify({"error": "No CID results found. Complete setup first."})
 
-        if operation == "AND":
-            result_cids = our_cid_set & user_cid_set
-        elif operation == "OR":
-            result_cids = our_cid_set | user_cid_set
-        elif operation == "NOT":
-            result_cids = our_cid_set - user_cid_set
-        else:
-            result_cids = set()
+    resolve, estimate = _query_resolver(
+        rug_table, load_compound_info().get("compounds", {}), inventory
+    )
+    try:
+        cids, plan = run_query(node, inventory, resolve, estimate)
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+    for step in plan:
+        logger.info("query: %s", step)
 
-        list_size = len(result_cids)
-        local_matching_cids = list(result_cids)  # Save for later use
-        logger.info("Local fallback computed %d results for %s operation", list_size, operation)
+    filter_id = save_filter_result(text, "QUERY", cids)
+    return jsonify({"filter_id": filter_id, "match_count": len(cids), "plan": plan})
 
-        if list_size > 0:
-            # Upload result CIDs to get a cache key
-            combined_key = upload_cids_to_pubchem_cache([str(c) for c in result_cids])
-            if not combined_key:
-                return jsonify({"error": "Failed to upload combined results to PubChem."})
-        else:
-            # 0 results - we'll handle this below
-            combined_key = None
 
-    # Handle the case where combine found 0 results (from API or local fallback)
-    if list_size == 0 or combined_key is None:
-        logger.info("Combine succeeded but found 0 matching compounds")
-        # Look up search name for the message
-        search_name = _lookup_search_name(user_key)
+def _similarity_index():
+    """(structure index, compound info), or (None, error response) without RDKit."""
+    compounds = load_compound_info().get("compounds", {})
+    index = get_structure_index(_inventory_cids(), compounds)
+    if index is None:
+        return None, (jsonify({"error": "Similarity search needs RDKit (pip install rdkit)."}), 501)
+    return index, compounds
 
-        # Save empty filter result so user can see it was attempted
-        filter_id = save_filter_result(search_name, operation, [], "")
-        return jsonify({
-            "pubchem_url": "",
-            "filter_id": filter_id,
-            "match_count": 0,
-        })
 
-    # Record this combined key as app-generated
-    save_app_search(combined_key)
+def _formula_search_cids(query: str) -> np.ndarray:
+    """Inventory CIDs matching a formula query (raises ValueError)."""
+    rows = (load_rug_table() or {}).get("rows", [])
+    compounds = load_compound_info().get("compounds", {})
+    return formula_query_cids(query, rows, compounds)
 
-    url = f"https://pubchem.ncbi.nlm.nih.gov/#query={combined_key}"
-    result = {"pubchem_url": url}
 
-    # Get the matching CIDs - use local results if available, otherwise fetch
-    if local_matching_cids is not None:
-        matching_cids = local_matching_cids
-        logger.info("Using locally computed %d CIDs", len(matching_cids))
-    else:
-        logger.info("Fetching CIDs from combined listkey")
-        matching_cids = fetch_cids_from_listkey(combined_key)
-
-        if matching_cids is None:
-            # Fetch failed - check if user search is stale
-            logger.warning("CID fetch failed, checking if user search is stale...")
-
-            # Validate the user's original search
-            user_cids = fetch_cids_from_listkey(user_key)
-            if user_cids is None:
-                # User search is stale
-                search_name = _lookup_search_name(user_key)
-                return jsonify({
-                    "error": "stale_search",
-                    "cache_key": user_key,
-                    "search_name": search_name,
-                    "message": f"The search '{search_name}' is no longer available on PubChem (expired after ~12 hours)."
-                })
-
-            # Combined operation failed for other reason
-            return jsonify({
-                "error": "combine_failed",
-                "message": "Failed to combine searches in PubChem."
-            })
+def _name_search_data() -> tuple[list[dict], dict]:
+    """(RUG rows, compound info) for the local name index."""
+    rows = (load_rug_table() or {}).get("rows", [])
+    return rows, load_compound_info().get("compounds", {})
+
+
+@app.route("/api/name-search")
+def name_search_api():
+    """
+    Typo-tolerant name / CAS lookup over the inventory, best matches first.
+
+    ?q= is the query, ?limit= caps the number of compounds (default 20).
+    """
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "No query provided"}), 400
+    limit = min(request.args.get("limit", 20, type=int), 500)
+    rows, compounds = _name_search_data()
+    matches = local_name_search(query, get_name_index(rows, compounds), limit=limit)
+    return jsonify({"query": query, "count": len(matches), "matches": matches})
+
+
+@app.route("/api/formula-search")
+def formula_search_api():
+    """
+    Inventory compounds matching an element composition query.
+
+    ?q= takes conditions such as ``halogen``, ``Hg``, ``C=6 N=1 dbe>=4`` or
+    an exact formula (``C6H6``); see formula_query_mask.
+    """
+    query = request.args.get("q", "").strip()
+    try:
+        cids = _formula_search_cids(query)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"query": query, "count": len(cids), "cids": cids.tolist()})
+
+
+@app.route("/api/similar/<int:cid>")
+def similar_api(cid):
+    """The inventory compounds most similar to one we hold."""
+    index, compounds = _similarity_index()
+    if index is None:
+        return compounds
+    k = min(request.args.get("k", 20, type=int), 500)
+    try:
+        neighbours = similar_compounds(index, cid, k, request.args.get("min", 0.0, type=float))
+    except KeyError:
+        return jsonify({"error": f"No structure known for CID {cid}"}), 404
+    return jsonify({
+        "cid": cid,
+        "neighbours": [
+            {"cid": c, "similarity": round(sim, 4), "title": compounds.get(str(c), {}).get("title", "")}
+            for c, sim in neighbours
+        ],
+    })
+
+
+@app.route("/similar/<int:cid>", methods=["POST"])
+def similar_page(cid):
+    """Results-page action: save a compound and its nearest neighbours as a filter."""
+    index, compounds = _similarity_index()
+    if index is None:
+        return "Similarity search needs RDKit (pip install rdkit).", 501
+    k = min(request.values.get("k", 20, type=int), 500)
+    try:
+        neighbours = similar_compounds(index, cid, k, 0.3)
+    except KeyError:
+        return f"No structure known for CID {cid}.", 404
+    title = compounds.get(str(cid), {}).get("title") or f"CID {cid}"
+    filter_id = save_filter_result(f"Similar to {title}", "SIMILAR", [cid] + [c for c, _ in neighbours])
+    return redirect(url_for("results_page", filter_id=filter_id))
+
+
+@app.route("/api/duplicates")
+def duplicates_api():
+    """Near-duplicate pairs among a filter's compounds (or the whole inventory)."""
+    index, compounds = _similarity_index()
+    if index is None:
+        return compounds
+    threshold = min(max(request.args.get("threshold", 0.95, type=float), SIMILARITY_MIN_THRESHOLD), 1.0)
+    filter_id = request.args.get("filter_id", "all")
+    cids = None
+    if filter_id != "all":
+        current = next((f for f in load_filter_results() if f["id"] == filter_id), None)
+        if current is None:
+            return jsonify({"error": "Filter not found"}), 404
+        cids = get_filter_cids(current)
+    start = time.time()
+    try:
+        pairs, compared = find_near_duplicates(index, threshold, cids)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    logger.info("Near-duplicates: %d pairs among %d compounds in %.2fs", len(pairs), compared, time.time() - start)
 
-    if matching_cids:
-        # Look up search name from history or app searches
-        search_name = _lookup_search_name(user_key)
-        filter_id = save_filter_result(search_name, operation, matching_cids, url)
-        result["filter_id"] = filter_id
+    def title(c):
+        return compounds.get(str(c), {}).get("title", "")
 
-    return jsonify(result)
+    return jsonify({
+        "threshold": threshold,
+        "compared": compared,
+        "pairs": [
+            {"a": a, "b": b, "similarity": round(sim, 4), "a_title": title(a), "b_title": title(b)}
+            for a, b, sim in pairs
+        ],
+    })
 
 
 @app.route("/api/compound-info-status")
@@ -3348,12 +2735,86 @@ def compound_info_status():
     total = s["total"]
     fetched = s["fetched"]
     progress = f"{fetched}/{total}" if total else ""
-    return jsonify({"status": s["status"], "progress": progress})
+    r = _refresh_status
+    return jsonify({
+        "status": s["status"],
+        "phase": s["phase"],
+        "progress": progress,
+        "refresh": {
+            "status": r["status"],
+            "progress": f"{r['refreshed']}/{r['total']}" if r["total"] else "",
+            "last_run": r["last_run"],
+            "budget": _refresh_budget,
+            "max_age_days": COMPOUND_INFO_MAX_AGE_DAYS,
+        },
+        "images": {
+            "status": _image_prefetch_status["status"],
+            "progress": f"{_image_prefetch_status['fetched']}/{_image_prefetch_status['total']}"
+            if _image_prefetch_status["total"] else "",
+        },
+    })
+
+
+# Images are keyed by CID / pictogram code and never change, so the browser
+# may cache them for good.
+IMAGE_MAX_AGE = 365 * 24 * 3600
+
+
+def _immutable(resp):
+    resp.headers["Cache-Control"] = f"public, max-age={IMAGE_MAX_AGE}, immutable"
+    return resp
+
+
+@app.route("/img/<int:cid>")
+def structure_image(cid):
+    """Structure depiction from the local image cache (t=s thumbnail, t=l large)."""
+    size = "l" if request.args.get("t") == "l" else "s"
+    path = get_structure_image(cid, size)
+    if path is None:
+        # Offline or PubChem error: let the browser try PubChem directly
+        return redirect(structure_image_url(cid, size))
+    return _immutable(send_file(path, mimetype="image/png"))
+
+
+@app.route("/img/ghs/<code>.svg")
+def ghs_pictogram(code):
+    """GHS hazard pictogram (bundled SVG, cached copy, or fetched once)."""
+    if code == "sprite":
+        sprite, complete = build_ghs_sprite()
+        resp = Response(sprite, mimetype="image/svg+xml")
+        return _immutable(resp) if complete else resp
+    if code not in GHS_CODES:
+        return "Unknown pictogram", 404
+    path = get_ghs_pictogram(code)
+    if path is None:
+        return redirect(f"https://pubchem.ncbi.nlm.nih.gov/images/ghs/{code}.svg")
+    return _immutable(send_file(path, mimetype="image/svg+xml"))
+
+
+@app.route("/api/ingest-extracts", methods=["POST"])
+def ingest_extracts():
+    """Fill compound info from PubChem extract files in a local directory."""
+    raw = ((request.get_json(silent=True) or {}).get("directory") or "").strip()
+    if not raw:
+        return jsonify({"error": "Enter the directory that holds the extract files"})
+    directory = Path(raw)
+    if not directory.is_dir():
+        return jsonify({"error": f"Directory not found: {directory}"})
+    if not find_extract_files(directory):
+        return jsonify({"error": "No CID-Title, CID-SMILES, CID-IUPAC or CID-Mass files in that directory"})
+    if not start_extract_ingest(directory):
+        return jsonify({"error": "Compound info is already being fetched, try again later"})
+    return jsonify({"success": True})
 
 
 @app.route("/api/filter-results/<filter_id>/table")
 def filter_results_table(filter_id):
     """JSON endpoint returning the filtered table data."""
+    etag = _versions_etag(json_file_version(RUG_TABLE_FILE), json_file_version(FILTER_RESULTS_FILE))
+    cached = _not_modified(etag)
+    if cached is not None:
+        return cached
+
     rug_table = load_rug_table()
     if not rug_table:
         return jsonify({"error": "RUG table not loaded"}), 404
@@ -3363,18 +2824,14 @@ def filter_results_table(filter_id):
     if not current:
         return jsonify({"error": "Filter not found"}), 404
 
-    matching_cid_set = set(current.get("matching_cids", []))
     columns = rug_table.get("columns", [])
-    rows = [
-        row for row in rug_table.get("rows", [])
-        if row.get("CID") is not None and int(row["CID"]) in matching_cid_set
-    ]
+    rows = [row for row, _ in _rows_in_cid_set(rug_table.get("rows", []), get_filter_cids(current))]
 
-    return jsonify({
+    return _with_etag(jsonify({
         "rows": rows,
         "columns": columns,
-        "filter": {k: v for k, v in current.items() if k != "matching_cids"},
-    })
+        "filter": {k: v for k, v in current.items() if k not in ("cids", "matching_cids")},
+    }), etag)
 
 
 @app.route("/api/pubchem-history/check")
@@ -3387,11 +2844,47 @@ def pubchem_history_check():
     return jsonify({"fingerprint": get_history_fingerprint()})
 
 
+# (ETag, cache keys) of the last full history response, so a 304 still
+# queues the same downloads
+_history_download_keys: tuple[str | None, list[str]] = (None, [])
+
+DEFAULT_BROWSER_TTL = 60  # seconds; looking it up spawns subprocesses
+_default_browser: tuple[float, str | None] = (float("-inf"), None)  # (checked, name)
+
+
+def _cached_default_browser() -> str | None:
+    """get_default_browser(), re-checked at most every DEFAULT_BROWSER_TTL seconds."""
+    global _default_browser
+    checked, browser = _default_browser
+    now = time.monotonic()
+    if now - checked >= DEFAULT_BROWSER_TTL:
+        browser = get_default_browser()
+        _default_browser = (now, browser)
+    return browser
+
+
 @app.route("/api/pubchem-history")
 def pubchem_history():
     """Get all PubChem search history."""
+    global _history_download_keys
+    # Default browser, browser storage mtimes and the app's own search
+    # lists; the history itself is re-read only when one of these changes
+    default_browser = _cached_default_browser()
+    etag = _versions_etag(
+        default_browser,
+        get_history_fingerprint(),
+        json_file_version(APP_SEARCHES_FILE),
+        json_file_version(STALE_SEARCHES_FILE),
+    )
+    last_etag, last_keys = _history_download_keys
+    if etag == last_etag:
+        # Queue on a 304 too; keys already held or pending are skipped
+        queue_cid_set_downloads(last_keys)
+        cached = _not_modified(etag)
+        if cached is not None:
+            return cached
+
     history = get_pubchem_history_details()
-    default_browser = get_default_browser()
     supported = default_browser is not None and default_browser in ("Chrome", "Firefox")
     warning = None
     if default_browser and not supported:
@@ -3417,7 +2910,9 @@ def pubchem_history():
                 "name": meta.get("query", "App search"),
                 "timestamp": meta.get("timestamp", ""),
                 "browser": "App",
-                "url": f"https://pubchem.ncbi.nlm.nih.gov/#query={cache_key}",
+                "url": url_for("open_search_in_pubchem", cache_key=cache_key)
+                if is_local_search_key(cache_key)
+                else f"https://pubchem.ncbi.nlm.nih.gov/#query={cache_key}",
                 "_list_size": meta.get("count"),
             })
 
@@ -3432,21 +2927,33 @@ def pubchem_history():
         if entry["cachekey"] not in excluded_searches
     ]
 
-    return jsonify({
+    # Download these searches in the background so they stay usable locally
+    # after PubChem expires their cache keys
+    download_keys = [entry["cachekey"] for entry in filtered_history]
+    queue_cid_set_downloads(download_keys)
+    _history_download_keys = (etag, download_keys)
+
+    return _with_etag(jsonify({
         "history": filtered_history,
         "all_history": history,  # Keep full list for toggle
         "count": len(filtered_history),
         "default_browser": default_browser,
         "browser_warning": warning,
         "app_search_count": len(history) - len(filtered_history),
-    })
+    }), etag)
+
 
+STRUCTURE_SEARCH_MODES = ("substructure", "superstructure", "similarity")
+SEARCH_JOB_TTL = 3600  # seconds a finished job stays queryable
 
-def _pubchem_structure_search(search_type: str, smiles: str, threshold: int = 90) -> dict | None:
+
+async def _pubchem_structure_search(search_type: str, smiles: str, threshold: int = 90) -> dict | None:
     """Execute a PubChem structure search via structure_search.cgi.
 
     Uses PubChem's internal structure_search.cgi endpoint which returns a
     cachekey directly, avoiding the unreliable PUG REST ListKey polling.
+    Runs on the search-job event loop and takes a slot from the shared
+    PubChem request budget.
 
     Args:
         search_type: One of 'substructure', 'superstructure', 'similarity'
@@ -3456,7 +2963,6 @@ def _pubchem_structure_search(search_type: str, smiles: str, threshold: int = 90
     Returns:
         Dict with 'cache_key' and 'count', or None if failed
     """
-    import json as _json
     from urllib.parse import quote
 
     parameters = [
@@ -3468,7 +2974,7 @@ def _pubchem_structure_search(search_type: str, smiles: str, threshold: int = 90
     if search_type == "similarity":
         parameters.append({"name": "Threshold", "num": threshold})
 
-    queryblob = _json.dumps({
+    queryblob = json.dumps({
         "query": {
             "type": search_type,
             "parameter": parameters,
@@ -3480,20 +2986,24 @@ def _pubchem_structure_search(search_type: str, smiles: str, threshold: int = 90
         f"?format=json&queryblob={quote(queryblob)}"
     )
 
+    await wait_for_pubchem_slot_async()
     logger.info("Submitting %s search via structure_search.cgi", search_type)
 
     try:
-        resp = _requests.get(url, timeout=60)
-    except _requests.RequestException as e:
-        logger.error("PubChem %s search failed: %s", search_type, e)
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=60)) as resp:
+                text = await resp.text()
+                status = resp.status
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error("PubChem %s search failed: %r", search_type, e)
         return None
 
-    if resp.status_code != 200:
-        logger.error("PubChem %s search HTTP %d: %s", search_type, resp.status_code, resp.text[:300])
+    if status != 200:
+        logger.error("PubChem %s search HTTP %d: %s", search_type, status, text[:300])
         return None
 
     try:
-        data = resp.json()
+        data = json.loads(text)
     except ValueError:
         logger.error("Invalid JSON from PubChem %s search", search_type)
         return None
@@ -3510,22 +3020,247 @@ def _pubchem_structure_search(search_type: str, smiles: str, threshold: int = 90
     return {"cache_key": cachekey, "count": hitcount}
 
 
+def _save_local_search(cids, search_label: str, operation: str) -> dict:
+    """Keep a search we hold every CID of under a local: key, combining it if asked.
+
+    We already hold the full CID list, so it is not uploaded back to
+    PubChem; the PubChem cache key is only created if the user opens the
+    search there (see open_search_in_pubchem).
+
+    Returns the /api/pubchem-search payload, without "url".
+    """
+    cids = cid_array(cids)
+    cache_key = local_search_key(cids)
+    store_cid_set(cache_key, cids)
+    save_app_search_with_metadata(cache_key, search_label, len(cids))
+    result = {
+        "success": True,
+        "cache_key": cache_key,
+        "query": search_label,
+        "count": len(cids),
+    }
+    if operation:
+        inventory = _inventory_cids()
+        if not inventory:
+            return {"error": "No CID results found. Complete setup first."}
+        matching_cids = combine_cid_sets(inventory, cids, operation)
+        result["filter_id"] = save_filter_result(search_label, operation, matching_cids)
+        result["match_count"] = len(matching_cids)
+    return result
+
+
+def _with_search_url(result: dict) -> dict:
+    """Add the "Open on PubChem" URL to a search payload (needs a request context)."""
+    cache_key = result.get("cache_key")
+    if cache_key:
+        result = dict(result, url=url_for("open_search_in_pubchem", cache_key=cache_key))
+    return result
+
+
+async def _structure_search(mode: str, query: str, operation: str) -> dict:
+    """Run a structure search, locally if possible; returns the search payload."""
+    labels = {
+        "substructure": "Substructure",
+        "superstructure": "Superstructure",
+        "similarity": "Similarity"
+    }
+    search_label = f"{labels[mode]}: {query[:25]}{'...' if len(query) > 25 else ''}"
+    loop = asyncio.get_running_loop()
+
+    # Local first: complete answers from the inventory's own structures
+    def run_local():
+        return local_structure_search(
+            mode, query, _inventory_cids(), load_compound_info().get("compounds", {})
+        )
+
+    try:
+        local = await loop.run_in_executor(None, run_local)
+    except ValueError as e:
+        return {"error": str(e)}
+    if local is not None:
+        cids, unsearched = local
+        logger.info("Local %s search: %d hits (%d CIDs without structure)", mode, len(cids), unsearched)
+        # An empty local result is still valid: none of our chemicals match
+        return await loop.run_in_executor(None, _save_local_search, cids, search_label, operation)
+
+    # No RDKit: ListKey-based PubChem search (doesn't download all CIDs)
+    result = await _pubchem_structure_search(mode, query)
+    if result is None:
+        return {"error": f"{mode.title()} search failed. Check that your SMILES is valid."}
+
+    cache_key = result.get("cache_key")
+    cid_count = result.get("count", 0)
+
+    if not cache_key:
+        if cid_count == 0:
+            return {"error": "No results found", "count": 0}
+        return {"error": "Failed to create search cache"}
+
+    # Save and return directly (we already have cache_key); the JSON stores
+    # and CID-set cache are file I/O, so keep them off the event loop
+    def save_remote():
+        save_app_search_with_metadata(cache_key, search_label, cid_count)
+        queue_cid_set_downloads([cache_key])
+
+    await loop.run_in_executor(None, save_remote)
+    return {
+        "success": True,
+        "cache_key": cache_key,
+        "query": search_label,
+        "count": cid_count,
+    }
+
+
+# --- Structure search jobs: run on one background event loop, polled by the UI ---
+_search_loop = None
+_search_loop_lock = threading.Lock()
+_search_jobs: dict[str, dict] = {}
+_search_jobs_lock = threading.Lock()
+
+
+def _search_event_loop() -> asyncio.AbstractEventLoop:
+    """The event loop search jobs run on, started on first use."""
+    global _search_loop
+    with _search_loop_lock:
+        if _search_loop is None:
+            _search_loop = asyncio.new_event_loop()
+            threading.Thread(target=_search_loop.run_forever, daemon=True).start()
+        return _search_loop
+
+
+def submit_search_job(mode: str, query: str, operation: str = "") -> dict:
+    """Start a structure search in the background and register it as a job."""
+    job = {
+        "id": uuid.uuid4().hex[:12],
+        "mode": mode,
+        "query": query,
+        "status": "running",
+        "created": time.time(),
+        "finished": None,
+        "result": None,
+    }
+
+    def on_done(future):
+        if future.cancelled():
+            job["status"] = "cancelled"
+        elif future.exception() is not None:
+            logger.error("search job %s failed: %r", job["id"], future.exception())
+            job["status"] = "failed"
+            job["result"] = {"error": f"Search failed: {future.exception()}"}
+        else:
+            job["result"] = future.result()
+            job["status"] = "done"
+        job["finished"] = time.time()
+
+    job["future"] = asyncio.run_coroutine_threadsafe(
+        _structure_search(mode, query, operation), _search_event_loop()
+    )
+    job["future"].add_done_callback(on_done)
+    with _search_jobs_lock:
+        now = time.time()
+        for job_id in [j for j, old in _search_jobs.items()
+                       if old["finished"] and now - old["finished"] > SEARCH_JOB_TTL]:
+            del _search_jobs[job_id]
+        _search_jobs[job["id"]] = job
+    logger.info("search job %s: %s search for %s", job["id"], mode, query[:40])
+    return job
+
+
+def _search_job_view(job: dict) -> dict:
+    end = job["finished"] or time.time()
+    view = {
+        "job_id": job["id"],
+        "mode": job["mode"],
+        "query": job["query"],
+        "status": job["status"],
+        "elapsed": round(end - job["created"], 1),
+    }
+    if job["result"] is not None:
+        view["result"] = _with_search_url(job["result"])
+    return view
+
+
+@app.route("/api/search-jobs", methods=["POST"])
+def create_search_job():
+    """Submit a structure search; poll GET /api/search-jobs/<id> for the result."""
+    data = request.get_json(silent=True) or {}
+    query = (data.get("query") or "").strip()
+    mode = data.get("mode", "substructure")
+    operation = (data.get("operation") or "").upper()
+    if not query:
+        return jsonify({"error": "No query provided"}), 400
+    if mode not in STRUCTURE_SEARCH_MODES:
+        return jsonify({"error": f"Unknown structure search mode: {mode}"}), 400
+    if operation not in ("", "AND", "OR", "NOT"):
+        return jsonify({"error": f"Invalid operation: {operation}. Use AND, OR, or NOT."}), 400
+    job = submit_search_job(mode, query, operation)
+    return jsonify(_search_job_view(job)), 202
+
+
+@app.route("/api/search-jobs")
+def list_search_jobs():
+    with _search_jobs_lock:
+        jobs = sorted(_search_jobs.values(), key=lambda j: j["created"], reverse=True)
+    return jsonify({"jobs": [_search_job_view(j) for j in jobs]})
+
+
+@app.route("/api/search-jobs/<job_id>")
+def get_search_job(job_id):
+    job = _search_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown search job"}), 404
+    return jsonify(_search_job_view(job))
+
+
+@app.route("/api/search-jobs/<job_id>", methods=["DELETE"])
+def cancel_search_job(job_id):
+    job = _search_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown search job"}), 404
+    if job["future"].cancel():
+        logger.info("search job %s cancelled", job_id)
+    return jsonify(_search_job_view(job))
+
+
 @app.route("/api/pubchem-search", methods=["POST"])
 def pubchem_search():
-    """Execute a PubChem search and return a cache key."""
+    """
+    Execute a PubChem search and return a cache key.
+
+    Name searches match the inventory's names locally unless "pubchem" is
+    set. Name and SMILES searches, and structure searches answered by the
+    local structure index, are kept locally under a local: key. With an
+    "operation" they are also combined with the inventory right away and the
+    response carries the filter_id; PubChem structure searches are combined
+    by the caller through /api/combine-pubchem. Structure searches block
+    here; the UI submits them through /api/search-jobs instead.
+    """
     from urllib.parse import quote
 
     data = request.get_json()
     query = data.get("query", "").strip() if data else ""
     mode = data.get("mode", "name") if data else "name"
+    operation = (data.get("operation") or "").upper() if data else ""
 
     if not query:
         return jsonify({"error": "No query provided"})
+    if operation not in ("", "AND", "OR", "NOT"):
+        return jsonify({"error": f"Invalid operation: {operation}. Use AND, OR, or NOT."})
 
     cids = None
     search_label = query  # Label for the search in history
 
-    if mode == "name":
+    if mode == "name" and not data.get("pubchem"):
+        # Names and CAS numbers of our own chemicals are matched locally;
+        # PubChem is only asked when the user wants all compounds
+        cids = name_search_cids(query, *_name_search_data())
+        if not len(cids):
+            if operation == "NOT":
+                # Excluding a name none of our chemicals have excludes nothing
+                return jsonify(_with_search_url(_save_local_search(cids, search_label, operation)))
+            return jsonify({"error": "No lab chemicals match this name. Toggle All PubChem to search PubChem.", "count": 0})
+
+    elif mode == "name":
         # Synchronous name/keyword search
         url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/name/{quote(query)}/cids/JSON"
         try:
@@ -3572,58 +3307,71 @@ def pubchem_search():
             return jsonify({"error": "Invalid response from PubChem"})
         search_label = f"SMILES: {query[:30]}{'...' if len(query) > 30 else ''}"
 
-    elif mode in ("substructure", "superstructure", "similarity"):
-        # Structure searches - use ListKey-based approach (doesn't download all CIDs)
-        result = _pubchem_structure_search(mode, query)
-        if result is None:
-            return jsonify({"error": f"{mode.title()} search failed. Check that your SMILES is valid."})
-
-        cache_key = result.get("cache_key")
-        cid_count = result.get("count", 0)
-
-        if not cache_key:
-            if cid_count == 0:
-                return jsonify({"error": "No results found", "count": 0})
-            return jsonify({"error": "Failed to create search cache"})
-
-        mode_labels = {
-            "substructure": "Substructure",
-            "superstructure": "Superstructure",
-            "similarity": "Similarity"
-        }
-        search_label = f"{mode_labels[mode]}: {query[:25]}{'...' if len(query) > 25 else ''}"
+    elif mode in STRUCTURE_SEARCH_MODES:
+        # Blocking variant of POST /api/search-jobs, kept for API clients
+        future = asyncio.run_coroutine_threadsafe(
+            _structure_search(mode, query, operation), _search_event_loop()
+        )
+        return jsonify(_with_search_url(future.result()))
 
-        # Save and return directly (we already have cache_key)
-        save_app_search_with_metadata(cache_key, search_label, cid_count)
-        return jsonify({
-            "success": True,
-            "cache_key": cache_key,
-            "query": search_label,
-            "count": cid_count,
-            "url": f"https://pubchem.ncbi.nlm.nih.gov/#query={cache_key}"
-        })
+    elif mode == "formula":
+        # Element composition query over the inventory, answered locally
+        try:
+            cids = _formula_search_cids(query)
+        except ValueError as e:
+            return jsonify({"error": str(e)})
+        search_label = f"Formula: {query[:30]}{'...' if len(query) > 30 else ''}"
 
     else:
         return jsonify({"error": f"Unknown search mode: {mode}"})
 
-    if not cids:
+    if not len(cids):
         return jsonify({"error": "No results found", "count": 0})
 
-    # Upload CIDs to get cache key (for name/smiles searches)
-    cache_key = upload_cids_to_pubchem_cache([str(c) for c in cids])
-    if not cache_key:
-        return jsonify({"error": "Failed to create search cache"})
+    return jsonify(_with_search_url(_save_local_search(cids, search_label, operation)))
 
-    # Save to app searches file with metadata
-    save_app_search_with_metadata(cache_key, search_label, len(cids))
 
-    return jsonify({
-        "success": True,
-        "cache_key": cache_key,
-        "query": search_label,
-        "count": len(cids),
-        "url": f"https://pubchem.ncbi.nlm.nih.gov/#query={cache_key}"
-    })
+@app.route("/api/batch-search", methods=["POST"])
+def batch_search_api():
+    """
+    Look up a list of names / CAS numbers / SMILES against the inventory.
+
+    Streams NDJSON: a "start" line, one "result" line (a batch report row)
+    per query as it completes, then a "done" line with the filter saved for
+    all matches together.
+    """
+    data = request.get_json(silent=True) or {}
+    queries = read_batch_queries(data.get("queries") or "")
+    if not queries:
+        return jsonify({"error": "No queries provided"})
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({"error": f"Too many queries ({len(queries)}), the limit is {BATCH_MAX_QUERIES}"})
+
+    rug_table = load_rug_table()
+    inventory = _inventory_cids()
+    if not rug_table or not inventory:
+        return jsonify({"error": "No CID results found. Complete setup first."})
+    by_cid = index_rows_by_cid(rug_table.get("rows", []))
+    label = f"Batch: {queries[0][:25]}{'...' if len(queries[0]) > 25 else ''} (+{len(queries) - 1})" \
+        if len(queries) > 1 else f"Batch: {queries[0][:30]}"
+
+    def generate():
+        yield json.dumps({"event": "start", "total": len(queries)}) + "\n"
+        matched = []
+        for result in batch_search(queries, inventory):
+            matched.extend(result["matches"])
+            row = batch_report_row(result, by_cid)
+            yield json.dumps({"event": "result", "index": result["index"], "row": row}) + "\n"
+        cids = cid_array(matched)
+        filter_id = save_filter_result(label, "BATCH", cids)
+        logger.info("batch search: %d queries, %d matching CIDs", len(queries), len(cids))
+        yield json.dumps({"event": "done", "filter_id": filter_id, "match_count": len(cids)}) + "\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.route("/api/mark-stale-search", methods=["POST"])
@@ -3744,8 +3492,8 @@ def apply_repairs():
 
     # Load current data
     from extract_chemicals import load_rug_table, RUG_TABLE_FILE
-    rug_table = load_rug_table()
-    cid_cache = load_cid_cache()
+    rug_table = copy.deepcopy(load_rug_table())
+    cid_cache = copy.deepcopy(load_cid_cache())
     if not rug_table or not cid_cache:
         return jsonify({"error": "Data not found"}), 404
 
@@ -3787,7 +3535,7 @@ def apply_repairs():
         applied_count += 1
 
     # Save rug_table directly (preserves row metadata)
-    RUG_TABLE_FILE.write_text(json.dumps(rug_table, indent=2, default=str))
+    write_json_file(RUG_TABLE_FILE, rug_table, default=str)
 
     # Save updated cache
     save_cid_cache(
@@ -3800,7 +3548,7 @@ def apply_repairs():
     pending_file.unlink()
 
     # Trigger compound info fetch for new CIDs
-    start_compound_info_fetch(force=False)
+    start_compound_info_fetch()
 
     return jsonify({
         "success": True,
@@ -3851,14 +3599,14 @@ def _do_import_database(bundle):
     DATA_DIR.mkdir(parents=True, exist_ok=True)
 
     # Write cid_cache
-    CID_CACHE_FILE.write_text(json.dumps(cid_cache, indent=2, default=str))
+    write_json_file(CID_CACHE_FILE, cid_cache, default=str)
 
     # Write rug_table
-    RUG_TABLE_FILE.write_text(json.dumps(rug_table, indent=2, default=str))
+    write_json_file(RUG_TABLE_FILE, rug_table, default=str)
 
     # Write compound_info if present
     if compound_info:
-        COMPOUND_INFO_FILE.write_text(json.dumps(compound_info, indent=2, default=str))
+        write_json_file(COMPOUND_INFO_FILE, compound_info, default=str)
 
     # Create dummy snapshot + latest.txt pointer so setup detects a valid state
     SNAPSHOTS_DIR.mkdir(parents=True, exist_ok=True)
@@ -4105,9 +3853,17 @@ if __name__ == "__main__":
     parser.add_argument("--host", default="127.0.0.1", help="Host to bind to (default: 127.0.0.1)")
     parser.add_argument("--debug", action="store_true", help="Run in debug mode")
     parser.add_argument("--no-browser", action="store_true", help="Don't auto-open browser")
+    parser.add_argument(
+        "--refresh-budget", type=int, default=COMPOUND_REFRESH_BUDGET,
+        help=f"Max PubChem requests per stale compound info refresh cycle, 0 disables (default: {COMPOUND_REFRESH_BUDGET})",
+    )
 
     args = parser.parse_args()
 
+    # Only start background threads in the serving process (not the reloader parent)
+    if not args.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_refresh_scheduler(args.refresh_budget)
+
     url = f"http://{args.host}:{args.port}"
     print(f"\n  Chemical Search Web UI")
     print(f"  Running at: {url}\n")